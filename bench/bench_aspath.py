@@ -0,0 +1,53 @@
+#!/usr/bin/python
+
+# Memory held by decoded AS paths: segments as arrays of 32-bit AS numbers
+# against the lists of ints they used to be, for a table of paths with
+# 4-byte AS numbers in them.
+#
+#   python bench/bench_aspath.py [paths] [path length]
+
+import random
+import sys
+import time
+
+from pybgp import pathattr
+
+def deep(value, seen):
+    # size of a list of segments, counting every object reached once
+    total = sys.getsizeof(value)
+    for seg in value:
+        total += sys.getsizeof(seg)
+        if isinstance(seg, list):
+            for asnum in seg:
+                if id(asnum) not in seen:
+                    seen.add(id(asnum))
+                    total += sys.getsizeof(asnum)
+    return total
+
+def main(count, length):
+    rand = random.Random(1)
+    wires = []
+    for i in xrange(count):
+        path = [rand.choice((rand.randrange(1, 64512), rand.randrange(131072, 4200000000)))
+                for j in xrange(length)]
+        wires.append(pathattr.AsPath([path]).encode(True))
+
+    start = time.time()
+    paths = [pathattr.decode(b, 0, True)[1] for b in wires]
+    elapsed = time.time() - start
+
+    seen = set()
+    arrays = sum([deep(p.value, seen) for p in paths])
+    # kept alive while measuring, so no ids are reused
+    plain = [[list(seg) for seg in p.value] for p in paths]
+    seen = set()
+    lists = sum([deep(value, seen) for value in plain])
+
+    print '%d paths of %d AS numbers, %.2f usec/decode' % (count, length, elapsed / count * 1e6)
+    print '%-8s %10d bytes' % ('lists', lists)
+    print '%-8s %10d bytes (%.0f%%)' % ('arrays', arrays, 100.0 * arrays / lists)
+
+if __name__=='__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    main(count, length)
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+# Filtering a table by "has any of these communities": parsing the raw
+# attribute per route, as policy code had to, against the Communities
+# codec on interned attributes with pathattr.having_any().
+#
+#   python bench/bench_communities.py [routes] [distinct sets]
+
+import struct
+import sys
+import time
+
+from pybgp import pathattr
+
+def table(count, distinct):
+    interner = pathattr.Interner()
+    routes = []
+    for i in xrange(count):
+        n = i % distinct
+        c = pathattr.Communities(['65000:%d' % (n % 300 + j,) for j in range(8)] + ['no-export'])
+        aset, mp = interner.intern_block(pathattr.Origin('igp').encode() + c.encode())
+        routes.append((i, aset))
+    return routes
+
+def raw(attrs):
+    # what a caller had to do before: unpack the opaque attribute value
+    b = attrs['communities'].encode()[3:]
+    return struct.unpack('!%dI' % (len(b) // 4,), b)
+
+def main(count, distinct):
+    routes = table(count, distinct)
+    wanted = pathattr.community_set(['65000:299', '65000:300'])
+
+    start = time.time()
+    naive = [k for k, a in routes if wanted.intersection(raw(a))]
+    elapsed = time.time() - start
+    print '%-12s %8.3f usec/route %d matched' % ('unpacked', elapsed / count * 1e6, len(naive))
+
+    start = time.time()
+    fast = [k for k, a in pathattr.having_any(routes, wanted)]
+    elapsed = time.time() - start
+    print '%-12s %8.3f usec/route %d matched' % ('having_any', elapsed / count * 1e6, len(fast))
+
+    assert naive==fast
+
+if __name__=='__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    main(count, distinct)
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+# Decoding an UPDATE corpus with the old odict.OrderedDict attribute
+# container and with ordered.OrderedMap. Each run happens in its own
+# process, keeping every decoded message alive, so peak RSS shows the
+# allocation cost alongside the decode time.
+#
+#   python bench/bench_decode.py [updates]
+
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from pybgp import proto, pathattr, nlri, odict
+
+def corpus(count):
+    up = proto.Update(
+        pathattr.Origin('igp'),
+        pathattr.AsPath([[65000, 3356, 1299]]),
+        pathattr.NextHop('192.168.1.1'),
+        pathattr.Med(0),
+        pathattr.LocalPref(100),
+        nlri=['10.0.0.0/24'],
+        )
+    # distinct messages, so nothing is shared between the decoded copies
+    head = up.encode()[:-4]
+    return [head + nlri.ipv4.from_int((i + 1) << 8, 24).encode() for i in xrange(count)]
+
+def run(container, count):
+    if container=='odict':
+        proto.OrderedMap = odict.OrderedDict
+
+    msgs = corpus(count)
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    kept = [proto.Update.from_bytes(b) for b in msgs]
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print '%-12s %8.2f usec/update %8d KiB peak RSS growth' % (
+            container, elapsed / count * 1e6, after - before)
+
+def main(count):
+    for container in ('odict', 'OrderedMap'):
+        subprocess.check_call([sys.executable, __file__, '--container', container,
+            str(count)], env=os.environ)
+
+if __name__=='__main__':
+    args = sys.argv[1:]
+    container = None
+    if args[:1]==['--container']:
+        container = args[1]
+        args = args[2:]
+    count = int(args[0]) if args else 1000000
+
+    if container:
+        run(container, count)
+    else:
+        main(count)
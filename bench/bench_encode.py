@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+# Cold versus warm UPDATE encoding: the same attribute set sent to many
+# peers and for many prefixes, with and without frozen attributes.
+#
+#   python bench/bench_encode.py [count]
+
+import sys
+import time
+
+from pybgp import proto, pathattr, nlri
+
+def attrs():
+    return [
+        pathattr.Origin('igp'),
+        pathattr.AsPath([[65000, 65001, 65002]]),
+        pathattr.NextHop('192.168.1.1'),
+        pathattr.Med(10),
+        pathattr.LocalPref(100),
+        pathattr.ExtCommunity(['RT:65000:1', 'RT:192.168.0.1:2']),
+        ]
+
+def timed(name, count, fn):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    print '%-40s %8.2f usec/encode' % (name, elapsed / count * 1e6)
+
+def main(count):
+    prefixes = [nlri.ipv4.from_int(0x0a000000 + (i << 8), 24) for i in range(count)]
+
+    cold = attrs()
+    warm = [a.freeze() for a in attrs()]
+
+    def fanout(a):
+        up = proto.Update(nlri=prefixes[:1], *a)
+        def run():
+            for i in xrange(count):
+                up.encode()
+        return run
+
+    def per_prefix(a):
+        def run():
+            for p in prefixes:
+                proto.Update(nlri=[p], *a).encode()
+        return run
+
+    print '%d encodes each' % (count,)
+    timed('one update to many peers, cold', count, fanout(cold))
+    timed('one update to many peers, warm', count, fanout(warm))
+    timed('one update per prefix, cold', count, per_prefix(cold))
+    timed('one update per prefix, warm', count, per_prefix(warm))
+
+if __name__=='__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(100000)
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+
+# Measures the per-message cost of framing and decoding when a peer delivers
+# a whole burst of UPDATEs in a single read. With linear framing the
+# cost per message should stay flat as the burst grows.
+#
+#   python bench/bench_framing.py [size-in-MB ...]
+
+import sys
+import time
+
+from pybgp import session, proto, pathattr
+
+def burst(size):
+    up = proto.Update(
+            pathattr.Origin('igp'),
+            pathattr.AsPath([[65000]]),
+            pathattr.NextHop('192.168.1.1'),
+            nlri=['10.%d.%d.0/24' % (i>>8, i&0xff) for i in range(16)],
+            )
+    body = up.encode()
+    msg = session.HEADER.pack(session.MARKER, 19+len(body), up.number) + body
+
+    count = size // len(msg)
+    return msg * count, count
+
+def run(mb):
+    data, count = burst(mb * 1024 * 1024)
+
+    s = session.Session()
+
+    start = time.time()
+    msgs = s.receive_data(data)
+    elapsed = time.time() - start
+
+    assert len(msgs)==count and not s.closing
+    return count, elapsed
+
+def main(sizes):
+    print '%8s %10s %10s %12s' % ('MB', 'messages', 'seconds', 'usec/msg')
+    for mb in sizes:
+        count, elapsed = run(mb)
+        print '%8d %10d %10.2f %12.2f' % (mb, count, elapsed, elapsed / count * 1e6)
+
+if __name__=='__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [1, 10, 100]
+    main(sizes)
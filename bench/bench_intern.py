@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+# Decoding a synthetic full table with and without a path attribute
+# Interner: many UPDATEs sharing a few thousand distinct attribute sets.
+# Each mode runs in its own process so peak RSS can be compared.
+#
+#   python bench/bench_intern.py [updates] [distinct sets]
+
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from pybgp import proto, pathattr, nlri
+
+def table(count, distinct):
+    msgs = []
+    for i in xrange(count):
+        n = i % distinct
+        up = proto.Update(
+            pathattr.Origin('igp'),
+            pathattr.AsPath([[65000, 64512 + n % 1000, 3356, 1299 + n]]),
+            pathattr.NextHop('192.168.%d.1' % (n % 8)),
+            pathattr.Med(n % 50),
+            pathattr.LocalPref(100),
+            nlri=[nlri.ipv4.from_int((i + 1) << 8, 24)],
+            )
+        msgs.append(up.encode())
+    return msgs
+
+def run(mode, count, distinct):
+    msgs = table(count, distinct)
+    interner = None
+    if mode=='interned':
+        interner = pathattr.Interner()
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    kept = []
+    for b in msgs:
+        up = proto.Update.from_bytes(b, interner)
+        if interner is not None:
+            interner.acquire(up.attrset)
+        kept.append(up)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print '%-10s %8.2f usec/update %8d KiB peak RSS growth' % (
+            mode, elapsed / count * 1e6, after - before)
+    if interner is not None:
+        print '           %r' % (interner.stats(),)
+
+def main(count, distinct):
+    for mode in ('plain', 'interned'):
+        subprocess.check_call([sys.executable, __file__, '--mode', mode,
+            str(count), str(distinct)], env=os.environ)
+
+if __name__=='__main__':
+    args = sys.argv[1:]
+    mode = None
+    if args[:1]==['--mode']:
+        mode = args[1]
+        args = args[2:]
+    count = int(args[0]) if args else 200000
+    distinct = int(args[1]) if len(args) > 1 else 2000
+
+    if mode:
+        run(mode, count, distinct)
+    else:
+        main(count, distinct)
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+# Sorting, set membership and encoding of IPv4 prefixes, comparing
+# nlri.ipv4 with the string-backed class it replaced.
+#
+#   python bench/bench_ipv4.py [count]
+
+import random
+import socket
+import struct
+import sys
+import time
+
+from pybgp import nlri
+
+class legacy_ipv4:
+    # nlri.ipv4 as it was: the prefix held as a dotted string
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __cmp__(self, other):
+        if isinstance(other, legacy_ipv4):
+            aip, alen = self.prefix.split('/')
+            alen = int(alen)
+            aip = socket.inet_aton(aip)
+
+            bip, blen = other.prefix.split('/')
+            blen = int(blen)
+            bip = socket.inet_aton(bip)
+
+            return cmp((aip,alen),(bip,blen))
+
+        return -1
+
+    def __hash__(self):
+        return hash(self.prefix)
+
+    def encode(self):
+        ip, masklen = self.prefix.split('/')
+        ip = socket.inet_aton(ip)
+        masklen = int(masklen)
+        return struct.pack('B', masklen) + ip[:nlri.pb(masklen)]
+
+def prefixes(count):
+    random.seed(1)
+    rv = []
+    for i in range(count):
+        masklen = random.randint(8, 32)
+        ip = random.getrandbits(32) & (0xffffffff << (32 - masklen))
+        rv.append(nlri.fmt(ip, masklen))
+    return rv
+
+def timed(fn):
+    start = time.time()
+    fn()
+    return time.time() - start
+
+def run(name, klass, strings):
+    objs = [klass(s) for s in strings]
+    probe = [klass(s) for s in strings[::10]]
+    table = set(objs)
+
+    def lookup():
+        for p in probe:
+            p in table
+
+    def encode():
+        for p in objs:
+            p.encode()
+
+    print '%-8s sort %6.2fs  member %6.2fs  encode %6.2fs  encode again %6.2fs' % (
+            name,
+            timed(lambda: sorted(objs)),
+            timed(lookup),
+            timed(encode),
+            timed(encode),
+            )
+
+def main(count):
+    strings = prefixes(count)
+    print '%d prefixes, %d membership probes' % (count, count // 10)
+
+    run('legacy', legacy_ipv4, strings)
+    run('ipv4', nlri.ipv4, strings)
+
+if __name__=='__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(1000000)
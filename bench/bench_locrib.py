@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+# Loc-RIB convergence and churn: every peer sends the same full table with
+# its own AS paths, then single-prefix UPDATEs flap routes on one peer.
+#
+#   python bench/bench_locrib.py [prefixes] [peers] [churn updates]
+
+import random
+import sys
+import time
+
+from pybgp import proto, pathattr, nlri, rib
+
+PER_UPDATE = 4
+
+def feed(peer, count, rand):
+    msgs = []
+    for i in xrange(0, count, PER_UPDATE):
+        up = proto.Update(
+            pathattr.Origin('igp'),
+            pathattr.AsPath([[65000 + peer] + [rand.randrange(1, 64000) for j in range(rand.randrange(1, 5))]]),
+            pathattr.NextHop('192.168.0.%d' % (peer + 1,)),
+            pathattr.Med(rand.randrange(3)),
+            nlri=[nlri.ipv4.from_int((i + j + 1) << 8, 24) for j in range(PER_UPDATE)],
+            )
+        msgs.append(up.encode())
+    return msgs
+
+def main(count, npeers, nchurn):
+    rand = random.Random(1)
+    loc = rib.LocRib()
+
+    names = []
+    feeds = []
+    for p in range(npeers):
+        name = '192.168.0.%d' % (p + 1,)
+        loc.add_peer(name, name, ebgp=True)
+        names.append(name)
+        feeds.append(feed(p, count, rand))
+
+    start = time.time()
+    changes = 0
+    for name, msgs in zip(names, feeds):
+        for b in msgs:
+            changes += len(loc.apply(name, proto.Update.from_bytes(b, loc.interner)))
+    elapsed = time.time() - start
+    print '%d prefixes from %d peers converged in %.2f sec (%d best path changes)' % (
+            len(loc), npeers, elapsed, changes)
+
+    churn = []
+    for i in xrange(nchurn):
+        prefix = nlri.ipv4.from_int((rand.randrange(count) + 1) << 8, 24)
+        if i % 2:
+            up = proto.Update(withdraw=[prefix])
+        else:
+            up = proto.Update(
+                pathattr.Origin('igp'),
+                pathattr.AsPath([[65000, rand.randrange(1, 64000)]]),
+                pathattr.NextHop('192.168.0.1'),
+                nlri=[prefix],
+                )
+        churn.append(up.encode())
+
+    start = time.time()
+    for b in churn:
+        loc.apply(names[0], proto.Update.from_bytes(b, loc.interner))
+    elapsed = time.time() - start
+    print '%.2f usec per churn UPDATE' % (elapsed / nchurn * 1e6,)
+
+if __name__=='__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    npeers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    nchurn = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+    main(count, npeers, nchurn)
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+# Pushes UPDATEs from one speaker to another over a loopback TCP connection
+# and reports session throughput, once with the asyncio speaker and once with
+# the Twisted one.
+#
+#   python bench/bench_loopback.py [count]
+
+import sys
+import time
+
+from pybgp import proto, pathattr
+
+def updates(count):
+    rv = []
+    for i in range(count):
+        rv.append(proto.Update(
+            pathattr.Origin('igp'),
+            pathattr.AsPath([[65000]]),
+            pathattr.NextHop('192.168.1.1'),
+            nlri=['10.%d.%d.0/24' % ((i>>8)&0xff, i&0xff)],
+            ))
+    return rv
+
+def report(name, count, elapsed):
+    print '%-8s %8d updates %8.2f s %10.0f updates/s' % (name, count, elapsed, count / elapsed)
+
+def run_asyncio(msgs):
+    from pybgp import aio
+    asyncio = aio.asyncio
+
+    loop = asyncio.new_event_loop()
+    done = asyncio.Future(loop=loop)
+    state = {}
+
+    class Receiver(aio.BGP):
+        def handle_msg(self, msg):
+            state['n'] = state.get('n', 0) + 1
+            if state['n']==len(msgs):
+                done.set_result(time.time())
+
+    class Sender(aio.BGP):
+        def connection_made(self, transport):
+            aio.BGP.connection_made(self, transport)
+            state['start'] = time.time()
+            self.send_many(msgs)
+
+    server = loop.run_until_complete(
+            loop.create_server(lambda: Receiver(loop), '127.0.0.1', 0))
+    port = server.sockets[0].getsockname()[1]
+    loop.run_until_complete(
+            loop.create_connection(lambda: Sender(loop), '127.0.0.1', port))
+
+    end = loop.run_until_complete(done)
+    server.close()
+    loop.close()
+
+    return end - state['start']
+
+def run_twisted(msgs):
+    from twisted.internet import reactor, protocol
+    from pybgp import speaker
+
+    state = {}
+
+    class Quiet(speaker.BGP):
+        def connectionLost(self, reason):
+            # the reactor drops both ends on shutdown; don't log that
+            self._cancel()
+
+    class Receiver(Quiet):
+        def handle_msg(self, msg):
+            state['n'] = state.get('n', 0) + 1
+            if state['n']==len(msgs):
+                state['end'] = time.time()
+                reactor.stop()
+
+    class Sender(Quiet):
+        def connectionMade(self):
+            speaker.BGP.connectionMade(self)
+            state['start'] = time.time()
+            self.send_many(msgs)
+
+    f = protocol.ServerFactory()
+    f.protocol = Receiver
+    port = reactor.listenTCP(0, f, interface='127.0.0.1')
+    protocol.ClientCreator(reactor, Sender).connectTCP('127.0.0.1', port.getHost().port)
+    reactor.run()
+
+    return state['end'] - state['start']
+
+def main(count):
+    msgs = updates(count)
+
+    report('asyncio', count, run_asyncio(msgs))
+    # the Twisted reactor cannot be restarted, so it goes last
+    report('twisted', count, run_twisted(msgs))
+
+if __name__=='__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(100000)
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+# Memory held by an AdjRibIn per million routes: a synthetic full table of
+# IPv4 UPDATEs, a few prefixes each, over a few thousand distinct
+# attribute sets, decoded with the RIB's interner and applied. Runs in a
+# child process so peak RSS growth covers the table alone.
+#
+#   python bench/bench_rib.py [routes] [distinct sets]
+
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from pybgp import proto, pathattr, nlri, rib
+
+PER_UPDATE = 4
+
+def table(count, distinct):
+    msgs = []
+    for i in xrange(0, count, PER_UPDATE):
+        n = (i // PER_UPDATE) % distinct
+        up = proto.Update(
+            pathattr.Origin('igp'),
+            pathattr.AsPath([[65000, 64512 + n % 1000, 3356, 1299 + n]]),
+            pathattr.NextHop('192.168.%d.1' % (n % 8)),
+            pathattr.Med(n % 50),
+            pathattr.Communities(['65000:%d' % (n % 100,)]),
+            nlri=[nlri.ipv4.from_int((i + j + 1) << 8, 24) for j in range(PER_UPDATE)],
+            )
+        msgs.append(up.encode())
+    return msgs
+
+def run(count, distinct):
+    msgs = table(count, distinct)
+    r = rib.AdjRibIn()
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    for b in msgs:
+        r.apply(proto.Update.from_bytes(b, r.interner))
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    growth = (after - before) * 1024.0
+    print '%d routes, %d attribute sets' % (len(r), r.stats()['sets'])
+    print '%8.2f usec/route applied' % (elapsed / len(r) * 1e6,)
+    print '%8.1f bytes/route, %.1f MiB per million routes' % (
+            growth / len(r), growth / len(r) * 1e6 / 2**20)
+
+    start = time.time()
+    r.flush()
+    print '%8.3f sec to flush' % (time.time() - start,)
+
+def main(count, distinct):
+    subprocess.check_call([sys.executable, __file__, '--run',
+        str(count), str(distinct)], env=os.environ)
+
+if __name__=='__main__':
+    args = sys.argv[1:]
+    child = args[:1]==['--run']
+    if child:
+        args = args[1:]
+    count = int(args[0]) if args else 1000000
+    distinct = int(args[1]) if len(args) > 1 else 5000
+
+    if child:
+        run(count, distinct)
+    else:
+        main(count, distinct)
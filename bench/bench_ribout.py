@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+# Sending churn to many peers: a table of prefixes is advertised to every
+# peer, then single prefixes flap, with an update round after each change.
+# Compares diffing the whole table against what each peer was sent (as
+# examples/dnsanycast used to) with an AdjRibOut per peer, which only
+# looks at the prefixes changed since its last round. Then the cost of
+# answering a ROUTE-REFRESH for the whole table, packing and encoding it
+# afresh against replaying the bodies the AdjRibOut keeps.
+#
+#   python bench/bench_ribout.py [prefixes] [peers] [rounds]
+
+import random
+import sys
+import time
+
+from pybgp import pathattr, nlri, packer, rib
+
+ATTRS = [
+    pathattr.Origin('incomplete'),
+    pathattr.Med(0),
+    pathattr.AsPath([[65001]]),
+    pathattr.NextHop('192.168.1.2'),
+    ]
+for a in ATTRS:
+    a.freeze()
+
+def flaps(prefixes, rounds):
+    rand = random.Random(1)
+    return [rand.choice(prefixes) for i in range(rounds)]
+
+def diff(prefixes, npeers, changes):
+    current = dict.fromkeys(prefixes, True)
+    sent = [set() for i in range(npeers)]
+
+    def send(routes):
+        p = packer.Packer()
+        for route in current:
+            if route not in routes:
+                routes.add(route)
+                p.advertise(route, ATTRS)
+        gone = [route for route in routes if route not in current]
+        for route in gone:
+            routes.remove(route)
+            p.withdraw(route)
+        return p.updates()
+
+    for routes in sent:
+        send(routes)
+
+    start = time.time()
+    for prefix in changes:
+        if prefix in current:
+            del current[prefix]
+        else:
+            current[prefix] = True
+        for routes in sent:
+            send(routes)
+    return time.time() - start
+
+def ribout(prefixes, npeers, changes):
+    current = dict.fromkeys(prefixes, True)
+    peers = [rib.AdjRibOut() for i in range(npeers)]
+
+    for out in peers:
+        for prefix in prefixes:
+            out.advertise(prefix, ATTRS)
+        out.updates()
+
+    start = time.time()
+    for prefix in changes:
+        if prefix in current:
+            del current[prefix]
+            for out in peers:
+                out.withdraw(prefix)
+        else:
+            current[prefix] = True
+            for out in peers:
+                out.advertise(prefix, ATTRS)
+        for out in peers:
+            out.updates()
+    return time.time() - start
+
+def refresh(prefixes):
+    out = rib.AdjRibOut()
+    for prefix in prefixes:
+        out.advertise(prefix, ATTRS)
+    out.updates()
+
+    start = time.time()
+    first = out.replay()
+    packed = time.time() - start
+
+    start = time.time()
+    again = out.replay()
+    replayed = time.time() - start
+    return len(first), packed, replayed
+
+def main(count, npeers, rounds):
+    prefixes = [nlri.ipv4.from_int((i + 1) << 8, 24) for i in xrange(count)]
+    changes = flaps(prefixes, rounds)
+
+    print '%d prefixes, %d peers, %d rounds' % (count, npeers, rounds)
+    for name, func in (('full diff', diff), ('AdjRibOut', ribout)):
+        elapsed = func(prefixes, npeers, changes)
+        print '%-10s %10.1f usec/round' % (name, elapsed / rounds * 1e6)
+
+    msgs, packed, replayed = refresh(prefixes)
+    print 'refresh: %d UPDATEs, %.1f msec packed, %.3f msec replayed' % (
+            msgs, packed * 1e3, replayed * 1e3)
+
+if __name__=='__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    count = args[0] if args else 100000
+    npeers = args[1] if len(args) > 1 else 20
+    rounds = args[2] if len(args) > 2 else 20
+    main(count, npeers, rounds)
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+
+# A Trie holding a full table: memory per prefix (peak RSS growth, in a
+# child process so it covers the trie alone), insert rate, and longest-
+# prefix match rate for random addresses. Prefixes are a mix of /16 to /24
+# like a real table, with one shared value.
+#
+#   python bench/bench_trie.py [prefixes]
+
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from pybgp import trie
+
+def table(count):
+    rand = random.Random(1)
+    prefixes = set()
+    while len(prefixes) < count:
+        masklen = rand.choice((16, 19, 20, 21, 22, 23, 24, 24, 24, 24))
+        ip = rand.getrandbits(32) & trie.MASKS[masklen]
+        prefixes.add((ip, masklen))
+    return list(prefixes)
+
+def run(count):
+    prefixes = table(count)
+    addrs = [random.getrandbits(32) for i in xrange(100000)]
+
+    t = trie.Trie()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    for ip, masklen in prefixes:
+        t.insert(ip, masklen, True)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    growth = (after - before) * 1024.0
+    print '%d prefixes, %d nodes' % (len(t), t.nodes())
+    print '%8.2f usec/prefix inserted' % (elapsed / count * 1e6,)
+    print '%8.1f bytes/prefix, %.1f MiB in all' % (growth / count, growth / 2**20)
+
+    start = time.time()
+    for a in addrs:
+        t.lookup(a)
+    print '%8.2f usec/lookup' % ((time.time() - start) / len(addrs) * 1e6,)
+
+    start = time.time()
+    for ip, masklen in prefixes:
+        t.remove(ip, masklen)
+    print '%8.2f usec/prefix removed' % ((time.time() - start) / count * 1e6,)
+
+def main(count):
+    subprocess.check_call([sys.executable, __file__, '--run', str(count)],
+        env=os.environ)
+
+if __name__=='__main__':
+    args = sys.argv[1:]
+    child = args[:1]==['--run']
+    if child:
+        args = args[1:]
+    count = int(args[0]) if args else 1000000
+
+    if child:
+        run(count)
+    else:
+        main(count)
@@ -0,0 +1,140 @@
+import logging
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from pybgp import proto, exceptions, session
+
+log = logging.getLogger(__name__)
+
+class BGP(asyncio.Protocol, proto.ProtoBase):
+    """asyncio adapter around a session.Session.
+
+    The counterpart of speaker.BGP for asyncio event loops: received data is
+    fed to the session and the decoded messages passed to handle_msg();
+    queued output is handed to transport.writelines() in one go, and a
+    single loop.call_at() handle tracks the session's next deadline. As
+    with speaker.BGP, the "update_class" and "interner" of a subclass (or
+    set before the connection is made) are handed on to the session.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.transport = None
+        self.session = None
+        self.timer = None
+        self.timer_at = None
+        self.dropped = False
+        self.closed = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.session = session.Session(clock=self.loop.time)
+        self.session.update_class = self.update_class
+        self.session.interner = self.interner
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            log.error('connection lost: %s', exc)
+        self._cancel()
+        if self.closed:
+            self.closed(exc)
+
+    def data_received(self, data):
+        msgs = self.session.receive_data(data)
+        if msgs:
+            if self.handle_msgs is not None:
+                self.handle_msgs(msgs)
+            else:
+                for msg in msgs:
+                    self.handle_msg(msg)
+        self._flush()
+
+    @property
+    def buffer(self):
+        s = self.session
+        return s.buffer[s.offset:]
+
+    @property
+    def holdtime(self):
+        return self.session.holdtime
+
+    @property
+    def max_len(self):
+        return self.session.max_len
+
+    @property
+    def asn4(self):
+        return self.session.asn4
+
+    def open(self, asnum, bgpid, holdtime=60, **caps):
+        self.session.open(asnum, bgpid, holdtime, **caps)
+        self._flush()
+
+    def notify(self, ex):
+        self.session.notify(ex)
+        self._flush()
+
+    def send(self, msg):
+        self.session.send(msg)
+        self._flush()
+
+    def send_many(self, msgs):
+        self.session.send_many(msgs)
+        self._flush()
+
+    def handle_msg(self, msg):
+        pass
+
+    # set to a callable (or override) to receive every message decoded from
+    # one read as a single list, instead of one handle_msg() call each
+    handle_msgs = None
+
+    def start_timer(self, holdtime):
+        self.session.start_timer(holdtime)
+        self._service()
+
+    def send_keepalive(self):
+        self.send(proto.Keepalive())
+
+    def _service(self):
+        self.timer = None
+        self.timer_at = None
+        self.session.tick()
+        self._flush()
+
+    def _flush(self):
+        s = self.session
+
+        data = s.data_to_send()
+        if data:
+            self.transport.writelines(data)
+
+        if s.closing:
+            self._cancel()
+            if self.dropped:
+                return
+            self.dropped = True
+            if isinstance(s.reason, exceptions.BgpExc):
+                if s.reason.send_error:
+                    log.info('sent notify %s', s.reason)
+            else:
+                log.info('%s', s.reason)
+            log.info('disconnecting')
+            self.transport.close()
+            return
+
+        deadline = s.next_deadline()
+        if deadline!=self.timer_at:
+            self._cancel()
+            if deadline is not None:
+                self.timer = self.loop.call_at(deadline, self._service)
+                self.timer_at = deadline
+
+    def _cancel(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+            self.timer_at = None
@@ -36,3 +36,27 @@ class BadMsg(BgpExc):
     def __str__(self):
         return '<BadMsg %d>' % (self.msg,)
 
+class BadOpen(BgpExc):
+    # OPEN message error with no more specific subcode, as for malformed
+    # optional parameters and capabilities
+    code = 2
+    subcode = 0
+
+    def __init__(self, reason):
+        self.reason = reason
+
+    def __str__(self):
+        return '<BadOpen %s>' % (self.reason,)
+
+class BadRefreshLen(BgpExc):
+    # RFC 7313 ROUTE-REFRESH message error, invalid message length
+    code = 7
+    subcode = 1
+
+    def __init__(self, payload):
+        # the data is the whole offending message, header included
+        self.len = 19 + len(payload)
+        self.data = '\xff'*16 + struct.pack('!HB', self.len, 5) + payload
+
+    def __str__(self):
+        return '<BadRefreshLen %d>' % (self.len,)
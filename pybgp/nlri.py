@@ -3,16 +3,15 @@ import array
 import struct
 import socket
 
-from odict import OrderedDict as OD
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-class NLRI:
-    def __init__(self, afi, safi, val):
-        self.afi = afi
-        self.safi = safi
-        self.val = val
 
-    def encode(self):
-        return self.val
+class NLRI(object):
+    # no per-instance dict unless a subclass wants one; see ipv4
+    __slots__ = ()
 
 class vpnv4(NLRI):
     def __init__(self, labels, rd, prefix):
@@ -39,23 +38,31 @@ class vpnv4(NLRI):
                     )
         return -1
 
+    def __hash__(self):
+        # labels are left out so that equal routes hash equally; as they
+        # take part in comparisons, the same route with other labels is
+        # still a different key, and whatever keys routes by rd and prefix
+        # alone has to use (rd, prefix) itself
+        return hash((self.rd, self.prefix))
 
     def encode(self):
         plen = 0
         v = ''
-        labels = self.labels[:]
-
-        if not labels:
-            return '\0'
 
-        labels = [l<<4 for l in labels]
-        labels[-1] |= 1
-
-        for l in labels:
-            lo = l & 0xff
-            hi = (l & 0xffff00) >> 8
-            v += struct.pack('>HB', hi, lo)
+        if not self.labels:
+            # no labels, as for (and decoded from) withdraws: the special
+            # null label stands in for the stack vpnv4 always carries
+            v += '\x80\x00\x00'
             plen += 24
+        else:
+            labels = [l<<4 for l in self.labels]
+            labels[-1] |= 1
+
+            for l in labels:
+                lo = l & 0xff
+                hi = (l & 0xffff00) >> 8
+                v += struct.pack('>HB', hi, lo)
+                plen += 24
 
         l, r = self.rd.split(':')
         if '.' in l:
@@ -87,13 +94,15 @@ class vpnv4(NLRI):
 
     @classmethod
     def from_bytes(cls, plen, val):
+        return cls.from_buffer(val, 0, plen)
+
+    @classmethod
+    def from_buffer(cls, val, idx, plen):
 
         if plen==0:
             # what the hell?
             return cls([], '0:0', '0.0.0.0/0')
 
-        idx = 0
-
         # plen is the length, in bits, of all the MPLS labels, plus the 8-byte RD, plus the IP prefix
         labels = []
         while True:
@@ -125,53 +134,81 @@ class vpnv4(NLRI):
         idx += 8
         plen -= 64
 
-        ipl = pb(plen)
-        ip = val[idx:idx+ipl]
-        idx += ipl
-
-        prefix = pip(ip, plen)
+        prefix = fmt(unpack_addr(val, idx, plen), plen)
 
         return cls(labels, rd, prefix)
 
 class ipv4(NLRI):
+    """An IPv4 prefix, held as a 32-bit int "ip" and a "masklen".
+
+    The dotted-quad "prefix" string and the wire encoding are worked out
+    the first time they are needed and kept.
+    """
+
+    __slots__ = ('ip', 'masklen', '_prefix', '_wire')
+
     def __init__(self, prefix):
-        self.prefix = prefix
+        ip, masklen = prefix.split('/')
+        self.ip, = _I.unpack(socket.inet_aton(ip))
+        self.masklen = int(masklen)
+        self._prefix = prefix
+        self._wire = None
 
-    def __cmp__(self, other):
+    @classmethod
+    def from_int(cls, ip, masklen):
+        self = object.__new__(cls)
+        self.ip = ip
+        self.masklen = masklen
+        self._prefix = None
+        self._wire = None
+        return self
+
+    @property
+    def prefix(self):
+        if self._prefix is None:
+            self._prefix = fmt(self.ip, self.masklen)
+        return self._prefix
+
+    # ordering is by address then mask length; masklen fits in 6 bits, so
+    # (ip << 6) | masklen orders the same way and doubles as the hash
+    def __hash__(self):
+        return (self.ip << 6) | self.masklen
+
+    def __eq__(self, other):
         if isinstance(other, ipv4):
-            aip, alen = self.prefix.split('/')
-            alen = int(alen)
-            aip = socket.inet_aton(aip)
+            return self.ip==other.ip and self.masklen==other.masklen
+        return NotImplemented
 
-            bip, blen = other.prefix.split('/')
-            blen = int(blen)
-            bip = socket.inet_aton(bip)
-
-            return cmp((aip,alen),(bip,blen))
+    def __ne__(self, other):
+        if isinstance(other, ipv4):
+            return self.ip!=other.ip or self.masklen!=other.masklen
+        return NotImplemented
 
-        return -1
+    def __lt__(self, other):
+        if isinstance(other, ipv4):
+            return ((self.ip << 6) | self.masklen) < ((other.ip << 6) | other.masklen)
+        return NotImplemented
 
-    def encode(self):
-        plen = 0
-        v = ''
+    def __le__(self, other):
+        if isinstance(other, ipv4):
+            return ((self.ip << 6) | self.masklen) <= ((other.ip << 6) | other.masklen)
+        return NotImplemented
 
-        ip, masklen = self.prefix.split('/')
-        ip = socket.inet_aton(ip)
-        masklen = int(masklen)
+    def __gt__(self, other):
+        if isinstance(other, ipv4):
+            return ((self.ip << 6) | self.masklen) > ((other.ip << 6) | other.masklen)
+        return NotImplemented
 
-        plen += masklen
-        if masklen > 24:
-            v += ip
-        elif masklen > 16:
-            v += ip[:3]
-        elif masklen > 8:
-            v += ip[:2]
-        elif masklen > 0:
-            v += ip[:1]
-        else:
-            pass
+    def __ge__(self, other):
+        if isinstance(other, ipv4):
+            return ((self.ip << 6) | self.masklen) >= ((other.ip << 6) | other.masklen)
+        return NotImplemented
 
-        return struct.pack('B', plen) + v
+    def encode(self):
+        if self._wire is None:
+            masklen = self.masklen
+            self._wire = chr(masklen) + _I.pack(self.ip)[:pb(masklen)]
+        return self._wire
 
     def __repr__(self):
         return '<ipv4 %s>' % (self.prefix,)
@@ -181,7 +218,11 @@ class ipv4(NLRI):
 
     @classmethod
     def from_bytes(cls, plen, val):
-        return cls(pip(val, plen))
+        return cls.from_buffer(val, 0, plen)
+
+    @classmethod
+    def from_buffer(cls, val, idx, plen):
+        return cls.from_int(unpack_addr(val, idx, plen), plen)
 
 
 def pb(masklen):
@@ -200,24 +241,160 @@ def pip(pi, masklen):
     return '%s/%s' % (socket.inet_ntoa(pi[:4]), masklen)
 
 
-def parse(bytes, afi=1, safi=0):
-    rv = []
+_B = struct.Struct('!B')
+_H = struct.Struct('!H')
+_HB = struct.Struct('!HB')
+_I = struct.Struct('!I')
+
+def unpack_addr(buf, idx, masklen):
+    """Read the address bits of an IPv4 prefix at buf[idx:] as an int,
+    without slicing them out."""
+    nbytes = pb(masklen)
+    if nbytes==4:
+        return _I.unpack_from(buf, idx)[0]
+    elif nbytes==3:
+        hi, lo = _HB.unpack_from(buf, idx)
+        return (hi << 16) | (lo << 8)
+    elif nbytes==2:
+        return _H.unpack_from(buf, idx)[0] << 16
+    elif nbytes==1:
+        return _B.unpack_from(buf, idx)[0] << 24
+    return 0
+
+def fmt(ip, masklen):
+    return '%d.%d.%d.%d/%d' % (
+            ip >> 24, (ip >> 16) & 0xff, (ip >> 8) & 0xff, ip & 0xff,
+            masklen,
+            )
 
+def iterparse(bytes, afi=1, safi=0, idx=0, end=None):
+    """Yield the prefixes in an NLRI field one at a time.
+
+    "bytes" may be a string, buffer, bytearray or memoryview; prefixes are
+    read in place between "idx" and "end" rather than sliced out first.
+    """
     if afi==1 and safi==128:
         klass = vpnv4
     else:
         klass = ipv4
 
-    idx = 0
-    while idx < len(bytes):
-        plen, = struct.unpack_from('B', bytes, idx)
+    if end is None:
+        end = len(bytes)
+
+    from_buffer = klass.from_buffer
+    unpack_plen = _B.unpack_from
+
+    while idx < end:
+        plen, = unpack_plen(bytes, idx)
         idx += 1
-        nbytes, rest = divmod(plen, 8)
-        if rest:
-            nbytes += 1
-        val = bytes[idx:idx+nbytes]
-        idx += nbytes
 
-        rv.append(klass.from_bytes(plen, val))
+        yield from_buffer(bytes, idx, plen)
 
-    return rv
+        idx += (plen + 7) >> 3
+
+def parse(bytes, afi=1, safi=0):
+    return list(iterparse(bytes, afi, safi))
+
+
+def decode_bulk(sections):
+    """Decode IPv4 NLRI fields into parallel columns.
+
+    "sections" is one NLRI field or a list of them (e.g. the NLRI of many
+    UPDATEs). Returns (network, masklen, index): the prefix addresses as
+    32-bit ints, their mask lengths, and which section each came from.
+    These are NumPy uint32/uint8/uint32 arrays when NumPy is available and
+    array.array('I'/'B'/'I') otherwise.
+    """
+    if isinstance(sections, str):
+        sections = [sections]
+
+    if numpy is None:
+        return _decode_bulk_py(sections)
+
+    data = ''.join(sections)
+    buf = bytearray(data)
+    n = len(buf)
+
+    # finding where each prefix starts has to be done in order, but it is
+    # the only per-prefix Python work; everything else is vectorised. Each
+    # section must end on a prefix boundary, or a prefix would run on into
+    # the next one
+    offsets = array.array('I')
+    append = offsets.append
+    i = 0
+    end = 0
+    for sec in sections:
+        end += len(sec)
+        while i < end:
+            append(i)
+            i += 1 + ((buf[i] + 7) >> 3)
+        if i!=end:
+            raise Exception('truncated NLRI')
+
+    b = numpy.frombuffer(data, dtype=numpy.uint8)
+    offsets = numpy.frombuffer(offsets, dtype=numpy.uint32).astype(numpy.intp)
+
+    masklen = b[offsets]
+    if len(masklen) and masklen.max() > 32:
+        raise Exception('IPv4 prefix longer than 32 bits')
+
+    nbytes = (masklen + 7) >> 3
+    network = numpy.zeros(len(offsets), dtype=numpy.uint32)
+    for k in range(4):
+        m = nbytes > k
+        network[m] |= b[offsets[m] + 1 + k].astype(numpy.uint32) << (24 - 8*k)
+
+    starts = numpy.cumsum([0] + [len(sec) for sec in sections[:-1]])
+    index = (numpy.searchsorted(starts, offsets, side='right') - 1).astype(numpy.uint32)
+
+    return network, masklen, index
+
+def _decode_bulk_py(sections):
+    network = array.array('I')
+    masklen = array.array('B')
+    index = array.array('I')
+
+    for n, sec in enumerate(sections):
+        idx = 0
+        while idx < len(sec):
+            plen, = _B.unpack_from(sec, idx)
+            idx += 1
+            if plen > 32:
+                raise Exception('IPv4 prefix longer than 32 bits')
+            if idx + ((plen + 7) >> 3) > len(sec):
+                raise Exception('truncated NLRI')
+
+            network.append(unpack_addr(sec, idx, plen))
+            masklen.append(plen)
+            index.append(n)
+            idx += (plen + 7) >> 3
+
+        if idx!=len(sec):
+            raise Exception('truncated NLRI')
+
+    return network, masklen, index
+
+def encode_bulk(network, masklen):
+    """Encode parallel columns of IPv4 addresses and mask lengths as one
+    NLRI field; the reverse of decode_bulk()."""
+    if numpy is None:
+        return ''.join([
+            ipv4.from_int(ip, plen).encode() for ip, plen in zip(network, masklen)
+            ])
+
+    network = numpy.asarray(network, dtype=numpy.uint32)
+    masklen = numpy.asarray(masklen, dtype=numpy.uint8)
+    if not len(masklen):
+        return ''
+
+    nbytes = (masklen.astype(numpy.intp) + 7) >> 3
+    sizes = 1 + nbytes
+    starts = numpy.cumsum(sizes) - sizes
+
+    out = numpy.zeros(int(sizes.sum()), dtype=numpy.uint8)
+    out[starts] = masklen
+    for k in range(4):
+        m = nbytes > k
+        out[starts[m] + 1 + k] = (network[m] >> (24 - 8*k)) & 0xff
+
+    return out.tostring()
@@ -0,0 +1,79 @@
+class OrderedMap(object):
+    """A small mapping that iterates in insertion order.
+
+    Holds the path attributes of an UPDATE and the capabilities and
+    parameters of an OPEN: a handful of entries each, but one instance per
+    message. Only a key list and a dict are allocated; deleting is linear
+    in the number of keys.
+    """
+
+    __slots__ = ('_keys', '_map')
+
+    def __init__(self, items=()):
+        self._keys = []
+        self._map = {}
+        for key, value in items:
+            self[key] = value
+
+    def __getitem__(self, key):
+        return self._map[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._map:
+            self._keys.append(key)
+        self._map[key] = value
+
+    def __delitem__(self, key):
+        del self._map[key]
+        self._keys.remove(key)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, key, default=None):
+        return self._map.get(key, default)
+
+    def setdefault(self, key, default=None):
+        if key not in self._map:
+            self[key] = default
+        return self._map[key]
+
+    def pop(self, key, *default):
+        if key in self._map:
+            self._keys.remove(key)
+        return self._map.pop(key, *default)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        m = self._map
+        return [m[k] for k in self._keys]
+
+    def items(self):
+        m = self._map
+        return [(k, m[k]) for k in self._keys]
+
+    def __eq__(self, other):
+        if isinstance(other, OrderedMap):
+            return self.items()==other.items()
+        if isinstance(other, dict):
+            return self._map==other
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        if eq is NotImplemented:
+            return eq
+        return not eq
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'OrderedMap(%r)' % (self.items(),)
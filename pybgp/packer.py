@@ -0,0 +1,214 @@
+from pybgp import nlri, pathattr, proto, session
+
+def pack(changes, max_len=session.MAX_LEN, asn4=False):
+    """Pack an iterable of (prefix, attrs) changes into UPDATEs.
+
+    "attrs" is a sequence of path attributes for an advertisement, or None
+    for a withdrawal. See Packer.
+    """
+    p = Packer(max_len, asn4)
+    for prefix, attrs in changes:
+        if attrs is None:
+            p.withdraw(prefix)
+        else:
+            p.advertise(prefix, attrs)
+    return p.updates()
+
+def _attrlen(vlen):
+    # flags, type and a one or two byte length
+    if vlen > 255:
+        return 4 + vlen
+    return 3 + vlen
+
+# MP_REACH_NLRI for vpnv4 before any NLRI: afi, safi, next hop length, an
+# RD of zero plus the IPv4 next hop, and the reserved byte
+MP_REACH_VPNV4 = 2 + 1 + 1 + 12 + 1
+# MP_UNREACH_NLRI before any withdrawn routes: afi and safi
+MP_UNREACH = 2 + 1
+
+class _Msg:
+    """An UPDATE being filled, tracking its encoded size as it grows."""
+
+    def __init__(self, attrs=(), block=0, nh=None):
+        self.attrs = attrs
+        self.block = block
+        self.nh = nh
+
+        self.nlri = []
+        self.withdraw = []
+        self.mp_nlri = []
+        self.mp_withdraw = []
+
+        self.nlri_len = 0
+        self.withdraw_len = 0
+        self.mp_nlri_len = 0
+        self.mp_withdraw_len = 0
+
+    def size(self, nlri=0, withdraw=0, mp_nlri=0, mp_withdraw=0):
+        """The encoded size, were this many more bytes of each added."""
+        size = 19 + 2 + 2 + self.block
+        size += self.nlri_len + nlri
+        size += self.withdraw_len + withdraw
+
+        if self.nh is not None:
+            size += _attrlen(MP_REACH_VPNV4 + self.mp_nlri_len + mp_nlri)
+        if self.mp_withdraw or mp_withdraw:
+            size += _attrlen(MP_UNREACH + self.mp_withdraw_len + mp_withdraw)
+
+        return size
+
+    def update(self):
+        attrs = list(self.attrs)
+
+        if self.nh is not None:
+            attrs.append(pathattr.MpReachNlri(dict(
+                afi=1, safi=128, nh=self.nh, nlri=self.mp_nlri,
+                )))
+        if self.mp_withdraw:
+            attrs.append(pathattr.MpUnreachNlri(dict(
+                afi=1, safi=128, withdraw=self.mp_withdraw,
+                )))
+
+        attrs.sort(key=lambda a: a.typenum)
+        return proto.Update(nlri=self.nlri, withdraw=self.withdraw, *attrs)
+
+class Packer:
+    """Packs route changes into as few UPDATEs as possible.
+
+    Routes are given with advertise() and withdraw(); the last change for a
+    prefix wins. updates() groups the advertised prefixes by identical
+    attribute set, fills one UPDATE after another up to "max_len" bytes,
+    and fits the withdrawals into whatever room is left before starting
+    withdraw-only messages.
+
+    Prefixes are nlri.ipv4 (or prefix strings) or nlri.vpnv4. The latter are
+    carried in MP_REACH_NLRI/MP_UNREACH_NLRI; their next hop is taken from
+    the NextHop among "attrs", which is not sent as an attribute itself.
+
+    The attributes passed in are frozen, so every message of a group, and
+    every peer it is sent to, reuses their encoding. Sizes are worked out
+    for a session with or without 4-byte AS numbers, as "asn4" says.
+    """
+
+    def __init__(self, max_len=session.MAX_LEN, asn4=False):
+        self.max_len = max_len
+        self.asn4 = asn4
+        self.changes = {}
+        self.order = []
+
+    def advertise(self, prefix, attrs):
+        self._change(prefix, list(attrs))
+
+    def withdraw(self, prefix):
+        self._change(prefix, None)
+
+    def _change(self, prefix, attrs):
+        if isinstance(prefix, str):
+            prefix = nlri.ipv4(prefix)
+        # a vpnv4 route is its rd and prefix; the labels of an advertisement
+        # and of its withdrawal differ, and must not make two routes of it
+        if isinstance(prefix, nlri.vpnv4):
+            key = (prefix.rd, prefix.prefix)
+        else:
+            key = prefix
+        if key not in self.changes:
+            self.order.append(key)
+        self.changes[key] = (prefix, attrs)
+
+    def updates(self):
+        groups = {}
+        keys = []
+        withdraw = []
+
+        for key in self.order:
+            prefix, attrs = self.changes[key]
+            if attrs is None:
+                withdraw.append(prefix)
+                continue
+
+            nh = None
+            if isinstance(prefix, nlri.vpnv4):
+                nh = [a.value for a in attrs if a.type=='nexthop']
+                if not nh:
+                    raise Exception('no next hop for %s' % (prefix,))
+                nh = nh[0]
+                attrs = [a for a in attrs if a.type!='nexthop']
+
+            for a in attrs:
+                a.freeze()
+            sent = pathattr.sendable(attrs, self.asn4)
+            key = (nh, tuple(sorted([(a.typenum, a.encode(self.asn4)) for a in sent])))
+            if key not in groups:
+                groups[key] = (attrs, [])
+                keys.append(key)
+            groups[key][1].append(prefix)
+
+        msgs = []
+        for key in keys:
+            nh, block = key
+            attrs, prefixes = groups[key]
+            blocklen = sum([len(b) for t, b in block])
+            msgs.extend(self._fill(attrs, blocklen, nh, prefixes))
+
+        # first fit, per kind of withdrawal; a message that has no room for
+        # one withdrawal is not offered the later ones
+        open = {False: list(msgs), True: list(msgs)}
+        for prefix in withdraw:
+            vpn = isinstance(prefix, nlri.vpnv4)
+            plen = len(prefix.encode())
+            if vpn:
+                kw = dict(mp_withdraw=plen)
+            else:
+                kw = dict(withdraw=plen)
+
+            candidates = open[vpn]
+            while candidates and candidates[0].size(**kw) > self.max_len:
+                candidates.pop(0)
+
+            if candidates:
+                msg = candidates[0]
+            else:
+                msg = _Msg()
+                if msg.size(**kw) > self.max_len:
+                    raise Exception('%s does not fit in %d bytes' % (prefix, self.max_len))
+                msgs.append(msg)
+                open[False].append(msg)
+                open[True].append(msg)
+
+            if vpn:
+                msg.mp_withdraw.append(prefix)
+                msg.mp_withdraw_len += plen
+            else:
+                msg.withdraw.append(prefix)
+                msg.withdraw_len += plen
+
+        self.changes = {}
+        self.order = []
+
+        return [msg.update() for msg in msgs]
+
+    def _fill(self, attrs, blocklen, nh, prefixes):
+        msgs = []
+        msg = None
+
+        for prefix in prefixes:
+            plen = len(prefix.encode())
+            if nh is None:
+                kw = dict(nlri=plen)
+            else:
+                kw = dict(mp_nlri=plen)
+
+            if msg is None or msg.size(**kw) > self.max_len:
+                msg = _Msg(attrs, blocklen, nh)
+                if msg.size(**kw) > self.max_len:
+                    raise Exception('%s does not fit in %d bytes' % (prefix, self.max_len))
+                msgs.append(msg)
+
+            if nh is None:
+                msg.nlri.append(prefix)
+                msg.nlri_len += plen
+            else:
+                msg.mp_nlri.append(prefix)
+                msg.mp_nlri_len += plen
+
+        return msgs
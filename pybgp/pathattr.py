@@ -1,57 +1,96 @@
 
+import array
+import bisect
 import struct
 import socket
+import sys
 
 from pybgp import nlri
 
-def decode(bytes, idx=0):
-    flagb, type = struct.unpack_from('BB', bytes, idx)
-    idx += 2
-    used = 2
+# stands in for AS numbers that do not fit two bytes, towards speakers
+# without 4-byte AS support (RFC 6793)
+AS_TRANS = 23456
+
+# attribute header: flags and type, then a one or two byte length
+_HEAD = struct.Struct('!BB')
+_LEN1 = struct.Struct('!B')
+_LEN2 = struct.Struct('!H')
+
+# type number -> the class decoding attributes of that type; see register()
+codecs = {}
+
+def register(klass):
+    """Decode attributes of type klass.typenum with klass.from_bytes(), and
+    store them under klass.type.
+
+    Replaces any codec already registered for the type number. Returns the
+    class, so this also works as a class decorator.
+    """
+    codecs[klass.typenum] = klass
+    return klass
+
+def scan(bytes, idx=0):
+    """Yield (type, start, end) for each attribute in a block of path
+    attributes, reading only the attribute headers."""
+    while idx < len(bytes):
+        flagb, type = _HEAD.unpack_from(bytes, idx)
+
+        if flagb & 16:
+            length, = _LEN2.unpack_from(bytes, idx+2)
+            end = idx + 4 + length
+        else:
+            length, = _LEN1.unpack_from(bytes, idx+2)
+            end = idx + 3 + length
+
+        yield type, idx, end
+        idx = end
+
+def typename(type):
+    """The key an attribute of the given type number is stored under."""
+    klass = codecs.get(type)
+    if klass is None:
+        return 'type-%s' % (type,)
+    return klass.type
+
+def decode(bytes, idx=0, asn4=False):
+    """Decode the attribute at "idx", returning (bytes used, attribute).
+    "asn4" says whether AS numbers are four bytes, as on a session that
+    negotiated the 4byteas capability."""
+    flagb, type = _HEAD.unpack_from(bytes, idx)
 
     if flagb & 16:
-        length, = struct.unpack_from('>H', bytes, idx)
-        idx += 2
-        used += 2
-    else:
-        length, = struct.unpack_from('!B', bytes, idx)
-        idx += 1
-        used += 1
-
-
-    vl = bytes[idx:idx+length]
-    used += length
-
-    if type==1:
-        obj = Origin.from_bytes(vl)
-    elif type==2:
-        obj = AsPath.from_bytes(vl)
-    elif type==3:
-        obj = NextHop.from_bytes(vl)
-    elif type==4:
-        obj = Med.from_bytes(vl)
-    elif type==5:
-        obj = LocalPref.from_bytes(vl)
-    elif type==9:
-        obj = Originator.from_bytes(vl)
-    elif type==10:
-        obj = ClusterList.from_bytes(vl)
-    elif type==14:
-        obj = MpReachNlri.from_bytes(vl)
-    elif type==15:
-        obj = MpUnreachNlri.from_bytes(vl)
-    elif type==16:
-        obj = ExtCommunity.from_bytes(vl)
+        length, = _LEN2.unpack_from(bytes, idx+2)
+        used = 4 + length
     else:
+        length, = _LEN1.unpack_from(bytes, idx+2)
+        used = 3 + length
+
+    vl = bytes[idx+used-length:idx+used]
+
+    klass = codecs.get(type)
+    if klass is None:
         obj = PathAttr(type, vl)
+    elif klass.asn_sized:
+        obj = klass.from_bytes(vl, asn4)
+    else:
+        obj = klass.from_bytes(vl)
 
     obj.flags = flagb
-        
+
     return used, obj
 
+_WRAP1 = struct.Struct('!BBB')
+_WRAP2 = struct.Struct('!BBH')
+
 class PathAttr:
     flags = 0
 
+    # the encoded attribute, once frozen
+    _wire = None
+
+    # whether the encoding depends on the AS number size; see AsnAttr
+    asn_sized = False
+
     def __init__(self, type, val):
         self.value = val
         self.typenum = type
@@ -78,16 +117,42 @@ class PathAttr:
                 self.value,
                 )
 
-    def encode(self):
+    def encode(self, asn4=False):
+        if self._wire is not None:
+            return self._wire
+        return self.wrap(self.packvalue())
+
+    def freeze(self, wire=None, asn4=False):
+        """Declare the attribute finished and keep its encoding.
+
+        Further encode() calls return the kept bytes, so an attribute shared
+        by many routes or peers is only packed once; "wire" supplies them
+        when already known, e.g. as received. Rebinding anything on a frozen
+        attribute raises AttributeError; its value must not be changed in
+        place either.
+        """
+        if self._wire is None:
+            if wire is None:
+                wire = self.encode()
+            self.__dict__['_wire'] = wire
+        return self
+
+    def frozen(self):
+        return self._wire is not None
+
+    def __setattr__(self, name, value):
+        if self._wire is not None:
+            raise AttributeError('%s is frozen' % (self.__class__.__name__,))
+        self.__dict__[name] = value
+
+    def wrap(self, vl):
+        """Encode "vl" as the value of an attribute like this one."""
         fl = self.flags
-        vl = self.packvalue()
 
         if len(vl) > 255:
-            fl = fl | 16
-            return struct.pack('!BBH', fl, self.typenum, len(vl)) + vl
+            return _WRAP2.pack(fl | 16, self.typenum, len(vl)) + vl
 
-        fl = fl & (0xff ^ 16)
-        return struct.pack('BBB', fl, self.typenum, len(vl)) + vl
+        return _WRAP1.pack(fl & (0xff ^ 16), self.typenum, len(vl)) + vl
 
     def __cmp__(self, other):
         if isinstance(other, PathAttr):
@@ -130,30 +195,206 @@ class Origin(PathAttr):
             return '\x02'
         return self.value
 
-class AsPath(PathAttr):
+class AsnAttr(PathAttr):
+    """An attribute carrying AS numbers, two or four bytes each depending on
+    whether the session negotiated 4-byte AS numbers.
+
+    from_bytes() and packvalue() take an "asn4" flag, as does encode(); a
+    frozen attribute keeps its encoding for both sizes. as4() gives the
+    AS4_* companion a 2-byte speaker needs to learn the real numbers.
+    """
+
+    asn_sized = True
+
+    # the frozen encoding with 4-byte AS numbers
+    _wire4 = None
+
+    # the class of the companion attribute for 2-byte speakers
+    companion = None
+
+    def encode(self, asn4=False):
+        if asn4:
+            if self._wire4 is not None:
+                return self._wire4
+        elif self._wire is not None:
+            return self._wire
+        return self.wrap(self.packvalue(asn4))
+
+    def freeze(self, wire=None, asn4=False):
+        if self._wire is None:
+            d = self.__dict__
+            if asn4:
+                d['_wire4'] = wire or self.encode(True)
+                d['_wire'] = self.encode(False)
+            else:
+                d['_wire4'] = self.encode(True)
+                d['_wire'] = wire or self.encode(False)
+        return self
+
+    def needs4(self):
+        """Whether any AS number does not fit two bytes."""
+        raise NotImplementedError
+
+    def as4(self):
+        """The companion attribute, or None if every AS number fits two
+        bytes. Kept once the attribute is frozen."""
+        d = self.__dict__
+        if '_as4' in d:
+            return d['_as4']
+
+        companion = None
+        if self.needs4():
+            companion = self.companion(self.value)
+            if self.frozen():
+                companion.freeze()
+        if self.frozen():
+            d['_as4'] = companion
+        return companion
+
+class AsSeq(array.array):
+    """An AS_SEQUENCE path segment.
+
+    The AS numbers are kept as an array of unsigned 32-bit ints; it compares
+    equal to a list or tuple of the same numbers.
+    """
+
+    __slots__ = ()
+
+    segtype = 2
+
+    def __new__(cls, asns=()):
+        return array.array.__new__(cls, 'I', asns)
+
+    def _same(self, other):
+        if isinstance(other, (AsSeq, list, tuple)):
+            return list(self)==list(other)
+        return False
+
+    def __eq__(self, other):
+        return self._same(other)
+
+    def __ne__(self, other):
+        return not self._same(other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+class AsSet(AsSeq):
+    """An AS_SET path segment; compares equal to a set of the same AS
+    numbers, regardless of order."""
+
+    __slots__ = ()
+
+    segtype = 1
+
+    def _same(self, other):
+        if isinstance(other, (AsSet, set, frozenset)):
+            return set(self)==set(other)
+        return False
+
+_SEG = struct.Struct('!BB')
+_SEGTYPES = {1: AsSet, 2: AsSeq}
+# array items are in host order; the wire is big-endian
+_SWAP = sys.byteorder=='little'
+
+def segments(v):
+    """AS_PATH segments from "v": a string like '65000,65001 set(1,2)', or a
+    list of lists (sequences) and sets."""
+    if isinstance(v, str):
+        val = []
+        for seg in v.split():
+            if seg.startswith('set(') and seg.endswith(')'):
+                seg = set([int(s) for s in seg[4:-1].split(',')])
+            else:
+                seg = [int(s) for s in seg.split(',')]
+            val.append(seg)
+        v = val
+
+    val = []
+    for seg in v:
+        if isinstance(seg, AsSeq):
+            val.append(seg)
+        elif isinstance(seg, (set, frozenset)):
+            val.append(AsSet(seg))
+        elif isinstance(seg, (tuple, list)):
+            val.append(AsSeq(seg))
+        else:
+            raise Exception('unknown segment type %r' % (seg,))
+    return val
+
+def _unpack_segments(val, asn4):
+    if asn4:
+        code, width = 'I', 4
+    else:
+        code, width = 'H', 2
+
+    value = []
+    iidx = 0
+    while iidx < len(val):
+        segtype, numas = _SEG.unpack_from(val, iidx)
+        iidx += 2
+
+        klass = _SEGTYPES.get(segtype)
+        if klass is None:
+            raise Exception('unknown segment type')
+
+        end = iidx + numas*width
+        if end > len(val):
+            raise Exception('truncated segment')
+
+        asns = array.array(code, val[iidx:end])
+        if _SWAP:
+            asns.byteswap()
+        iidx = end
+
+        value.append(klass(asns))
+
+    return value
+
+def _pack_segments(value, asn4):
+    v = []
+    for seg in value:
+        if asn4:
+            asns = array.array('I', seg)
+        else:
+            asns = array.array('H', [
+                asnum if asnum <= 0xffff else AS_TRANS for asnum in seg
+                ])
+        if _SWAP:
+            asns.byteswap()
+
+        v.append(_SEG.pack(seg.segtype, len(seg)))
+        v.append(asns.tostring())
+    return ''.join(v)
+
+def _count(value):
+    # the path length as RFC 4271 counts it: a set counts once
+    n = 0
+    for seg in value:
+        if isinstance(seg, AsSet):
+            n += 1
+        else:
+            n += len(seg)
+    return n
+
+class AsPath(AsnAttr):
     typenum = 2
     type = 'aspath'
     # non-optional, transitive
     flags = 0x40
 
     def __init__(self, v):
-        if isinstance(v, str):
-            val = []
-            for seg in v.split():
-                if seg.startswith('set(') and seg.endswith(')'):
-                    seg = set([int(s) for s in seg[4:-1].split(',')])
-                else:
-                    seg = [int(s) for s in seg.split(',')]
-                val.append(seg)
-        else:
-            val = v
-                   
-        self.value = val
+        self.value = segments(v)
 
     def __repr__(self):
-        s = '<aspath'
+        s = '<%s' % (self.type,)
         for v in self.value:
-            if isinstance(v, set):
+            if isinstance(v, AsSet):
                 s += ' set('
                 s += ','.join([
                     str(asnum) for asnum in v
@@ -167,51 +408,23 @@ class AsPath(PathAttr):
         s += '>'
         return s
 
-    def from_bytes(cls, val):
-        value = []
-        iidx = 0
-
-        while iidx < len(val):
-            segtype, numas = struct.unpack_from('BB', val, iidx)
-            iidx += 2
-
-            if segtype==1:
-                v = set()
-                add = v.add
-
-            elif segtype==2:
-                v = []
-                add = v.append
-
-            else:
-                raise Exception('unknown segment type')
-
-            for i in range(numas):
-                asnum, = struct.unpack_from('!H', val, iidx)
-                iidx += 2
-
-                add(asnum)
-
-            value.append(v)
-
-        return cls(value)
+    def from_bytes(cls, val, asn4=False):
+        return cls(_unpack_segments(val, asn4))
     from_bytes = classmethod(from_bytes)
 
-    def packvalue(self):
-        v = ''
-        for seg in self.value:
-            if isinstance(seg, set):
-                segtype = 1
-            elif isinstance(seg, (tuple, list)):
-                segtype = 2
-            else:
-                raise Exception('unknown segment type %r' % (seg,))
+    def packvalue(self, asn4=False):
+        return _pack_segments(self.value, asn4)
 
-
-            v += struct.pack('BB', segtype, len(seg))
+    def needs4(self):
+        for seg in self.value:
             for asnum in seg:
-                v += struct.pack('!H', asnum)
-        return v
+                if asnum > 0xffff:
+                    return True
+        return False
+
+    def length(self):
+        """The path length used in best path selection."""
+        return _count(self.value)
 
 class NextHop(PathAttr):
     typenum = 3
@@ -233,6 +446,8 @@ class NextHop(PathAttr):
         return socket.inet_aton(self.value)
 
 class IntAttr(PathAttr):
+    _struct = struct.Struct('!I')
+
     def __init__(self, val=0):
         self.value = val
 
@@ -240,12 +455,12 @@ class IntAttr(PathAttr):
         return '<%s %d>' % (self.__class__.__name__, self.value)
 
     def from_bytes(cls, val):
-        value, = struct.unpack_from('!I', val)
+        value, = cls._struct.unpack_from(val)
         return cls(value)
     from_bytes = classmethod(from_bytes)
 
     def packvalue(self):
-        return struct.pack('!I', self.value)
+        return self._struct.pack(self.value)
 
 class Med(IntAttr):
     type = 'med'
@@ -303,13 +518,198 @@ class ClusterList(PathAttr):
             v += socket.inet_aton(c)
         return v
 
+class As4Path(PathAttr):
+    """AS4_PATH: the AS path with 4-byte AS numbers, sent alongside AS_PATH
+    to speakers that only understand 2-byte ones."""
+
+    typenum = 17
+    type = 'as4path'
+    # optional, transitive
+    flags = 0xc0
+
+    def __init__(self, v):
+        self.value = segments(v)
+
+    __repr__ = AsPath.__repr__.im_func
+
+    def from_bytes(cls, val):
+        return cls(_unpack_segments(val, True))
+    from_bytes = classmethod(from_bytes)
+
+    def packvalue(self):
+        return _pack_segments(self.value, True)
+
+AsPath.companion = As4Path
+
+class Aggregator(AsnAttr):
+    """AGGREGATOR, as (AS number, router id)."""
+
+    typenum = 7
+    type = 'aggregator'
+    # optional, transitive
+    flags = 0xc0
+
+    _struct2 = struct.Struct('!H4s')
+    _struct4 = struct.Struct('!I4s')
+
+    def __init__(self, val):
+        self.value = tuple(val)
+
+    def from_bytes(cls, val, asn4=False):
+        if asn4:
+            asnum, ip = cls._struct4.unpack(val)
+        else:
+            asnum, ip = cls._struct2.unpack(val)
+        return cls((asnum, socket.inet_ntoa(ip)))
+    from_bytes = classmethod(from_bytes)
+
+    def packvalue(self, asn4=False):
+        asnum, ip = self.value
+        if asn4:
+            return self._struct4.pack(asnum, socket.inet_aton(ip))
+        if asnum > 0xffff:
+            asnum = AS_TRANS
+        return self._struct2.pack(asnum, socket.inet_aton(ip))
+
+    def needs4(self):
+        return self.value[0] > 0xffff
+
+class As4Aggregator(PathAttr):
+    """AS4_AGGREGATOR, the AGGREGATOR with a 4-byte AS number."""
+
+    typenum = 18
+    type = 'as4aggregator'
+    # optional, transitive
+    flags = 0xc0
+
+    def __init__(self, val):
+        self.value = tuple(val)
+
+    def from_bytes(cls, val):
+        asnum, ip = Aggregator._struct4.unpack(val)
+        return cls((asnum, socket.inet_ntoa(ip)))
+    from_bytes = classmethod(from_bytes)
+
+    def packvalue(self):
+        asnum, ip = self.value
+        return Aggregator._struct4.pack(asnum, socket.inet_aton(ip))
+
+Aggregator.companion = As4Aggregator
+
+def sendable(attrs, asn4=False):
+    """The attributes to put on the wire for "attrs".
+
+    Towards a speaker without 4-byte AS support, AS numbers that do not fit
+    two bytes are sent as AS_TRANS and the real ones in AS4_PATH and
+    AS4_AGGREGATOR, which are added after the rest unless already present.
+    Towards one with it, those two are never sent, but folded into AS_PATH
+    and AGGREGATOR first if they came from a 2-byte speaker (see
+    reconcile()).
+    """
+    if asn4:
+        for a in attrs:
+            if a.typenum in (17, 18):
+                return _reconciled(attrs)
+        return list(attrs)
+
+    extra = []
+    have = set([a.typenum for a in attrs])
+    for a in attrs:
+        if a.asn_sized:
+            companion = a.as4()
+            if companion is not None and companion.typenum not in have:
+                extra.append(companion)
+
+    if extra:
+        return list(attrs) + extra
+    return attrs
+
+def reconcile(attrs):
+    """Fold AS4_PATH and AS4_AGGREGATOR, as received from a speaker without
+    4-byte AS support, back into AS_PATH and AGGREGATOR (RFC 6793 4.2.3).
+
+    "attrs" is a dict of attributes by name, as Update.pathattr, and is
+    changed in place; the AS4_* attributes are removed.
+    """
+    as4path = attrs.get('as4path')
+    as4agg = attrs.get('as4aggregator')
+    if as4path is None and as4agg is None:
+        return
+
+    for name in ('as4path', 'as4aggregator'):
+        if name in attrs:
+            del attrs[name]
+
+    agg = attrs.get('aggregator')
+    if agg is not None and as4agg is not None:
+        if agg.value[0]!=AS_TRANS:
+            # aggregated by a 2-byte speaker after the AS4_* attributes
+            # were added, so both are out of date
+            return
+        new = Aggregator(as4agg.value)
+        new.flags = agg.flags
+        attrs['aggregator'] = new
+
+    aspath = attrs.get('aspath')
+    if aspath is None or as4path is None:
+        return
+
+    keep = aspath.length() - _count(as4path.value)
+    if keep < 0:
+        return
+
+    # the leading part of AS_PATH that AS4_PATH does not cover, which
+    # 2-byte speakers prepended, then AS4_PATH
+    merged = []
+    for seg in aspath.value:
+        if keep <= 0:
+            break
+        if isinstance(seg, AsSet):
+            merged.append(seg)
+            keep -= 1
+        else:
+            merged.append(AsSeq(seg[:keep]))
+            keep -= len(seg)
+
+    for seg in as4path.value:
+        if merged and seg.segtype==2 and merged[-1].segtype==2:
+            merged[-1] = AsSeq(list(merged[-1]) + list(seg))
+        else:
+            merged.append(seg)
+
+    new = AsPath(merged)
+    new.flags = aspath.flags
+    attrs['aspath'] = new
+
+def _reconciled(attrs):
+    # a list of attributes with reconcile() applied, in the same order
+    named = dict([(a.type, a) for a in attrs])
+    reconcile(named)
+    return [named[a.type] for a in attrs if a.type in named]
+
 class MpReachNlri(PathAttr):
     typenum = 14
     type = 'mp-reach-nlri'
+    flags = 0x80
     reserved = None
 
-    def __init__(self, val):
-        self.value = val
+    # when decoded, the attribute body and where its NLRI start; "value" is
+    # only built on first use, so iter_nlri() can stream straight from here
+    raw = None
+    offset = None
+
+    def __init__(self, val=None):
+        if val is not None:
+            self.value = val
+
+    def __getattr__(self, name):
+        if name=='value' and self.raw is not None:
+            self.value = dict(
+                    afi=self.afi, safi=self.safi, nh=self.nh,
+                    nlri=list(self.iter_nlri()),
+                    )
+            return self.value
+        raise AttributeError(name)
 
     def __repr__(self):
         return '<MpReachNlri afi=%d safi=%d nh=%r %d nlri>' % (
@@ -319,8 +719,27 @@ class MpReachNlri(PathAttr):
                 len(self.value['nlri']),
                 )
 
+    def iter_nlri(self):
+        if self.raw is None or 'value' in self.__dict__:
+            return iter(self.value['nlri'])
+        return nlri.iterparse(self.raw, self.afi, self.safi, self.offset)
+
+    def family(self):
+        """(afi, safi), without building "value"."""
+        if self.raw is None:
+            return self.value['afi'], self.value['safi']
+        return self.afi, self.safi
+
+    def nexthop(self):
+        """The next hop, without building "value"."""
+        if self.raw is None:
+            return self.value['nh']
+        return self.nh
+
+    _head = struct.Struct('!HBB')
+
     def from_bytes(cls, val):
-        afi, safi, nhlen = struct.unpack_from('!HBB', val)
+        afi, safi, nhlen = cls._head.unpack_from(val)
         fmt = '%dsB' % (nhlen,)
         nh, reserved = struct.unpack_from(fmt, val, 4)
 
@@ -329,10 +748,12 @@ class MpReachNlri(PathAttr):
             rdlo, rdhi, nhip = struct.unpack('!II4s', nh)
             nh = socket.inet_ntoa(nhip)
 
-        n = nlri.parse(val[5+nhlen:], afi, safi)
-
-        v = cls(dict(afi=afi, safi=safi, nh=nh, nlri=n))
-
+        v = cls()
+        v.afi = afi
+        v.safi = safi
+        v.nh = nh
+        v.raw = val
+        v.offset = 5 + nhlen
 
         if reserved:
             # probably useless, but pass it through anyway
@@ -342,7 +763,8 @@ class MpReachNlri(PathAttr):
 
     from_bytes = classmethod(from_bytes)
 
-    def packvalue(self):
+    def packhead(self):
+        """The encoded value up to where the NLRI start."""
         afi = self.value['afi']
         safi = self.value['safi']
         if afi==1 and safi==128:
@@ -351,10 +773,13 @@ class MpReachNlri(PathAttr):
         else:
             nh = self.value['nh']
 
-        v = struct.pack('!HBB', afi, safi, len(nh))
+        v = self._head.pack(afi, safi, len(nh))
         v += nh
         v += chr(self.reserved or 0)
+        return v
 
+    def packvalue(self):
+        v = self.packhead()
         for n in self.value['nlri']:
             v += n.encode()
         return v
@@ -362,9 +787,24 @@ class MpReachNlri(PathAttr):
 class MpUnreachNlri(PathAttr):
     typenum = 15
     type = 'mp-unreach-nlri'
+    flags = 0x80
 
-    def __init__(self, val):
-        self.value = val
+    # as for MpReachNlri, "value" is built from these on first use
+    raw = None
+    offset = 3
+
+    def __init__(self, val=None):
+        if val is not None:
+            self.value = val
+
+    def __getattr__(self, name):
+        if name=='value' and self.raw is not None:
+            self.value = dict(
+                    afi=self.afi, safi=self.safi,
+                    withdraw=list(self.iter_withdraw()),
+                    )
+            return self.value
+        raise AttributeError(name)
 
     def __repr__(self):
         return '<MpUneachNlri afi=%d safi=%d %d withdraw>' % (
@@ -373,73 +813,599 @@ class MpUnreachNlri(PathAttr):
                 len(self.value['withdraw']),
                 )
 
-    def from_bytes(cls, val):
-        afi, safi = struct.unpack_from('!HB', val)
+    def iter_withdraw(self):
+        if self.raw is None or 'value' in self.__dict__:
+            return iter(self.value['withdraw'])
+        return nlri.iterparse(self.raw, self.afi, self.safi, self.offset)
+
+    def family(self):
+        """(afi, safi), without building "value"."""
+        if self.raw is None:
+            return self.value['afi'], self.value['safi']
+        return self.afi, self.safi
 
-        w = nlri.parse(val[3:], afi, safi)
+    _head = struct.Struct('!HB')
+
+    def from_bytes(cls, val):
+        afi, safi = cls._head.unpack_from(val)
 
-        v = cls(dict(afi=afi, safi=safi, withdraw=w))
+        v = cls()
+        v.afi = afi
+        v.safi = safi
+        v.raw = val
 
         return v
 
     from_bytes = classmethod(from_bytes)
 
-    def packvalue(self):
-        afi = self.value['afi']
-        safi = self.value['safi']
-
-        v = struct.pack('!HB', afi, safi)
+    def packhead(self):
+        """The encoded value up to where the withdrawn routes start."""
+        return self._head.pack(self.value['afi'], self.value['safi'])
 
+    def packvalue(self):
+        v = self.packhead()
         for n in self.value['withdraw']:
             v += n.encode()
         return v
 
+# extended communities are 64-bit ints; an array of them where the
+# platform has a 64-bit array type, a list otherwise
+if array.array('L').itemsize==8:
+    _U64 = 'L'
+else:
+    _U64 = None
+
+def _u64s(values=()):
+    if _U64:
+        return array.array(_U64, values)
+    return list(values)
+
+def route_target(v):
+    """A route target extended community as an int, from an int or an
+    'RT:asn:n', 'RT:a.b.c.d:n' or 'RT:asnL:n' string; the last is a 4-octet
+    AS route target, as are those with an AS number too big for 2 octets."""
+    if isinstance(v, (int, long)):
+        return v
+    k, l, h = v.split(':')
+    if k!='RT':
+        raise Exception('not a route target: %r' % (v,))
+
+    h = int(h)
+    if '.' in l:
+        ip, = _LEN4.unpack(socket.inet_aton(l))
+        return (0x0102 << 48) | (ip << 16) | h
+    if l.endswith('L'):
+        return (0x0202 << 48) | (int(l[:-1]) << 16) | h
+    l = int(l)
+    if l > 0xffff:
+        # RFC 5668 4-octet AS specific
+        return (0x0202 << 48) | (l << 16) | h
+    return (0x0002 << 48) | (l << 32) | h
+
+def extcommunity(v):
+    """An extended community as an int, from an int, a route target string
+    (see route_target()) or 'type:hex' with the 7 bytes after the type."""
+    if isinstance(v, (int, long)):
+        return v
+    k, rest = v.split(':', 1)
+    if k=='RT':
+        return route_target(v)
+    return (int(k) << 56) | int(rest, 16)
+
+def is_route_target(i):
+    return (i >> 48) & 0xffff in (0x0002, 0x0102, 0x0202)
+
+def extcommunity_str(i):
+    """The string form of an extended community int."""
+    etype = i >> 56
+    esubtype = (i >> 48) & 0xff
+
+    if esubtype==2:
+        if etype==0:
+            return 'RT:%d:%d' % ((i >> 32) & 0xffff, i & 0xffffffff)
+        elif etype==1:
+            ip = socket.inet_ntoa(_LEN4.pack((i >> 16) & 0xffffffff))
+            return 'RT:%s:%d' % (ip, i & 0xffff)
+        elif etype==2:
+            return 'RT:%dL:%d' % ((i >> 16) & 0xffffffff, i & 0xffff)
+
+    return '%s:%014x' % (etype, i & 0xffffffffffffff)
+
+_LEN4 = struct.Struct('!I')
+
+class _ExtValue(list):
+    # ExtCommunity.value: a list of strings whose changes in place are
+    # written through to the ints of the attribute
+
+    def __init__(self, attr, values):
+        list.__init__(self, values)
+        self.attr = attr
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+def _write_through(name):
+    method = getattr(list, name)
+    def change(self, *args):
+        # set the ints first, so a frozen attribute is left as it was
+        new = list(self)
+        method(new, *args)
+        self.attr._set_ints(new)
+        return method(self, *args)
+    change.__name__ = name
+    return change
+
+for name in ('append', 'extend', 'insert', 'pop', 'remove', 'reverse',
+        'sort', '__setitem__', '__delitem__', '__setslice__', '__delslice__'):
+    setattr(_ExtValue, name, _write_through(name))
+
 class ExtCommunity(PathAttr):
+    """EXTENDED COMMUNITIES (RFC 4360).
+
+    The communities are kept in order as 64-bit ints in "ints". "value" is
+    their list of strings, such as 'RT:65000:1', made when first read;
+    assigning it, or changing it in place, updates the ints. Route targets
+    are plain ints too (see route_target()), so filtering on them is an
+    integer comparison.
+    """
+
     typenum = 16
     type = 'extcommunity'
 
-    def __init__(self, val=[]):
-        self.value = val
+    def __init__(self, val=()):
+        self.ints = _u64s([extcommunity(v) for v in val])
+
+    def __getattr__(self, name):
+        if name=='value':
+            value = _ExtValue(self, [extcommunity_str(i) for i in self.ints])
+            self.__dict__['value'] = value
+            return value
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name=='value':
+            self._set_ints(value)
+            self.__dict__.pop('value', None)
+            return
+        PathAttr.__setattr__(self, name, value)
+
+    def _set_ints(self, values):
+        PathAttr.__setattr__(self, 'ints', _u64s([extcommunity(v) for v in values]))
+
+    def __cmp__(self, other):
+        if isinstance(other, ExtCommunity):
+            return cmp(list(self.ints), list(other.ints))
+        return PathAttr.__cmp__(self, other)
+
+    def route_targets(self):
+        """The route targets among the communities, as ints."""
+        return [i for i in self.ints if is_route_target(i)]
+
+    def has_route_target(self, rt):
+        return route_target(rt) in self.ints
+
+    def has_any(self, wanted):
+        """Whether any of "wanted", a set of ints as made by
+        route_target_set(), is present."""
+        for i in self.ints:
+            if i in wanted:
+                return True
+        return False
 
     def from_bytes(cls, val):
-        value = []
-        iidx = 0
-        while iidx < len(val):
-            etype, esubtype, payload = struct.unpack_from('BB6s', val, iidx)
+        if len(val) % 8:
+            raise Exception('invalid extended community length %d' % (len(val),))
+
+        v = cls()
+        if _U64:
+            ints = array.array(_U64, val)
+            if _SWAP:
+                ints.byteswap()
+        else:
+            ints = list(struct.unpack('!%dQ' % (len(val) // 8,), val))
+        v.ints = ints
+        return v
+    from_bytes = classmethod(from_bytes)
 
-            if etype in (0,2) and esubtype==2:
-                asnum, i = struct.unpack('!HI', payload)
-                value.append(
-                        'RT:%s:%s' % (asnum, i)
-                        )
-            elif etype==1 and esubtype==2:
-                ip, i = struct.unpack('!4sH', payload)
-                ip = socket.inet_ntoa(ip)
-                value.append(
-                        'RT:%s:%s' % (ip, i)
-                        )
-            else:
-                value.append(
-                        '%s:%s' % (etype, val[iidx+1:iidx+8].encode('hex'))
-                        )
+    def packvalue(self):
+        if _U64:
+            ints = array.array(_U64, self.ints)
+            if _SWAP:
+                ints.byteswap()
+            return ints.tostring()
+        return struct.pack('!%dQ' % (len(self.ints),), *self.ints)
+
+def route_target_set(values):
+    """A frozenset of route targets, for ExtCommunity.has_any() and
+    having_any(..., name='extcommunity')."""
+    return frozenset([route_target(v) for v in values])
+
+# RFC 1997 and later well-known communities
+WELL_KNOWN = {
+    'graceful-shutdown': 0xffff0000,
+    'blackhole': 0xffff029a,
+    'no-export': 0xffffff01,
+    'no-advertise': 0xffffff02,
+    'no-export-subconfed': 0xffffff03,
+    'no-peer': 0xffffff04,
+    }
+_WELL_KNOWN_NAMES = dict([(v, k) for k, v in WELL_KNOWN.items()])
+
+def community(v):
+    """A standard community as an int, from an int, 'asn:value' or a
+    well-known name such as 'no-export'."""
+    if isinstance(v, (int, long)):
+        return v
+    if v in WELL_KNOWN:
+        return WELL_KNOWN[v]
+    hi, lo = v.split(':')
+    return (int(hi) << 16) | int(lo)
+
+def large_community(v):
+    """A large community as a (global, local1, local2) tuple, from such a
+    tuple or 'global:local1:local2'."""
+    if isinstance(v, tuple):
+        return v
+    g, l1, l2 = v.split(':')
+    return (int(g), int(l1), int(l2))
+
+def community_set(values):
+    """A frozenset of standard communities, for has_any()/has_all() and
+    having_any()."""
+    return frozenset([community(v) for v in values])
+
+def large_community_set(values):
+    """As community_set(), for large communities."""
+    return frozenset([large_community(v) for v in values])
+
+def _words(bytes):
+    # the 32-bit big-endian words of "bytes" as an array('I')
+    a = array.array('I', bytes)
+    if _SWAP:
+        a.byteswap()
+    return a
+
+def _unwords(a):
+    a = array.array('I', a)
+    if _SWAP:
+        a.byteswap()
+    return a.tostring()
+
+class _Matching:
+    # membership for attributes whose value is a sorted, duplicate free
+    # sequence, searched by bisection; members() gives that sequence
+
+    def __contains__(self, v):
+        seq = self.members()
+        v = self.parse(v)
+        i = bisect.bisect_left(seq, v)
+        return i < len(seq) and seq[i]==v
+
+    def __len__(self):
+        return len(self.members())
+
+    def __nonzero__(self):
+        # an attribute that is present is true, however few members it has,
+        # as "if attrs.get('communities'):" expects
+        return True
+
+    def has_any(self, wanted):
+        """Whether any of "wanted", a set as made by community_set() or
+        large_community_set(), is present."""
+        seq = self.members()
+        if len(wanted) < len(seq):
+            for v in wanted:
+                i = bisect.bisect_left(seq, v)
+                if i < len(seq) and seq[i]==v:
+                    return True
+            return False
+        for v in seq:
+            if v in wanted:
+                return True
+        return False
+
+    def has_all(self, wanted):
+        """Whether all of "wanted" are present."""
+        for v in wanted:
+            if v not in self:
+                return False
+        return True
+
+class Communities(_Matching, PathAttr):
+    """COMMUNITIES (RFC 1997).
+
+    "value" is a sorted array of the communities as 32-bit ints; duplicates
+    are dropped. Membership tests take ints, 'asn:value' strings or
+    well-known names.
+    """
+
+    typenum = 8
+    type = 'communities'
+    # optional, transitive
+    flags = 0xc0
 
-            iidx += 8
-        return cls(value)
+    parse = staticmethod(community)
+
+    def __init__(self, val=()):
+        self.value = array.array('I', sorted(set([community(v) for v in val])))
+
+    def members(self):
+        return self.value
+
+    def strings(self):
+        return [
+            _WELL_KNOWN_NAMES.get(c) or '%d:%d' % (c >> 16, c & 0xffff)
+            for c in self.value
+            ]
+
+    def __repr__(self):
+        return '<communities %s>' % (' '.join(self.strings()),)
+
+    def from_bytes(cls, val):
+        v = cls()
+        v.value = array.array('I', sorted(set(_words(val))))
+        return v
     from_bytes = classmethod(from_bytes)
 
     def packvalue(self):
-        o = ''
-        for v in self.value:
-            k,v = v.split(':', 1)
-            if k=='RT':
-                l,h = v.split(':')
-                if '.' in l:
-                    ip = socket.inet_aton(l)
-                    o += struct.pack('!BB4sH', 1, 2, ip, int(h))
-                else:
-                    o += struct.pack('!BBHI', 0, 2, int(l), int(h))
+        return _unwords(self.value)
+
+class _Triples:
+    # an array of (global, local1, local2) words seen as a sequence of
+    # tuples, for bisect
+    def __init__(self, words):
+        self.words = words
+
+    def __len__(self):
+        return len(self.words) // 3
+
+    def __getitem__(self, i):
+        w = self.words
+        i = i*3
+        return (w[i], w[i+1], w[i+2])
+
+class LargeCommunities(_Matching, PathAttr):
+    """LARGE_COMMUNITY (RFC 8092).
+
+    "value" is a sorted array of 32-bit ints, three per community; use
+    communities() for them as (global, local1, local2) tuples. Membership
+    tests take tuples or 'global:local1:local2' strings.
+    """
+
+    typenum = 32
+    type = 'largecommunities'
+    # optional, transitive
+    flags = 0xc0
+
+    parse = staticmethod(large_community)
+
+    def __init__(self, val=()):
+        self.value = self._pack(set([large_community(v) for v in val]))
+
+    def _pack(cls, triples):
+        words = array.array('I')
+        for t in sorted(triples):
+            words.extend(t)
+        return words
+    _pack = classmethod(_pack)
+
+    def members(self):
+        return _Triples(self.value)
+
+    def communities(self):
+        return list(self.members())
+
+    def __repr__(self):
+        return '<largecommunities %s>' % (' '.join([
+            '%d:%d:%d' % t for t in self.members()
+            ]),)
+
+    def from_bytes(cls, val):
+        if len(val) % 12:
+            raise Exception('invalid large community length %d' % (len(val),))
+        t = _Triples(_words(val))
+        v = cls()
+        v.value = cls._pack(set([t[i] for i in xrange(len(t))]))
+        return v
+    from_bytes = classmethod(from_bytes)
+
+    def packvalue(self):
+        return _unwords(self.value)
+
+def having_any(routes, wanted, name='communities'):
+    """Yield the (key, attrs) pairs of "routes" whose attrs[name] has any
+    of "wanted", a set from community_set(), large_community_set() or, for
+    'extcommunity', route_target_set().
+
+    Each distinct attribute object is checked once: filtering a table whose
+    attributes are interned costs one check per distinct set of
+    communities, not one per route.
+    """
+    seen = {}
+    for key, attrs in routes:
+        a = attrs.get(name)
+        if a is None:
+            continue
+        hit = seen.get(id(a))
+        if hit is None:
+            # keep the attribute too, so its id is not reused
+            hit = seen[id(a)] = (a, a.has_any(wanted))
+        if hit[1]:
+            yield key, attrs
+
+class AttrSet(object):
+    """An immutable set of path attributes, as handed out by an Interner.
+
+    Looks like the ordered dict of an Update: keyed by attribute name, in
+    wire order. encode() returns the bytes it was interned under, if asked
+    for the same AS number size; "refs" counts the routes holding it.
+    "cache" is free for users of the set to keep something derived from
+    the attributes in, such as the ranking rib.LocRib compares.
+    """
+
+    __slots__ = ('_keys', '_attrs', 'key', 'asn4', 'refs', 'cache')
+
+    def __init__(self, attrs, key, asn4=False):
+        self._keys = tuple([a.type for a in attrs])
+        self._attrs = dict([(a.type, a) for a in attrs])
+        self.key = key
+        self.asn4 = asn4
+        self.refs = 0
+        self.cache = None
+
+    def __getitem__(self, name):
+        return self._attrs[name]
+
+    def __contains__(self, name):
+        return name in self._attrs
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, name, default=None):
+        return self._attrs.get(name, default)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [self._attrs[k] for k in self._keys]
+
+    def items(self):
+        return [(k, self._attrs[k]) for k in self._keys]
+
+    def encode(self, asn4=None):
+        if asn4 is None or asn4==self.asn4:
+            return self.key
+        return ''.join([a.encode(asn4) for a in self.values()])
+
+    def __repr__(self):
+        return '<AttrSet %s refs=%d>' % (' '.join(self._keys), self.refs)
+
+class Interner:
+    """Shares decoded path attributes between the routes of a table.
+
+    intern_block() takes the path attribute block of an UPDATE. Each
+    attribute is looked up by its received bytes, so identical attributes
+    decode to one frozen object. Everything but MP_REACH_NLRI and
+    MP_UNREACH_NLRI (which carry per-update routes) is interned together as
+    an AttrSet, keyed by the combined bytes. As the same bytes mean
+    different things with 2- and 4-byte AS numbers, the AS number size is
+    part of the key. Sets from a speaker without 4-byte AS support have
+    any AS4_PATH and AS4_AGGREGATOR folded in (see reconcile()), so their
+    AS_PATH and AGGREGATOR hold the real AS numbers.
+
+    Sets are reference counted by the routes using them: acquire() when a
+    route is stored, release() when it is withdrawn or replaced. A set is
+    evicted, along with any attributes no other set uses, when its count
+    drops to zero; sweep() evicts sets decoded since the last sweep that
+    were never acquired. Sweep between batches of UPDATEs, once every one
+    decoded has been stored, so that a set waiting in an UPDATE not yet
+    stored is not evicted and then decoded again.
+    """
+
+    def __init__(self):
+        self.sets = {}
+        # raw bytes -> [attribute, number of sets using it]
+        self.attrs = {}
+        self.fresh = []
+
+        self.lookups = 0
+        self.hits = 0
+        self.attr_lookups = 0
+        self.attr_hits = 0
+
+    def intern_block(self, bytes, asn4=False):
+        """Return (attrset, mp) for a block of path attributes, "mp" being
+        the decoded MP_REACH_NLRI/MP_UNREACH_NLRI, if any."""
+        mp = []
+        spans = []
+        as4 = False
+        for type, start, end in scan(bytes):
+            if type in (14, 15):
+                mp.append(decode(bytes, start, asn4)[1])
             else:
-                o += struct.pack('B', int(k))
-                o += v.decode('hex')
-        return o
+                spans.append((start, end))
+                as4 = as4 or type in (17, 18)
+
+        if mp:
+            key = ''.join([bytes[start:end] for start, end in spans])
+        else:
+            key = bytes
+
+        self.lookups += 1
+        aset = self.sets.get((asn4, key))
+        if aset is not None:
+            self.hits += 1
+            return aset, mp
+
+        attrs = [self._attr(bytes[start:end], asn4) for start, end in spans]
+        if as4 and not asn4:
+            attrs = _reconciled(attrs)
+        aset = AttrSet(attrs, key, asn4)
+        self.sets[asn4, key] = aset
+        self.fresh.append(aset)
+
+        return aset, mp
+
+    def _attr(self, raw, asn4):
+        self.attr_lookups += 1
+        entry = self.attrs.get((asn4, raw))
+        if entry is None:
+            used, attr = decode(raw, 0, asn4)
+            entry = self.attrs[asn4, raw] = [attr.freeze(raw, asn4), 0]
+        else:
+            self.attr_hits += 1
+        entry[1] += 1
+        return entry[0]
+
+    def acquire(self, aset):
+        aset.refs += 1
+
+    def release(self, aset):
+        aset.refs -= 1
+        if aset.refs <= 0:
+            self._evict(aset)
+
+    def sweep(self):
+        for aset in self.fresh:
+            if aset.refs <= 0:
+                self._evict(aset)
+        self.fresh = []
+
+    def _evict(self, aset):
+        asn4 = aset.asn4
+        if self.sets.get((asn4, aset.key)) is not aset:
+            return
+        del self.sets[asn4, aset.key]
+
+        # by the bytes received, as the set may hold reconciled attributes
+        for type, start, end in scan(aset.key):
+            key = (asn4, aset.key[start:end])
+            entry = self.attrs[key]
+            entry[1] -= 1
+            if entry[1]==0:
+                del self.attrs[key]
+
+    def stats(self):
+        """Counts of what is interned, and of the decodes saved: every hit
+        is an attribute set (or attribute) that shared an existing object
+        instead of allocating its own."""
+        return dict(
+                sets=len(self.sets),
+                attrs=len(self.attrs),
+                lookups=self.lookups,
+                hits=self.hits,
+                attr_lookups=self.attr_lookups,
+                attr_hits=self.attr_hits,
+                )
+
 
+for klass in (Origin, AsPath, NextHop, Med, LocalPref, Aggregator,
+        Communities, Originator, ClusterList, MpReachNlri, MpUnreachNlri,
+        ExtCommunity, As4Path, As4Aggregator, LargeCommunities):
+    register(klass)
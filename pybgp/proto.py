@@ -2,10 +2,118 @@
 import struct
 import socket
 
-from odict import OrderedDict as OD
+from pybgp import nlri, pathattr, exceptions
+from pybgp.ordered import OrderedMap
 
+class Capability:
+    """Codec for one OPEN capability code.
 
-from pybgp import nlri, pathattr, exceptions
+    Capabilities are stored in Open.caps under "name", as a list of values
+    (a capability may appear several times). This base class keeps the
+    value as bytes; subclasses convert to and from something friendlier.
+    """
+
+    def __init__(self, code, name):
+        self.code = code
+        self.name = name
+
+    def decode(self, bytes):
+        return bytes
+
+    def encode(self, value):
+        return value
+
+class IntCapability(Capability):
+    """A capability whose value is a single unsigned integer."""
+
+    def __init__(self, code, name, fmt='!I'):
+        Capability.__init__(self, code, name)
+        self.struct = struct.Struct(fmt)
+
+    def decode(self, bytes):
+        value, = self.struct.unpack(bytes)
+        return value
+
+    def encode(self, value):
+        return self.struct.pack(value)
+
+class MultiprotocolCapability(Capability):
+    """RFC 4760 multiprotocol extensions, as dict(afi=..., safi=...)."""
+
+    struct = struct.Struct('!HBB')
+
+    def decode(self, bytes):
+        afi, reserved, safi = self.struct.unpack(bytes)
+        return dict(afi=afi, safi=safi)
+
+    def encode(self, value):
+        return self.struct.pack(value['afi'], 0, value['safi'])
+
+class GracefulRestartCapability(Capability):
+    """RFC 4724 graceful restart, as dict(restart=..., time=...,
+    families=[(afi, safi, forwarding), ...]).
+
+    "restart" is the restart state (R) bit, set by a speaker that has just
+    restarted; "time" is how many seconds its peer should keep its routes
+    for, once the session is lost; "forwarding" says whether forwarding
+    state for the family was kept across the restart.
+    """
+
+    head = struct.Struct('!H')
+    family = struct.Struct('!HBB')
+
+    def decode(self, bytes):
+        head, = self.head.unpack_from(bytes)
+        families = []
+        for idx in range(2, len(bytes) - 3, 4):
+            afi, safi, flags = self.family.unpack_from(bytes, idx)
+            families.append((afi, safi, bool(flags & 0x80)))
+        return dict(restart=bool(head & 0x8000), time=head & 0xfff, families=families)
+
+    def encode(self, value):
+        head = value.get('time', 120) & 0xfff
+        if value.get('restart'):
+            head |= 0x8000
+        v = self.head.pack(head)
+        for afi, safi, forwarding in value.get('families', ()):
+            v += self.family.pack(afi, safi, forwarding and 0x80 or 0)
+        return v
+
+# capability code -> Capability, and the same by name; see register_capability()
+capabilities = {}
+_capnames = {}
+
+def register_capability(codec):
+    """Decode and encode capabilities of codec.code with "codec", replacing
+    any codec registered for the same code or name."""
+    old = capabilities.get(codec.code)
+    if old is not None:
+        del _capnames[old.name]
+    old = _capnames.get(codec.name)
+    if old is not None:
+        del capabilities[old.code]
+
+    capabilities[codec.code] = codec
+    _capnames[codec.name] = codec
+    return codec
+
+def unregister_capability(code):
+    """Forget the codec for capability "code", returning it, or None if
+    there was none; the capability is then kept as raw bytes."""
+    codec = capabilities.pop(code, None)
+    if codec is not None:
+        del _capnames[codec.name]
+    return codec
+
+for codec in (
+        MultiprotocolCapability(1, 'mbgp'),
+        Capability(2, 'refresh'),
+        Capability(6, 'extended-message'),
+        GracefulRestartCapability(64, 'graceful-restart'),
+        IntCapability(65, '4byteas'),
+        Capability(70, 'enhanced-refresh'),
+        ):
+    register_capability(codec)
 
 class Open:
     kind = 'open'
@@ -16,8 +124,8 @@ class Open:
         self.holdtime = holdtime
         self.asnum = asnum
         self.bgpid = bgpid
-        self.caps = OD()
-        self.params = OD()
+        self.caps = OrderedMap()
+        self.params = OrderedMap()
 
     def from_bytes(cls, bytes):
         self = cls(None, None)
@@ -33,8 +141,12 @@ class Open:
 
         offset = 10
         while offset < len(bytes):
+            if offset + 2 > len(bytes):
+                raise exceptions.BadOpen('truncated parameter')
             type, plen = struct.unpack_from('BB', bytes, offset)
             offset += 2
+            if offset + plen > len(bytes):
+                raise exceptions.BadOpen('truncated parameter %d' % (type,))
             value = bytes[offset:offset+plen]
             offset += plen
 
@@ -42,23 +154,22 @@ class Open:
                 # capabilities
                 idx = 0
                 while idx < len(value):
+                    if idx + 2 > len(value):
+                        raise exceptions.BadOpen('truncated capability')
                     kind, clen = struct.unpack_from('BB', value, idx)
                     idx += 2
+                    if idx + clen > len(value):
+                        raise exceptions.BadOpen('truncated capability %d' % (kind,))
                     cap = value[idx:idx+clen]
                     idx += clen
 
-                    if kind==1:
-                        kind = 'mbgp'
-                        iidx = 0
-                        afi, reserved, safi = struct.unpack_from('!HBB', cap)
-                        cap = dict(afi=afi, safi=safi)
-                    elif kind==2:
-                        kind = 'refresh'
-                    elif kind==64:
-                        kind = 'graceful-restart'
-                    elif kind==65:
-                        kind = '4byteas'
-                        cap, = struct.unpack('!I', cap)
+                    codec = capabilities.get(kind)
+                    if codec is not None:
+                        kind = codec.name
+                        try:
+                            cap = codec.decode(cap)
+                        except (struct.error, ValueError, IndexError):
+                            raise exceptions.BadOpen('malformed %s capability' % (kind,))
 
                     if kind in self.caps:
                         self.caps[kind].append(cap)
@@ -77,20 +188,13 @@ class Open:
             params += v
 
         for c,vv in self.caps.items():
-            if c=='mbgp':
-                c = 1
-            elif c=='refresh':
-                c = 2
-            elif c=='graceful-restart':
-                c = 64
-            elif c=='4byteas':
-                c = 65
+            codec = _capnames.get(c)
+            if codec is not None:
+                c = codec.code
 
             for v in vv:
-                if c==1:
-                    v = struct.pack('!HH', v['afi'], v['safi'])
-                elif c==65:
-                    v = struct.pack('!I', v)
+                if codec is not None:
+                    v = codec.encode(v)
 
                 cap = struct.pack('BB', c, len(v)) + v
                 params += struct.pack('BB', 2, len(cap)) + cap
@@ -178,15 +282,66 @@ class Notification:
             v += self.data
         return v
 
+class RouteRefresh:
+    """A ROUTE-REFRESH message (RFC 2918) asking for the routes of one
+    address family to be sent again.
+
+    "subtype" is 0 for the request itself; with enhanced route refresh
+    (RFC 7313) BORR and EORR mark the start and end of the routes sent in
+    answer. Other subtypes are decoded, to be ignored.
+    """
+
+    kind = 'refresh'
+    number = 5
+
+    REQUEST = 0
+    BORR = 1
+    EORR = 2
+
+    SUBTYPES = {0: 'request', 1: 'BoRR', 2: 'EoRR'}
+
+    def __init__(self, afi=1, safi=1, subtype=0):
+        self.afi = afi
+        self.safi = safi
+        self.subtype = subtype
+
+    def from_bytes(cls, bytes):
+        afi, subtype, safi = struct.unpack('!HBB', bytes)
+        return cls(afi, safi, subtype)
+    from_bytes = classmethod(from_bytes)
+
+    def family(self):
+        return (self.afi, self.safi)
+
+    def encode(self):
+        return struct.pack('!HBB', self.afi, self.subtype, self.safi)
+
+    def __str__(self):
+        return 'Route refresh %s afi=%d safi=%d' % (
+                self.SUBTYPES.get(self.subtype, self.subtype), self.afi, self.safi)
+
+def end_of_rib(afi=1, safi=1):
+    """The End-of-RIB marker of a family (RFC 4724): an empty UPDATE for
+    IPv4 unicast, otherwise one holding just an empty MP_UNREACH_NLRI."""
+    if (afi, safi)==(1, 1):
+        return Update()
+    return Update(pathattr.MpUnreachNlri(dict(afi=afi, safi=safi, withdraw=[])))
 
 class Update:
     kind = 'update'
     number = 2
 
+    # (attributes, encoded block) kept by attrblock()
+    _block = None
+
     def __init__(self, *pathattr, **kw):
         self.nlri = []
         self.withdraw = []
-        self.pathattr = OD()
+        self.pathattr = OrderedMap()
+
+        # the shared pathattr.AttrSet of everything but the MP attributes,
+        # when decoded with an Interner
+        self.attrset = None
 
         for n in kw.pop('nlri', []):
             if isinstance(n, str):
@@ -198,11 +353,11 @@ class Update:
                 w = nlri.ipv4(w)
             self.withdraw.append(w)
 
-        self.pathattr = OD()
+        self.pathattr = OrderedMap()
         for p in pathattr:
             self.pathattr[p.type] = p
 
-    def from_bytes(cls, bytes):
+    def from_bytes(cls, bytes, interner=None, asn4=False):
         self = cls()
 
         d = {}
@@ -217,20 +372,58 @@ class Update:
         self.nlri = nlri.parse(bytes[idx:])
         self.withdraw = nlri.parse(d['withdraw'])
 
-        self.pathattr = OD()
+        self.pathattr = OrderedMap()
+
+        if interner is not None:
+            self.attrset, mp = interner.intern_block(d['pathattr'], asn4)
+            for kind, attr in self.attrset.items():
+                self.pathattr[kind] = attr
+            for attr in mp:
+                self.pathattr[attr.type] = attr
+            return self
 
         idx = 0
         bytes = d['pathattr']
 
         while idx < len(bytes):
 
-            used, pattr = pathattr.decode(bytes, idx)
+            used, pattr = pathattr.decode(bytes, idx, asn4)
             idx += used
             self.pathattr[pattr.type] = pattr
 
         return self
     from_bytes = classmethod(from_bytes)
 
+    def reconcile(self):
+        """Fold any AS4_PATH and AS4_AGGREGATOR, as sent by a speaker
+        without 4-byte AS support, into AS_PATH and AGGREGATOR; see
+        pathattr.reconcile()."""
+        pathattr.reconcile(self.pathattr)
+
+    def attributes(self, asn4=False):
+        """The path attributes to send, with or without 4-byte AS numbers;
+        see pathattr.sendable()."""
+        return pathattr.sendable(self.pathattr.values(), asn4)
+
+    def iter_nlri(self):
+        return iter(self.nlri)
+
+    def iter_withdraw(self):
+        return iter(self.withdraw)
+
+    def eor(self):
+        """The (afi, safi) this is the End-of-RIB marker of, or None."""
+        if self.nlri or self.withdraw:
+            return None
+        if not self.pathattr:
+            return (1, 1)
+        unreach = self.pathattr.get('mp-unreach-nlri')
+        if len(self.pathattr)!=1 or unreach is None:
+            return None
+        for prefix in unreach.iter_withdraw():
+            return None
+        return unreach.family()
+
     def __repr__(self):
         s =  '<Update message withdraw=%r' % (self.withdraw,)
         for type,p in self.pathattr.items():
@@ -248,12 +441,12 @@ class Update:
     def __cmp__(self, other):
         if isinstance(other, Update):
             return cmp(
-                    (self.pathattr, self.withdraw, self.nlri),
-                    (other.pathattr, other.withdraw, other.nlri),
+                    (self.pathattr.items(), self.withdraw, self.nlri),
+                    (other.pathattr.items(), other.withdraw, other.nlri),
                     )
         return -1
 
-    def encode(self):
+    def encode(self, asn4=False):
         v = ''
 
         w = ''
@@ -263,9 +456,7 @@ class Update:
         v += struct.pack('!H', len(w))
         v += w
 
-        p = ''
-        for kind, attr in self.pathattr.items():
-            p += attr.encode()
+        p = self.attrblock(asn4)
         v += struct.pack('!H', len(p))
         v += p
 
@@ -274,9 +465,339 @@ class Update:
 
         return v
 
+    def attrblock(self, asn4=False):
+        """The encoded path attributes.
+
+        When every attribute is frozen the block is kept for as long as the
+        same attribute objects are in place, so an Update sent to many
+        peers joins its attributes once.
+        """
+        attrs = self.attributes(asn4)
+
+        if self._block is not None:
+            mode, cached, block = self._block
+            if mode==asn4 and len(cached)==len(attrs):
+                for a, b in zip(cached, attrs):
+                    if a is not b:
+                        break
+                else:
+                    return block
+
+        block = ''.join([a.encode(asn4) for a in attrs])
+        for a in attrs:
+            if not a.frozen():
+                break
+        else:
+            self._block = (asn4, attrs, block)
+        return block
+
+    def encode_iter(self, max_len=4096, asn4=False):
+        """Encode as one or more UPDATE bodies, each fitting in a message of
+        "max_len" bytes.
+
+        When the whole update does not fit, withdrawn routes, NLRI and the
+        contents of MP_REACH_NLRI and MP_UNREACH_NLRI are spread over as
+        many messages as needed. Withdrawals go first, in messages of their
+        own; each message with NLRI repeats the other attributes, which are
+        encoded once.
+        """
+        limit = max_len - 19
+
+        # the encoded attributes in order, with None where the MP ones go
+        block = []
+        mpreach = mpunreach = None
+        for attr in self.attributes(asn4):
+            if attr.type=='mp-reach-nlri':
+                mpreach = attr
+                rpos = len(block)
+                block.append(None)
+            elif attr.type=='mp-unreach-nlri':
+                mpunreach = attr
+                upos = len(block)
+                block.append(None)
+            else:
+                block.append(attr.encode(asn4))
+        common = ''.join([b for b in block if b is not None])
+
+        withdraw = [n.encode() for n in self.iter_withdraw()]
+        nlri = [n.encode() for n in self.iter_nlri()]
+
+        rhead = uhead = ''
+        mpnlri = mpwithdraw = []
+        if mpreach is not None:
+            rhead = mpreach.packhead()
+            mpnlri = [n.encode() for n in mpreach.iter_nlri()]
+        if mpunreach is not None:
+            uhead = mpunreach.packhead()
+            mpwithdraw = [n.encode() for n in mpunreach.iter_withdraw()]
+
+        size = 4 + len(common) + sum(map(len, withdraw)) + sum(map(len, nlri))
+        if mpreach is not None:
+            size += _mpsize(rhead, sum(map(len, mpnlri)))
+        if mpunreach is not None:
+            size += _mpsize(uhead, sum(map(len, mpwithdraw)))
+
+        if size <= limit:
+            # it all fits: put together what was encoded for the sizing
+            # rather than encoding everything again
+            if mpreach is not None:
+                block[rpos] = _mpjoin(mpreach, rhead, mpnlri, asn4)
+            if mpunreach is not None:
+                block[upos] = _mpjoin(mpunreach, uhead, mpwithdraw, asn4)
+            w = ''.join(withdraw)
+            p = ''.join(block)
+            yield struct.pack('!H', len(w)) + w + struct.pack('!H', len(p)) + p + ''.join(nlri)
+            return
+
+        for w, u in _fill(limit, 4, withdraw, mpwithdraw, uhead):
+            w = ''.join(w)
+            p = ''
+            if u:
+                p = mpunreach.wrap(uhead + ''.join(u))
+            yield struct.pack('!H', len(w)) + w + struct.pack('!H', len(p)) + p
+
+        for n, r in _fill(limit, 4 + len(common), nlri, mpnlri, rhead):
+            p = common
+            if r:
+                p += mpreach.wrap(rhead + ''.join(r))
+            yield '\0\0' + struct.pack('!H', len(p)) + p + ''.join(n)
+
+def _mpjoin(attr, head, pieces, asn4):
+    # an MP attribute from its encoded head and prefixes, or as kept
+    if attr.frozen():
+        return attr.encode(asn4)
+    return attr.wrap(head + ''.join(pieces))
+
+def _mpsize(head, n):
+    # the encoded size of an MP attribute holding "head" then n bytes
+    v = len(head) + n
+    if v > 255:
+        return 4 + v
+    return 3 + v
+
+def _fill(limit, fixed, plain, mp, head):
+    """Split encoded prefixes into chunks that fit "limit" bytes together
+    with "fixed" bytes of other content; "plain" ones go in a field of the
+    message itself and "mp" ones in an MP attribute starting with "head".
+    Returns a list of (plain, mp) chunks."""
+    chunks = []
+    a, alen, b, blen = [], 0, [], 0
+
+    for piece in plain:
+        size = fixed + alen + len(piece)
+        if size > limit and a:
+            chunks.append((a, b))
+            a, alen, b, blen = [], 0, [], 0
+            size = fixed + len(piece)
+        if size > limit:
+            raise Exception('prefix does not fit in %d bytes' % (limit,))
+        a.append(piece)
+        alen += len(piece)
+
+    for piece in mp:
+        size = fixed + alen + _mpsize(head, blen + len(piece))
+        if size > limit and (a or b):
+            chunks.append((a, b))
+            a, alen, b, blen = [], 0, [], 0
+            size = fixed + _mpsize(head, len(piece))
+        if size > limit:
+            raise Exception('prefix does not fit in %d bytes' % (limit,))
+        b.append(piece)
+        blen += len(piece)
+
+    if a or b:
+        chunks.append((a, b))
+    return chunks
+
+
+class LazyPathAttrs(object):
+    """The path attributes of a LazyUpdate.
+
+    Behaves like the ordered dict of an Update, keyed by attribute name in
+    wire order, but only the attribute headers are read up front. Each
+    attribute is decoded the first time it is looked up and kept; encode()
+    reuses the received bytes of any attribute that was never decoded.
+    "asn4" is the AS number size they were received with.
+    """
+
+    __slots__ = ('_bytes', '_keys', '_spans', '_attrs', '_asn4')
+
+    def __init__(self, bytes='', asn4=False):
+        self._bytes = bytes
+        self._keys = []
+        self._spans = {}
+        self._attrs = {}
+        self._asn4 = asn4
+
+        for type, start, end in pathattr.scan(bytes):
+            name = pathattr.typename(type)
+            if name not in self._spans:
+                self._keys.append(name)
+            self._spans[name] = (start, end)
+
+    def __getitem__(self, key):
+        try:
+            return self._attrs[key]
+        except KeyError:
+            pass
+
+        start, end = self._spans[key]
+        used, attr = pathattr.decode(self._bytes, start, self._asn4)
+        self._attrs[key] = attr
+        return attr
+
+    def __setitem__(self, key, attr):
+        if key not in self._spans:
+            self._keys.append(key)
+        self._spans[key] = None
+        self._attrs[key] = attr
+
+    def __delitem__(self, key):
+        del self._spans[key]
+        self._attrs.pop(key, None)
+        self._keys.remove(key)
+
+    def __contains__(self, key):
+        return key in self._spans
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, key, default=None):
+        if key in self._spans:
+            return self[key]
+        return default
+
+    def keys(self):
+        return self._keys[:]
+
+    def values(self):
+        return [self[k] for k in self._keys]
+
+    def items(self):
+        return [(k, self[k]) for k in self._keys]
+
+    def encode(self):
+        p = ''
+        for k in self._keys:
+            if k in self._attrs:
+                p += self._attrs[k].encode(self._asn4)
+            else:
+                start, end = self._spans[k]
+                p += self._bytes[start:end]
+        return p
+
+class LazyUpdate(Update):
+    """An Update that decodes on demand.
+
+    from_bytes() only splits the message into its withdrawn routes, path
+    attribute and NLRI sections. "withdraw" and "nlri" are parsed the first
+    time they are read and "pathattr" is a LazyPathAttrs; sections that were
+    never looked at are encoded from the received bytes, as long as the AS
+    number size is the one they were received with. With an Interner,
+    "attrset" is interned the first time it is read.
+    """
+
+    def __init__(self, withdraw='', pathattr='', nlri='', interner=None, asn4=False):
+        self.raw_withdraw = withdraw
+        self.raw_pathattr = pathattr
+        self.raw_nlri = nlri
+        self.interner = interner
+        self.asn4 = asn4
+
+    def __getattr__(self, name):
+        if name=='nlri':
+            value = nlri.parse(self.raw_nlri)
+        elif name=='withdraw':
+            value = nlri.parse(self.raw_withdraw)
+        elif name=='pathattr':
+            value = LazyPathAttrs(self.raw_pathattr, self.asn4)
+        elif name=='attrset':
+            value = None
+            if self.interner is not None:
+                value, mp = self.interner.intern_block(self.raw_pathattr, self.asn4)
+        else:
+            raise AttributeError(name)
+
+        setattr(self, name, value)
+        return value
+
+    def iter_nlri(self):
+        if 'nlri' in self.__dict__:
+            return iter(self.nlri)
+        return nlri.iterparse(self.raw_nlri)
+
+    def iter_withdraw(self):
+        if 'withdraw' in self.__dict__:
+            return iter(self.withdraw)
+        return nlri.iterparse(self.raw_withdraw)
+
+    def eor(self):
+        d = self.__dict__
+        if 'nlri' in d or 'withdraw' in d or 'pathattr' in d:
+            return Update.eor(self)
+        # an empty MP_UNREACH_NLRI takes 6 or 7 bytes; anything more is
+        # not a marker, and needs no decoding to tell
+        if self.raw_withdraw or self.raw_nlri or len(self.raw_pathattr) > 7:
+            return None
+        return Update.eor(self)
+
+    def from_bytes(cls, bytes, interner=None, asn4=False):
+        wlen, = struct.unpack_from('!H', bytes)
+        idx = 2 + wlen
+        plen, = struct.unpack_from('!H', bytes, idx)
+        idx += 2
+
+        return cls(bytes[2:2+wlen], bytes[idx:idx+plen], bytes[idx+plen:],
+                interner, asn4)
+    from_bytes = classmethod(from_bytes)
+
+    def encode(self, asn4=False):
+        d = self.__dict__
+
+        if 'withdraw' in d:
+            w = ''.join([n.encode() for n in self.withdraw])
+        else:
+            w = self.raw_withdraw
+
+        if asn4!=self.asn4:
+            p = self.attrblock(asn4)
+        elif 'pathattr' in d:
+            p = self.pathattr.encode()
+        else:
+            p = self.raw_pathattr
+
+        if 'nlri' in d:
+            n = ''.join([n.encode() for n in self.nlri])
+        else:
+            n = self.raw_nlri
+
+        return struct.pack('!H', len(w)) + w + struct.pack('!H', len(p)) + p + n
+
 
 class ProtoBase:
+    # decoded UPDATEs are instances of this; set it to LazyUpdate to defer
+    # decoding until the message contents are looked at
+    update_class = Update
+
+    # a pathattr.Interner to share attributes between received UPDATEs;
+    # a session sweeps it as each read comes in, by when the UPDATEs of the
+    # previous one have been handled
+    interner = None
+
+    # whether AS numbers in UPDATEs are four bytes, once both sides have
+    # sent the 4byteas capability
+    asn4 = False
+
     def parse_payload(self, type, payload):
+        if isinstance(payload, memoryview):
+            # the speaker hands us a view into its receive buffer; take the
+            # one copy the decoders need here
+            payload = payload.tobytes()
+
         length = len(payload)
         totlen = length + 19
 
@@ -288,7 +809,7 @@ class ProtoBase:
         elif type==2:
             if length<4:
                 raise exceptions.BadLen(type, totlen)
-            return Update.from_bytes(payload)
+            return self.update_class.from_bytes(payload, self.interner, self.asn4)
 
         elif type==3:
             if length<2:
@@ -300,5 +821,10 @@ class ProtoBase:
                 print "keepalive with data? %r" % (payload,)
             return Keepalive.from_bytes(payload)
 
+        elif type==5:
+            if length!=4:
+                raise exceptions.BadRefreshLen(payload)
+            return RouteRefresh.from_bytes(payload)
+
         raise exceptions.BadMsg(type)
 
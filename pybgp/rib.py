@@ -0,0 +1,595 @@
+import socket
+import struct
+
+from pybgp import nlri, pathattr, packer, session
+
+# the (afi, safi) of IPv4 unicast, and of vpnv4 as carried in
+# MP_REACH_NLRI/MP_UNREACH_NLRI
+IPV4 = (1, 1)
+VPNV4 = (1, 128)
+
+def ipv4_key(prefix):
+    """The int an IPv4 prefix is stored under: (address << 6) | masklen."""
+    if isinstance(prefix, str):
+        prefix = nlri.ipv4(prefix)
+    return hash(prefix)
+
+def ipv4_prefix(key):
+    return nlri.ipv4.from_int(key >> 6, key & 63)
+
+def route_key(prefix):
+    """The key a route is stored under: ipv4_key() for an nlri.ipv4 (or
+    prefix string), (rd, ipv4_key()) for an nlri.vpnv4, whose labels are
+    not part of it."""
+    if isinstance(prefix, nlri.vpnv4):
+        return (prefix.rd, ipv4_key(prefix.prefix))
+    return ipv4_key(prefix)
+
+class AdjRibIn:
+    """The routes received from one peer (the RFC 4271 Adj-RIB-In).
+
+    apply() takes each decoded UPDATE: IPv4 routes from its NLRI and
+    withdrawn routes, and vpnv4 routes from MP_REACH_NLRI/MP_UNREACH_NLRI.
+    The attributes of a route are the AttrSet of everything but the MP
+    attributes, shared through "interner" with every other route (and,
+    given the same interner, every other peer) with the same attributes.
+
+    IPv4 routes are kept under the int of ipv4_key() with their AttrSet as
+    the value; vpnv4 routes under (rd, ipv4_key()) with a tuple of
+    (AttrSet, next hop, labels). get() and routes() hand out the same
+    values. flush() drops everything at once, for when the session goes
+    down.
+
+    UPDATEs are best decoded with the same interner, as the session does
+    when its "interner" is set to this one; otherwise apply() interns the
+    attributes itself. apply() leaves sweeping the interner to whoever
+    decodes: the session sweeps before decoding each read, and a caller
+    decoding UPDATEs itself should sweep once a batch has been applied.
+
+    For graceful restart (RFC 4724), mark_stale() keeps the routes of a
+    lost session instead of flush(): each route the peer sends again is no
+    longer stale, and the End-of-RIB marker of a family, passed to apply()
+    like any UPDATE, drops those of the family that are left. sweep() does
+    the same without one, as when the restart time runs out. The same
+    pair serves enhanced route refresh, from BoRR to EoRR.
+    """
+
+    def __init__(self, interner=None, asn4=False):
+        if interner is None:
+            interner = pathattr.Interner()
+        self.interner = interner
+        self.asn4 = asn4
+
+        self.ipv4 = {}
+        self.vpnv4 = {}
+        # rd strings and next hops, so each is stored once
+        self._strings = {}
+        # family -> set of the keys of routes still stale
+        self.stale = {}
+
+    def __len__(self):
+        return len(self.ipv4) + len(self.vpnv4)
+
+    def apply(self, update):
+        """Apply a decoded UPDATE, returning the prefixes it changed."""
+        changed = []
+        interner = self.interner
+
+        if self.stale:
+            family = update.eor()
+            if family is not None:
+                return self.sweep(family)
+
+        reach = update.pathattr.get('mp-reach-nlri')
+        unreach = update.pathattr.get('mp-unreach-nlri')
+
+        for prefix in update.iter_withdraw():
+            if self._drop_ipv4(hash(prefix)):
+                changed.append(prefix)
+
+        if unreach is not None and unreach.family()==VPNV4:
+            for prefix in unreach.iter_withdraw():
+                if self._drop_vpnv4(self._vpnv4_key(prefix)):
+                    changed.append(prefix)
+
+        if reach is not None and reach.family()!=VPNV4:
+            reach = None
+
+        aset = None
+        plain = list(update.iter_nlri())
+        if plain or reach is not None:
+            aset = update.attrset
+            if aset is None:
+                aset, mp = interner.intern_block(update.attrblock(self.asn4), self.asn4)
+
+        for prefix in plain:
+            self._store_ipv4(hash(prefix), aset)
+            changed.append(prefix)
+
+        if reach is not None:
+            nh = self._string(reach.nexthop())
+            for prefix in reach.iter_nlri():
+                labels = prefix.labels
+                if labels is not None:
+                    labels = tuple(labels)
+                self._store_vpnv4(self._vpnv4_key(prefix), (aset, nh, labels))
+                changed.append(prefix)
+
+        return changed
+
+    def _string(self, s):
+        return self._strings.setdefault(s, s)
+
+    def _vpnv4_key(self, prefix):
+        return (self._string(prefix.rd), ipv4_key(prefix.prefix))
+
+    def _store_ipv4(self, key, aset):
+        if self.stale:
+            self._fresh(IPV4, key)
+        self.interner.acquire(aset)
+        old = self.ipv4.get(key)
+        self.ipv4[key] = aset
+        if old is not None:
+            self.interner.release(old)
+
+    def _store_vpnv4(self, key, route):
+        if self.stale:
+            self._fresh(VPNV4, key)
+        self.interner.acquire(route[0])
+        old = self.vpnv4.get(key)
+        self.vpnv4[key] = route
+        if old is not None:
+            self.interner.release(old[0])
+
+    def _drop_ipv4(self, key):
+        if self.stale:
+            self._fresh(IPV4, key)
+        old = self.ipv4.pop(key, None)
+        if old is None:
+            return False
+        self.interner.release(old)
+        return True
+
+    def _drop_vpnv4(self, key):
+        if self.stale:
+            self._fresh(VPNV4, key)
+        old = self.vpnv4.pop(key, None)
+        if old is None:
+            return False
+        self.interner.release(old[0])
+        return True
+
+    def get(self, prefix):
+        """The AttrSet of an nlri.ipv4 (or prefix string), or the
+        (AttrSet, next hop, labels) of an nlri.vpnv4; None if absent."""
+        key = route_key(prefix)
+        if isinstance(key, tuple):
+            return self.vpnv4.get(key)
+        return self.ipv4.get(key)
+
+    def __contains__(self, prefix):
+        return self.get(prefix) is not None
+
+    def routes(self):
+        """Yield (prefix, value) for every route, prefixes being nlri.ipv4
+        and nlri.vpnv4 objects."""
+        for key, aset in self.ipv4.iteritems():
+            yield ipv4_prefix(key), aset
+        for (rd, key), route in self.vpnv4.iteritems():
+            yield self._vpnv4_prefix(rd, key, route), route
+
+    def _vpnv4_prefix(self, rd, key, route):
+        labels = route[2]
+        if labels is not None:
+            labels = list(labels)
+        return nlri.vpnv4(labels, rd, ipv4_prefix(key).prefix)
+
+    def flush(self):
+        """Drop every route, returning the prefixes dropped."""
+        release = self.interner.release
+
+        dropped = []
+        for key, aset in self.ipv4.iteritems():
+            release(aset)
+            dropped.append(ipv4_prefix(key))
+        for (rd, key), route in self.vpnv4.iteritems():
+            release(route[0])
+            dropped.append(self._vpnv4_prefix(rd, key, route))
+
+        self.ipv4 = {}
+        self.vpnv4 = {}
+        self._strings = {}
+        self.stale = {}
+        return dropped
+
+    def _fresh(self, family, key):
+        stale = self.stale.get(family)
+        if stale is not None:
+            stale.discard(key)
+
+    def mark_stale(self, family=None):
+        """Mark every route of "family" (an (afi, safi) pair), or of all
+        families if None, as stale."""
+        # a family without routes has nothing to wait for
+        if family in (None, IPV4) and self.ipv4:
+            self.stale[IPV4] = set(self.ipv4)
+        if family in (None, VPNV4) and self.vpnv4:
+            self.stale[VPNV4] = set(self.vpnv4)
+
+    def is_stale(self, prefix):
+        key = route_key(prefix)
+        stale = self.stale.get(_family(key))
+        return stale is not None and key in stale
+
+    def sweep(self, family=None):
+        """Drop the routes of "family", or of all families if None, that
+        are still stale, returning their prefixes."""
+        dropped = []
+        for fam in self.stale.keys():
+            if family is not None and fam!=family:
+                continue
+            stale = self.stale.pop(fam)
+            if fam==VPNV4:
+                for key in stale:
+                    route = self.vpnv4[key]
+                    dropped.append(self._vpnv4_prefix(key[0], key[1], route))
+                    self._drop_vpnv4(key)
+            else:
+                for key in stale:
+                    self._drop_ipv4(key)
+                    dropped.append(ipv4_prefix(key))
+        return dropped
+
+    def stats(self):
+        s = self.interner.stats()
+        s.update(ipv4=len(self.ipv4), vpnv4=len(self.vpnv4))
+        return s
+
+class AdjRibOut:
+    """The routes advertised to one peer (the RFC 4271 Adj-RIB-Out).
+
+    advertise() and withdraw() only note the prefix as pending, with the
+    attributes it should have, so a change costs the same however many
+    routes there are. updates() packs the pending changes that differ from
+    what was last sent into UPDATEs, and records them as sent: call it
+    whenever the peer may be sent to, and only the delta goes out.
+
+    Prefixes are as for packer.Packer, and "attrs" sequences of path
+    attributes; handing out the same (frozen) attribute objects for every
+    route lets both the comparison with what was sent and the packing stay
+    cheap.
+
+    The routes sent are also grouped by address family and attrs object,
+    and replay() hands out the encoded UPDATE bodies of a family for
+    answering a ROUTE-REFRESH. The bodies of each group are kept until a
+    route of the group changes, so a refresh only packs and encodes the
+    groups that changed since the last one.
+    """
+
+    def __init__(self):
+        # route_key() -> (prefix, attrs) as sent
+        self.sent = {}
+        # route_key() -> (prefix, attrs, or None to withdraw)
+        self.pending = {}
+        # (family, id(attrs)) -> _Group of the routes sent with attrs
+        self.groups = {}
+
+    def __len__(self):
+        return len(self.sent)
+
+    def advertise(self, prefix, attrs):
+        if isinstance(prefix, str):
+            prefix = nlri.ipv4(prefix)
+        self.pending[route_key(prefix)] = (prefix, attrs)
+
+    def withdraw(self, prefix):
+        if isinstance(prefix, str):
+            prefix = nlri.ipv4(prefix)
+        self.pending[route_key(prefix)] = (prefix, None)
+
+    def updates(self, max_len=session.MAX_LEN, asn4=False):
+        """The UPDATEs taking the peer from what it was sent to what is
+        pending, which then counts as sent."""
+        p = packer.Packer(max_len, asn4)
+        sent = self.sent
+
+        for key, (prefix, attrs) in self.pending.iteritems():
+            old = sent.get(key)
+            if attrs is None:
+                if old is not None:
+                    del sent[key]
+                    self._ungroup(key, old[1])
+                    p.withdraw(prefix)
+            elif old is None or not _same(old[1], attrs):
+                if old is not None:
+                    self._ungroup(key, old[1])
+                sent[key] = (prefix, attrs)
+                self._group(key, attrs)
+                p.advertise(prefix, attrs)
+
+        self.pending = {}
+        return p.updates()
+
+    def _group(self, key, attrs):
+        gkey = (_family(key), id(attrs))
+        group = self.groups.get(gkey)
+        if group is None:
+            group = self.groups[gkey] = _Group(attrs)
+        group.keys.add(key)
+        group.bodies = None
+
+    def _ungroup(self, key, attrs):
+        gkey = (_family(key), id(attrs))
+        group = self.groups[gkey]
+        group.keys.discard(key)
+        group.bodies = None
+        if not group.keys:
+            # the attrs object may go, and its id with it
+            del self.groups[gkey]
+
+    def replay(self, family=IPV4, max_len=session.MAX_LEN, asn4=False):
+        """The encoded UPDATE bodies advertising every route of "family"
+        (an (afi, safi) pair) as last sent, or of all families if None."""
+        bodies = []
+        for (fam, i), group in self.groups.iteritems():
+            if family is not None and fam!=family:
+                continue
+            if group.bodies is None or group.params!=(max_len, asn4):
+                group.params = (max_len, asn4)
+                group.bodies = self._encode(group, max_len, asn4)
+            bodies.extend(group.bodies)
+        return bodies
+
+    def _encode(self, group, max_len, asn4):
+        p = packer.Packer(max_len, asn4)
+        sent = self.sent
+        for key in group.keys:
+            p.advertise(sent[key][0], group.attrs)
+
+        bodies = []
+        for up in p.updates():
+            bodies.extend(up.encode_iter(max_len, asn4))
+        return bodies
+
+    def resend(self):
+        """Mark every route sent as pending again, so the next updates()
+        sends the whole table; changes still pending win over what was
+        sent."""
+        pending = dict(self.sent)
+        pending.update(self.pending)
+        self.pending = pending
+        self.sent = {}
+        self.groups = {}
+
+    def clear(self):
+        """Forget everything, as when the session goes down."""
+        self.sent = {}
+        self.pending = {}
+        self.groups = {}
+
+class _Group(object):
+    # the routes an AdjRibOut sent with one attrs object, and their
+    # encoded UPDATE bodies for "params", (max_len, asn4), once replayed
+    __slots__ = ('attrs', 'keys', 'params', 'bodies')
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+        self.keys = set()
+        self.params = None
+        self.bodies = None
+
+def _family(key):
+    # route_key() of a vpnv4 route is a tuple, of an IPv4 route an int
+    if isinstance(key, tuple):
+        return VPNV4
+    return IPV4
+
+def _same(a, b):
+    if a is b:
+        return True
+    if len(a)!=len(b):
+        return False
+    for x, y in zip(a, b):
+        if x is not y and x!=y:
+            return False
+    return True
+
+ORIGINS = {'igp': 0, 'egp': 1, 'incomplete': 2}
+
+# LOCAL_PREF assumed for routes without one
+DEFAULT_LOCAL_PREF = 100
+
+def _addr(ip):
+    # a dotted quad as an int, for lowest-address comparisons
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+class Peer:
+    """A peer feeding a LocRib: its Adj-RIB-In, plus what the decision
+    process needs to know about it."""
+
+    def __init__(self, name, bgpid, ebgp, adj):
+        self.name = name
+        self.bgpid = _addr(bgpid)
+        self.ebgp = ebgp
+        self.adj = adj
+
+    def __repr__(self):
+        return '<Peer %s>' % (self.name,)
+
+class LocRib:
+    """The best route for every prefix, over the Adj-RIBs-In of all peers.
+
+    Peers are added with add_peer() and their UPDATEs passed to apply();
+    only the prefixes an UPDATE touched are reconsidered. apply(), flush()
+    and remove_peer() return the resulting changes as a list of (prefix,
+    peer, value) in the order they happened: "value" is what the peer's
+    AdjRibIn holds for the prefix, or peer and value are both None when no
+    route is left.
+
+    The decision process (RFC 4271 9.1.2.2, with RFC 4456 for route
+    reflection) prefers, in turn: the highest LOCAL_PREF, the shortest
+    AS_PATH, the lowest ORIGIN, the lowest MED among routes from the same
+    neighbouring AS, routes from eBGP over iBGP peers, the lowest
+    ORIGINATOR_ID or else peer BGP identifier, the shortest CLUSTER_LIST
+    and finally the lowest peer name. There is no IGP cost to compare.
+    """
+
+    def __init__(self, interner=None):
+        if interner is None:
+            interner = pathattr.Interner()
+        self.interner = interner
+
+        self.peers = {}
+        # route_key() -> (prefix, peer, value)
+        self.best = {}
+
+    def add_peer(self, name, bgpid, ebgp=False, asn4=False):
+        """Add a peer, returning its Peer. Its AdjRibIn shares this RIB's
+        interner, which the peer's session should decode with too."""
+        peer = Peer(name, bgpid, ebgp, AdjRibIn(self.interner, asn4))
+        self.peers[name] = peer
+        return peer
+
+    def remove_peer(self, name):
+        changes = self.flush(name)
+        del self.peers[name]
+        return changes
+
+    def apply(self, name, update):
+        """Apply a decoded UPDATE from peer "name"; see AdjRibIn.apply()."""
+        return self._select(self.peers[name].adj.apply(update))
+
+    def flush(self, name):
+        """Drop every route from peer "name", as when its session goes
+        down."""
+        return self._select(self.peers[name].adj.flush())
+
+    def mark_stale(self, name, family=None):
+        """Keep the routes from peer "name" as stale, for a graceful
+        restart; nothing changes until they are swept."""
+        self.peers[name].adj.mark_stale(family)
+
+    def sweep(self, name, family=None):
+        """Drop the routes from peer "name" still stale; see
+        AdjRibIn.sweep()."""
+        return self._select(self.peers[name].adj.sweep(family))
+
+    def get(self, prefix):
+        """The (peer, value) of the best route for "prefix", or None."""
+        best = self.best.get(route_key(prefix))
+        if best is None:
+            return None
+        return best[1:]
+
+    def __len__(self):
+        return len(self.best)
+
+    def routes(self):
+        """Yield (prefix, peer, value) for every best route."""
+        return self.best.itervalues()
+
+    def _select(self, prefixes):
+        changes = []
+        peers = self.peers.values()
+
+        for prefix in prefixes:
+            key = route_key(prefix)
+            vpn = isinstance(key, tuple)
+
+            candidates = []
+            for peer in peers:
+                if vpn:
+                    value = peer.adj.vpnv4.get(key)
+                else:
+                    value = peer.adj.ipv4.get(key)
+                if value is not None:
+                    candidates.append((peer, value))
+
+            old = self.best.get(key)
+            if not candidates:
+                if old is not None:
+                    del self.best[key]
+                    changes.append((prefix, None, None))
+                continue
+
+            peer, value = self.decide(candidates)
+            if old is not None and old[1] is peer and old[2]==value:
+                continue
+            self.best[key] = (prefix, peer, value)
+            changes.append((prefix, peer, value))
+
+        return changes
+
+    def decide(self, candidates):
+        """The best of a list of (peer, value) routes for one prefix."""
+        if len(candidates)==1:
+            return candidates[0]
+
+        routes = []
+        for peer, value in candidates:
+            if isinstance(value, tuple):
+                attrs = value[0]
+            else:
+                attrs = value
+
+            rank = attrs.cache
+            if rank is None:
+                rank = attrs.cache = _rank(attrs)
+            lp, length, origin, neighbour, med, originator, clusters = rank
+
+            routes.append((
+                lp, length, origin,
+                # MED, compared within a neighbouring AS only
+                neighbour, med,
+                not peer.ebgp,
+                originator is None and peer.bgpid or originator,
+                clusters,
+                peer.name,
+                peer, value,
+                ))
+
+        # everything up to ORIGIN is a plain ordering
+        top = min([r[:3] for r in routes])
+        routes = [r for r in routes if r[:3]==top]
+
+        # MED only removes routes beaten by one from the same neighbour AS
+        lowest = {}
+        for r in routes:
+            if r[3] not in lowest or r[4] < lowest[r[3]]:
+                lowest[r[3]] = r[4]
+        routes = [r for r in routes if r[4]==lowest[r[3]]]
+
+        best = min([r[5:9] for r in routes])
+        for r in routes:
+            if r[5:9]==best:
+                return r[9], r[10]
+
+def _rank(attrs):
+    # what the decision process compares of a set of attributes, worked
+    # out once per set; lower is better throughout
+    lp = attrs.get('localpref')
+    aspath = attrs.get('aspath')
+    origin = attrs.get('origin')
+    med = attrs.get('med')
+    originator = attrs.get('originator')
+    clusters = attrs.get('cluster-list')
+
+    length = 0
+    neighbour = None
+    if aspath is not None:
+        length = aspath.length()
+        if aspath.value and aspath.value[0].segtype==2:
+            neighbour = aspath.value[0][0]
+
+    if originator is not None:
+        originator = _addr(originator.value)
+
+    return (
+        -(lp is None and DEFAULT_LOCAL_PREF or lp.value),
+        length,
+        ORIGINS.get(origin and origin.value, 3),
+        neighbour,
+        med is not None and med.value or 0,
+        originator,
+        clusters is not None and len(clusters.value) or 0,
+        )
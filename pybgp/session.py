@@ -0,0 +1,287 @@
+import struct
+import time
+
+from pybgp import proto, pathattr, exceptions
+
+HEADER = struct.Struct('!16sHB')
+MARKER = '\xff'*16
+
+# RFC 4271 message size limit, and the one allowed by RFC 8654 extended
+# messages; OPEN and KEEPALIVE stay within the former regardless
+MAX_LEN = 4096
+MAX_EXTENDED_LEN = 65535
+
+class Session(proto.ProtoBase):
+    """BGP session state without any I/O.
+
+    Received bytes are fed to receive_data(), which returns the decoded
+    messages. Messages passed to send() are queued as encoded bytes, to be
+    collected with data_to_send() and written by the caller. Keepalive and
+    hold timers are tracked as absolute times read from "clock": the caller
+    arranges for tick() to be called at next_deadline(). Once "closing" is
+    set the caller should write any pending data and drop the connection;
+    "reason" says why.
+
+    "max_len" is the largest message either side may send; it is raised to
+    MAX_EXTENDED_LEN once both OPENs carry the extended-message capability.
+    Likewise "asn4" is set once both carry 4byteas, and UPDATEs are then
+    encoded and decoded with 4-byte AS numbers.
+
+    With "ribout" set to the rib.AdjRibOut of the peer, a ROUTE-REFRESH
+    request is answered by queueing the encoded UPDATEs the AdjRibOut
+    keeps for the family, bracketed by BoRR and EoRR when both OPENs carry
+    enhanced-refresh. The request is passed on as well.
+
+    "graceful_restart" is the peer's graceful-restart capability value
+    once both OPENs carry one, None otherwise. The caller should then end
+    its initial UPDATEs with proto.end_of_rib() for each family, and keep
+    the peer's routes as stale for its restart time should the session go
+    down (see rib.AdjRibIn.mark_stale()).
+    """
+
+    # a rib.AdjRibOut to answer ROUTE-REFRESH requests from
+    ribout = None
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+
+        # received bytes accumulate in a bytearray; "offset" is the start of
+        # the first unconsumed message, so framing a burst never re-copies
+        # the tail of the buffer once per message
+        self.buffer = bytearray()
+        self.offset = 0
+
+        self.holdtime = None
+        self.keepalive_at = None
+        self.expiry_at = None
+
+        self.closing = False
+        self.reason = None
+
+        self.local_open = None
+        self.peer_open = None
+        self.max_len = MAX_LEN
+        self.enhanced_refresh = False
+        self.graceful_restart = None
+
+        self._out = []
+
+    def open(self, asnum, bgpid, holdtime=60, **caps):
+        self.holdtime = holdtime
+        open = proto.Open(asnum=asnum, bgpid=bgpid, holdtime=holdtime)
+        open.caps = caps
+        if asnum > 0xffff:
+            # only the capability can carry the real AS number
+            open.asnum = pathattr.AS_TRANS
+            open.caps.setdefault('4byteas', [asnum])
+        self.send(open)
+
+    def send(self, msg):
+        if self.closing:
+            return
+        for header, body in self._encode(msg):
+            self._out.append(header + body)
+
+    def send_many(self, msgs):
+        """Queue several messages at once.
+
+        Headers and bodies are queued as separate chunks rather than joined,
+        for transports that can write a sequence of buffers in one go.
+        """
+        if self.closing:
+            return
+        out = self._out
+        encode = self._encode
+        for msg in msgs:
+            for header, body in encode(msg):
+                out.append(header)
+                if body:
+                    out.append(body)
+
+    def send_encoded(self, number, bodies):
+        """Queue messages of type "number" from already encoded bodies."""
+        if self.closing:
+            return
+        out = self._out
+        limit = self._limit(number)
+        for body in bodies:
+            length = 19 + len(body)
+            if length > limit:
+                raise Exception('message type %d of %d bytes exceeds %d' % (
+                    number, length, limit))
+            out.append(HEADER.pack(MARKER, length, number))
+            out.append(body)
+
+    def refresh(self, msg):
+        """Answer a ROUTE-REFRESH from "ribout"; requests for other
+        families are answered with no routes."""
+        if msg.subtype!=proto.RouteRefresh.REQUEST or self.ribout is None:
+            return
+
+        afi, safi = msg.family()
+        if self.enhanced_refresh:
+            self.send(proto.RouteRefresh(afi, safi, proto.RouteRefresh.BORR))
+        self.send_encoded(proto.Update.number,
+                self.ribout.replay((afi, safi), self.max_len, self.asn4))
+        if self.enhanced_refresh:
+            self.send(proto.RouteRefresh(afi, safi, proto.RouteRefresh.EORR))
+
+    def _encode(self, msg):
+        """Return (header, body) pairs for a message; an UPDATE too large
+        for max_len is split into several."""
+        if msg.kind=='update':
+            bodies = msg.encode_iter(self.max_len, self.asn4)
+        else:
+            bodies = [msg.encode()]
+
+        if msg.kind=='open':
+            self.local_open = msg
+            self._negotiate()
+
+        rv = []
+        for body in bodies:
+            length = 19 + len(body)
+            if length > self._limit(msg.number):
+                raise Exception('%s message of %d bytes exceeds %d' % (
+                    msg.kind, length, self._limit(msg.number)))
+            rv.append((HEADER.pack(MARKER, length, msg.number), body))
+        return rv
+
+    def data_to_send(self):
+        out = self._out
+        self._out = []
+        return out
+
+    def receive_data(self, data):
+        if self.closing:
+            return []
+
+        # the UPDATEs decoded from the last read have been handled by now:
+        # attribute sets none of them stored can go
+        if self.interner is not None:
+            self.interner.sweep()
+
+        self.buffer.extend(data)
+
+        msgs = []
+        view = memoryview(self.buffer)
+        try:
+            self._frame(view, msgs)
+        finally:
+            # the buffer cannot be resized while a view of it is alive
+            del view
+            self._compact()
+
+        return msgs
+
+    def _frame(self, view, msgs):
+        buffer = self.buffer
+
+        while True:
+            offset = self.offset
+            if len(buffer) - offset < 19:
+                return
+            auth, length, type = HEADER.unpack_from(buffer, offset)
+
+            if auth!=MARKER:
+                return self.notify(exceptions.NotSync())
+
+            if length < 19 or length > self._limit(type):
+                return self.notify(exceptions.BadLen(type, length))
+
+            if len(buffer) - offset < length:
+                return
+
+            payload = view[offset+19:offset+length]
+            self.offset = offset + length
+
+            try:
+                msg = self.parse_payload(type, payload)
+            except exceptions.BgpExc, ex:
+                return self.notify(ex)
+
+            if self.expiry_at is not None:
+                self.expiry_at = self.clock() + self.holdtime
+
+            if msg.kind=='open':
+                self.peer_open = msg
+                self._negotiate()
+            elif msg.kind=='refresh':
+                self.refresh(msg)
+
+            if msg.kind!='keepalive':
+                msgs.append(msg)
+
+    def _limit(self, type):
+        if type in (1, 4):
+            return MAX_LEN
+        return self.max_len
+
+    def _negotiate(self):
+        if self.local_open is None or self.peer_open is None:
+            return
+
+        if 'extended-message' in self.local_open.caps and \
+                'extended-message' in self.peer_open.caps:
+            self.max_len = MAX_EXTENDED_LEN
+
+        if '4byteas' in self.local_open.caps and \
+                '4byteas' in self.peer_open.caps:
+            self.asn4 = True
+
+        if 'enhanced-refresh' in self.local_open.caps and \
+                'enhanced-refresh' in self.peer_open.caps:
+            self.enhanced_refresh = True
+
+        if 'graceful-restart' in self.local_open.caps and \
+                'graceful-restart' in self.peer_open.caps:
+            self.graceful_restart = self.peer_open.caps['graceful-restart'][0]
+
+    def _compact(self):
+        # drop consumed bytes once they make up at least half the buffer;
+        # each byte is moved at most once on average, keeping framing linear
+        offset = self.offset
+        if offset==len(self.buffer):
+            self.buffer = bytearray()
+            self.offset = 0
+        elif offset and offset >= len(self.buffer) - offset:
+            del self.buffer[:offset]
+            self.offset = 0
+
+    def notify(self, ex):
+        if ex.send_error:
+            self.send(proto.Notification(ex.code, ex.subcode, ex.data))
+        self.close(ex)
+
+    def close(self, reason):
+        self.closing = True
+        self.reason = reason
+        self.keepalive_at = None
+        self.expiry_at = None
+
+    def start_timer(self, holdtime):
+        self.holdtime = min(self.holdtime, holdtime)
+        if not self.holdtime:
+            # a hold time of zero disables both timers
+            return
+
+        # the first keepalive goes out straight away
+        now = self.clock()
+        self.keepalive_at = now
+        self.expiry_at = now + self.holdtime
+
+    def next_deadline(self):
+        deadlines = [t for t in (self.keepalive_at, self.expiry_at) if t is not None]
+        if deadlines:
+            return min(deadlines)
+        return None
+
+    def tick(self):
+        now = self.clock()
+
+        if self.expiry_at is not None and now >= self.expiry_at:
+            return self.close('hold timer expired')
+
+        if self.keepalive_at is not None and now >= self.keepalive_at:
+            self.send(proto.Keepalive())
+            self.keepalive_at = now + self.holdtime / 2
@@ -1,103 +1,134 @@
-
-import struct
-
-from twisted.internet import reactor, protocol, task
+from twisted.internet import reactor, protocol
 from twisted.python import log
 
-from pybgp import nlri, pathattr, proto, exceptions
+from pybgp import nlri, pathattr, proto, exceptions, session
+
+HEADER = session.HEADER
+MARKER = session.MARKER
 
 class BGP(protocol.Protocol, proto.ProtoBase):
+    """Twisted adapter around a session.Session.
+
+    Received data is fed to the session and the decoded messages passed to
+    handle_msg(); whatever the session wants to send is written straight
+    out with one writeSequence() call, and a single reactor call is kept
+    scheduled for the session's next deadline.
+
+    It is still a proto.ProtoBase, as before the session existed: the
+    "update_class" and "interner" of a subclass (or set before the
+    connection is made) are handed on to the session, which does the
+    decoding, and parse_payload() remains for existing callers.
+    """
 
     def connectionMade(self):
-        self.buffer = ''
-        self.holdtime = None
-        self.keepalive = None
-        self.expiry = None
+        self.session = session.Session(clock=reactor.seconds)
+        self.session.update_class = self.update_class
+        self.session.interner = self.interner
+        self.timer = None
+        self.dropped = False
         self.closed = None
 
+    @property
+    def buffer(self):
+        s = self.session
+        return s.buffer[s.offset:]
+
+    @property
+    def holdtime(self):
+        return self.session.holdtime
+
+    @property
+    def max_len(self):
+        return self.session.max_len
+
+    @property
+    def asn4(self):
+        return self.session.asn4
+
     def open(self, asnum, bgpid, holdtime=60, **caps):
-        self.holdtime = holdtime
-        open = proto.Open(asnum=asnum, bgpid=bgpid, holdtime=holdtime)
-        open.caps = caps
-        self.send(open)
+        self.session.open(asnum, bgpid, holdtime, **caps)
+        self._flush()
 
     def connectionLost(self, reason):
         log.err(reason)
-        if self.expiry:
-            self.expiry.cancel()
-        if self.keepalive:
-            self.keepalive.stop()
+        self._cancel()
         if self.closed:
             self.closed(reason)
 
     def dataReceived(self, data):
-        self.buffer += data
-
-        while True:
-            if len(self.buffer) < 19:
-                return
-            auth, length, type = struct.unpack('!16sHB', self.buffer[:19])
-
-            if auth!='\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff':
-                return self.notify(exceptions.NotSync())
-
-            if length < 19 or length > 4096:
-                return self.notify(exceptions.BadLen(type, length))
-
-            if len(self.buffer) < length:
-                return
-
-            payload = self.buffer[19:length]
-            self.buffer = self.buffer[length:]
-
-            try:
-                msg = self.parse_payload(type, payload)
-            except exceptions.BgpExc, ex:
-                return self.notify(ex)
-
-            self._handle_msg(msg)
+        msgs = self.session.receive_data(data)
+        if msgs:
+            if self.handle_msgs is not None:
+                self.handle_msgs(msgs)
+            else:
+                for msg in msgs:
+                    self.handle_msg(msg)
+        self._flush()
 
     def notify(self, ex):
-        if ex.send_error:
-            log.msg("sending notify", ex)
-            notify = proto.Notification(ex.code, ex.subcode, ex.data)
-            self.send(notify)
-        log.msg("disconnecting")
-        self.transport.loseConnection()
+        self.session.notify(ex)
+        self._flush()
 
     def send(self, msg):
-        body = msg.encode()
-        msg = struct.pack('!16sHB', '\xff'*16, 19+len(body), msg.number) + body
-        self.transport.write(msg)
-
-    def _handle_msg(self, msg):
-        if msg.kind=='keepalive':
-            if self.expiry:
-                self.expiry.reset(self.holdtime)
-            return
+        self.session.send(msg)
+        self._flush()
 
-        self.handle_msg(msg)
+    def send_many(self, msgs):
+        self.session.send_many(msgs)
+        self._flush()
 
     def handle_msg(self, msg):
         pass
 
+    # set to a callable (or override) to receive every message decoded from
+    # one read as a single list, instead of one handle_msg() call each
+    handle_msgs = None
+
     def start_timer(self, holdtime):
-        self.holdtime = min(self.holdtime, holdtime)
+        self.session.start_timer(holdtime)
+        self._service()
 
-        # setup the function to send keepalives
-        self.keepalive = task.LoopingCall(self.send_keepalive)
-        interval = self.holdtime / 2
-        self.keepalive.start(interval)
+    def send_keepalive(self):
+        self.send(proto.Keepalive())
 
-        # setup the expiry timer
-        self.expiry = reactor.callLater(self.holdtime, self.expired)
+    def _service(self):
+        self.timer = None
+        self.session.tick()
+        self._flush()
 
-    def expired(self):
-        self.keepalive.stop()
-        self.keepalive = None
+    def _flush(self):
+        s = self.session
 
-        log.msg('hold timer expired')
-        self.transport.loseConnection()
+        data = s.data_to_send()
+        if data:
+            self.transport.writeSequence(data)
 
-    def send_keepalive(self):
-        self.send(proto.Keepalive())
+        if s.closing:
+            self._cancel()
+            if self.dropped:
+                return
+            self.dropped = True
+            if isinstance(s.reason, exceptions.BgpExc):
+                if s.reason.send_error:
+                    log.msg("sent notify", s.reason)
+            else:
+                log.msg(s.reason)
+            log.msg("disconnecting")
+            self.transport.loseConnection()
+            return
+
+        deadline = s.next_deadline()
+        if deadline is None:
+            self._cancel()
+            return
+
+        delay = max(0, deadline - reactor.seconds())
+        if self.timer is None:
+            self.timer = reactor.callLater(delay, self._service)
+        elif self.timer.getTime()!=deadline:
+            self.timer.reset(delay)
+
+    def _cancel(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+import unittest
+
+from pybgp import proto, nlri, pathattr
+
+try:
+    from pybgp import aio
+except ImportError:
+    aio = None
+
+class FakeTransport:
+    def __init__(self):
+        self.value = []
+        self.closed = False
+
+    def writelines(self, data):
+        self.value.extend(data)
+
+    def close(self):
+        self.closed = True
+
+    def reply(self):
+        return ''.join(self.value)
+
+class FakeLoop:
+    def __init__(self):
+        self.calls = []
+
+    def time(self):
+        return 1000.0
+
+    def call_at(self, when, func):
+        self.calls.append((when, func))
+        return self
+
+    def cancel(self):
+        pass
+
+class TestAsyncSpeaker(unittest.TestCase):
+    def open(self):
+        msg = '\xff'*16
+        msg += '\x00'
+        msg += chr(29)
+        msg += '\x01'       # open
+        msg += '\x04'       # version
+        msg += '\xde\xad'   # asnum 0xdead
+        msg += '\xbe\xef'   # holdtime 0xbeef
+        msg += '\xc0\xa8\x01\x01'   # bgpid 192.168.1.1
+        msg += '\x00'       # no params
+
+        return msg
+
+    def update_w(self):
+        msg = '\xff'*16
+        msg += '\x00'
+        msg += chr(30)
+        msg += '\x02'       # update
+        msg += '\x00\x07'   # withdrawn len
+        msg += '\x19\xc0\xa8\x01\x00'   # 192.168.1/25
+        msg += '\x08\x0a'   # 10/8
+        msg += '\x00\x00'   # no pathattr
+
+        return msg
+
+    def setUp(self):
+        if aio is None:
+            self.skipTest('asyncio not available')
+
+        self.msgs = []
+        self.loop = FakeLoop()
+        self.proto = aio.BGP(loop=self.loop)
+        self.proto.handle_msg = self.msgs.append
+        self.proto.connection_made(FakeTransport())
+
+    def test_protobase(self):
+        # a ProtoBase, whose decoding settings reach the session
+        class Lazy(aio.BGP):
+            update_class = proto.LazyUpdate
+
+        p = Lazy(loop=self.loop)
+        p.interner = pathattr.Interner()
+        p.handle_msg = self.msgs.append
+        p.connection_made(FakeTransport())
+        self.failUnless(isinstance(p, proto.ProtoBase))
+        self.failUnless(p.session.interner is p.interner)
+
+        p.data_received(self.update_w())
+        self.failUnless(isinstance(self.msgs[0], proto.LazyUpdate))
+        self.assertEqual(p.parse_payload(4, '').kind, 'keepalive')
+
+    def test_open(self):
+        self.proto.data_received(self.open())
+
+        self.failIf(self.proto.transport.closed)
+        self.failUnless(len(self.msgs)==1)
+        self.failUnless(self.proto.buffer=='')
+
+        msg = self.msgs[0]
+        self.failUnless(isinstance(msg, proto.Open))
+        self.assertEqual(msg.asnum, 0xdead)
+        self.assertEqual(msg.bgpid, '192.168.1.1')
+
+    def test_notsync(self):
+        self.proto.data_received('\xee'*16 + '\x00\x13\x01')
+
+        self.failUnless(self.proto.transport.closed)
+        self.assertEqual(
+                self.proto.transport.reply(),
+                '\xff'*16 + '\x00\x15\x03\x01\x01',
+                )
+
+    def test_timers(self):
+        self.proto.open(1, '192.168.1.1', holdtime=90)
+        self.proto.start_timer(30)
+
+        # open and the first keepalive, then a timer for the next keepalive
+        self.assertEqual(
+                self.proto.transport.reply(),
+                self.proto.transport.value[0] + '\xff'*16 + '\x00\x13\x04',
+                )
+        self.assertEqual(len(self.loop.calls), 1)
+        self.assertEqual(self.loop.calls[0][0], 1015.0)
+
+if __name__=='__main__':
+    unittest.main()
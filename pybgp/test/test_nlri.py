@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+import unittest
+
+from pybgp import nlri
+
+class TestIpv4(unittest.TestCase):
+    def test_int(self):
+        p = nlri.ipv4('192.168.1.128/25')
+
+        self.assertEqual(p.ip, 0xc0a80180)
+        self.assertEqual(p.masklen, 25)
+
+        q = nlri.ipv4.from_int(0xc0a80180, 25)
+        self.assertEqual(q.prefix, '192.168.1.128/25')
+        self.assertEqual(str(q), '192.168.1.128/25')
+
+    def test_compare(self):
+        a = nlri.ipv4('10.0.0.0/8')
+        b = nlri.ipv4.from_int(0x0a000000, 8)
+        c = nlri.ipv4('10.0.0.0/16')
+        d = nlri.ipv4('9.255.0.0/16')
+
+        self.assertEqual(a, b)
+        self.failIf(a!=b)
+        self.assertNotEqual(a, c)
+        self.assertEqual(hash(a), hash(b))
+        self.failUnless(b in set([a, c]))
+
+        self.assertEqual(sorted([c, a, d]), [d, a, c])
+
+    def test_encode(self):
+        self.assertEqual(nlri.ipv4('192.168.1.128/25').encode(), '\x19\xc0\xa8\x01\x80')
+        self.assertEqual(nlri.ipv4('10.1.0.0/16').encode(), '\x10\x0a\x01')
+        self.assertEqual(nlri.ipv4('0.0.0.0/0').encode(), '\x00')
+
+class TestIterParse(unittest.TestCase):
+    sample = '\x19\xc0\xa8\x01\x80\x08\x0a\x00\x18\x0a\x01\x02\x20\x0a\x01\x02\x03'
+
+    expect = [
+        nlri.ipv4('192.168.1.128/25'),
+        nlri.ipv4('10.0.0.0/8'),
+        nlri.ipv4('0.0.0.0/0'),
+        nlri.ipv4('10.1.2.0/24'),
+        nlri.ipv4('10.1.2.3/32'),
+        ]
+
+    def test_parse(self):
+        self.assertEqual(nlri.parse(self.sample), self.expect)
+
+    def test_buffers(self):
+        for buf in (bytearray(self.sample), memoryview(self.sample)):
+            self.assertEqual(list(nlri.iterparse(buf)), self.expect)
+
+    def test_lazy(self):
+        it = nlri.iterparse('\x08\x0a' + '\x20')
+        self.assertEqual(it.next(), nlri.ipv4('10.0.0.0/8'))
+
+        # the truncated second prefix is only noticed when it is reached
+        self.assertRaises(Exception, it.next)
+
+    def test_range(self):
+        prefixes = nlri.iterparse('junk' + self.sample, idx=4, end=4+6)
+        self.assertEqual(list(prefixes), self.expect[:2])
+
+    def test_vpnv4(self):
+        b = '\x68\x80\x00\x00\x00\x00\xfd\xe8\x00\x00\x00\x01\x0a\x01'
+        b += '\x58\x00\x07\x01\x00\x01\x9b\xc6\x00\x00\x00\x01'
+
+        self.assertEqual(list(nlri.iterparse(memoryview(b), 1, 128)), [
+            nlri.vpnv4(None, '65000:1', '10.1.0.0/16'),
+            nlri.vpnv4([112], '155.198.0.0:1', '0.0.0.0/0'),
+            ])
+
+    def test_vpnv4_withdraw(self):
+        # no labels encode as the null label, and decode back to None
+        b = '\x68\x80\x00\x00\x00\x00\xfd\xe8\x00\x00\x00\x01\x0a\x01'
+        self.assertEqual(nlri.vpnv4(None, '65000:1', '10.1.0.0/16').encode(), b)
+        self.assertEqual(nlri.vpnv4([], '65000:1', '10.1.0.0/16').encode(), b)
+
+class TestBulk(unittest.TestCase):
+    sections = [
+        TestIterParse.sample,
+        '',
+        '\x10\x0a\x01\x18\xc0\xa8\x02',
+        ]
+
+    def check(self):
+        network, masklen, index = nlri.decode_bulk(self.sections)
+
+        expect = []
+        for n, sec in enumerate(self.sections):
+            for p in nlri.parse(sec):
+                expect.append((p.ip, p.masklen, n))
+
+        self.assertEqual(zip(list(network), list(masklen), list(index)), expect)
+
+        self.assertEqual(
+                nlri.encode_bulk(network, masklen),
+                ''.join(self.sections),
+                )
+
+        self.truncated('\x18\x0a\x01')
+        # a prefix may not run on from one section into the next
+        self.truncated(['\x18\x0a', '\x01\x02'])
+        self.truncated(['\x08\x0a', '\x18\x0a', '\x01\x02'])
+        self.assertRaises(Exception, nlri.decode_bulk, '\x21\x0a\x01\x02\x03\x04')
+
+    def truncated(self, sections):
+        try:
+            nlri.decode_bulk(sections)
+        except Exception, ex:
+            self.assertEqual(str(ex), 'truncated NLRI')
+        else:
+            self.fail('%r decoded' % (sections,))
+
+    def test_numpy(self):
+        if nlri.numpy is None:
+            self.skipTest('numpy not available')
+        self.check()
+
+    def test_python(self):
+        saved = nlri.numpy
+        nlri.numpy = None
+        try:
+            self.check()
+        finally:
+            nlri.numpy = saved
+
+if __name__=='__main__':
+    unittest.main()
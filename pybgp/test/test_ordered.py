@@ -0,0 +1,53 @@
+#!/usr/bin/python
+
+import unittest
+
+from pybgp.ordered import OrderedMap
+
+class TestOrderedMap(unittest.TestCase):
+    def test_order(self):
+        m = OrderedMap()
+        m['origin'] = 'igp'
+        m['aspath'] = [[65000]]
+        m['med'] = 0
+        m['origin'] = 'egp'
+
+        self.assertEqual(m.keys(), ['origin', 'aspath', 'med'])
+        self.assertEqual(m.values(), ['egp', [[65000]], 0])
+        self.assertEqual(list(m), m.keys())
+        self.assertEqual(len(m), 3)
+        self.assertEqual(m['origin'], 'egp')
+
+    def test_delete(self):
+        m = OrderedMap([('a', 1), ('b', 2), ('c', 3)])
+        del m['b']
+
+        self.assertEqual(m.items(), [('a', 1), ('c', 3)])
+        self.failIf('b' in m)
+        self.assertEqual(m.get('b'), None)
+        self.assertRaises(KeyError, m.__getitem__, 'b')
+        self.assertRaises(KeyError, m.__delitem__, 'b')
+
+        self.assertEqual(m.pop('a'), 1)
+        self.assertEqual(m.pop('a', None), None)
+        self.assertEqual(m.keys(), ['c'])
+
+    def test_setdefault(self):
+        m = OrderedMap()
+        m.setdefault('mbgp', []).append(1)
+        m.setdefault('mbgp', []).append(2)
+        self.assertEqual(m['mbgp'], [1, 2])
+
+    def test_eq(self):
+        a = OrderedMap([('a', 1), ('b', 2)])
+
+        self.assertEqual(a, OrderedMap([('a', 1), ('b', 2)]))
+        self.assertNotEqual(a, OrderedMap([('b', 2), ('a', 1)]))
+        self.assertEqual(a, {'b': 2, 'a': 1})
+        self.assertNotEqual(a, {'a': 1})
+
+    def test_slots(self):
+        self.assertRaises(AttributeError, setattr, OrderedMap(), 'x', 1)
+
+if __name__=='__main__':
+    unittest.main()
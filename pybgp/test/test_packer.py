@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+import unittest
+
+from pybgp import packer, pathattr, proto, nlri
+
+def attrs(med=0):
+    return [
+        pathattr.Origin('igp'),
+        pathattr.AsPath([[65000]]),
+        pathattr.NextHop('192.168.1.1'),
+        pathattr.Med(med),
+        ]
+
+def prefixes(count, third=0):
+    return ['10.%d.%d.0/24' % (third, i) for i in range(count)]
+
+class TestPacker(unittest.TestCase):
+    def check(self, updates, max_len=4096):
+        for up in updates:
+            self.failUnless(19 + len(up.encode()) <= max_len)
+            # what went out must decode to what was packed
+            self.assertEqual(proto.Update.from_bytes(up.encode()), up)
+
+    def test_group(self):
+        changes = []
+        for i, p in enumerate(prefixes(10)):
+            changes.append((p, attrs(i % 2)))
+
+        updates = packer.pack(changes)
+        self.check(updates)
+
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(updates[0].pathattr['med'], 0)
+        self.assertEqual(updates[0].nlri, [nlri.ipv4(p) for p in prefixes(10)[0::2]])
+        self.assertEqual(updates[1].pathattr['med'], 1)
+        self.assertEqual(updates[1].nlri, [nlri.ipv4(p) for p in prefixes(10)[1::2]])
+
+    def test_split(self):
+        p = packer.Packer(max_len=200)
+        for prefix in prefixes(200):
+            p.advertise(prefix, attrs())
+
+        updates = p.updates()
+        self.check(updates, 200)
+
+        # 23 bytes of header, 25 of attributes, leaves room for 38 /24s
+        self.assertEqual([len(up.nlri) for up in updates], [38]*5 + [10])
+
+    def test_withdraw(self):
+        p = packer.Packer(max_len=200)
+        for prefix in prefixes(30):
+            p.advertise(prefix, attrs())
+        for prefix in prefixes(50, 1):
+            p.withdraw(prefix)
+
+        # the last change for a prefix wins
+        p.withdraw(prefixes(30)[0])
+
+        updates = p.updates()
+        self.check(updates, 200)
+
+        # the withdrawals fill the spare room of the advertisement first
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(len(updates[0].nlri), 29)
+        self.assertEqual(len(updates[0].withdraw), 9)
+        self.assertEqual(len(updates[1].nlri), 0)
+        self.assertEqual(len(updates[1].withdraw), 42)
+
+    def test_vpnv4(self):
+        p = packer.Packer()
+        for i in range(3):
+            p.advertise(
+                    nlri.vpnv4([100+i], '65000:1', '10.0.%d.0/24' % (i,)),
+                    attrs(),
+                    )
+        p.withdraw(nlri.vpnv4([200], '65000:2', '10.1.0.0/16'))
+        p.withdraw('10.2.0.0/16')
+
+        updates = p.updates()
+        self.check(updates)
+
+        self.assertEqual(len(updates), 1)
+        up = updates[0]
+
+        self.failIf('nexthop' in up.pathattr)
+        self.assertEqual(up.pathattr['mp-reach-nlri'].value['nh'], '192.168.1.1')
+        self.assertEqual(len(up.pathattr['mp-reach-nlri'].value['nlri']), 3)
+        self.assertEqual(up.pathattr['mp-unreach-nlri'].value['withdraw'], [
+            nlri.vpnv4([200], '65000:2', '10.1.0.0/16'),
+            ])
+        self.assertEqual(up.withdraw, [nlri.ipv4('10.2.0.0/16')])
+
+        # both MP attributes are optional, non-transitive on the wire
+        block = up.attrblock()
+        flags = dict([(type, ord(block[start]) & 0xf0)
+            for type, start, end in pathattr.scan(block)])
+        self.assertEqual(flags[14], 0x80)
+        self.assertEqual(flags[15], 0x80)
+
+    def test_vpnv4_last_wins(self):
+        # the withdrawal has no labels, but is the same route
+        p = packer.Packer()
+        p.advertise(nlri.vpnv4([100], '65000:1', '10.0.0.0/24'), attrs())
+        p.withdraw(nlri.vpnv4(None, '65000:1', '10.0.0.0/24'))
+
+        updates = p.updates()
+        self.check(updates)
+        self.assertEqual(len(updates), 1)
+        self.failIf('mp-reach-nlri' in updates[0].pathattr)
+        self.assertEqual(updates[0].pathattr['mp-unreach-nlri'].value['withdraw'], [
+            nlri.vpnv4(None, '65000:1', '10.0.0.0/24'),
+            ])
+
+        p.withdraw(nlri.vpnv4(None, '65000:1', '10.0.0.0/24'))
+        p.advertise(nlri.vpnv4([100], '65000:1', '10.0.0.0/24'), attrs())
+        updates = p.updates()
+        self.failIf('mp-unreach-nlri' in updates[0].pathattr)
+        self.assertEqual(len(updates[0].pathattr['mp-reach-nlri'].value['nlri']), 1)
+
+if __name__=='__main__':
+    unittest.main()
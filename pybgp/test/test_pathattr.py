@@ -4,6 +4,7 @@ import socket
 import unittest
 
 from pybgp import pathattr, nlri
+from pybgp.ordered import OrderedMap
 
 class TestOrigin(unittest.TestCase):
     def test_encode(self):
@@ -23,6 +24,21 @@ class TestOrigin(unittest.TestCase):
 
         self.assertEqual(orig.value, 'incomplete')
 
+class TestFreeze(unittest.TestCase):
+    def test_freeze(self):
+        med = pathattr.Med(32)
+        self.failIf(med.frozen())
+
+        self.failUnless(med.freeze() is med)
+        self.failUnless(med.frozen())
+        self.assertEqual(med.encode(), '\x80\x04\x04\x00\x00\x00 ')
+        self.failUnless(med.encode() is med.encode())
+
+        def rebind():
+            med.value = 33
+        self.assertRaises(AttributeError, rebind)
+        self.assertEqual(med.value, 32)
+
 class TestAsPath(unittest.TestCase):
     def sample(self):
         shouldb = '\x40\x02'    # as path
@@ -64,6 +80,181 @@ class TestAsPath(unittest.TestCase):
             ])
 
 
+    def test_asn4(self):
+        aspath = pathattr.AsPath([[65000, 4200000000], set([1])])
+
+        b = aspath.encode(True)
+        self.assertEqual(b, '\x40\x02\x10'
+                '\x02\x02\x00\x00\xfd\xe8\xfa\x56\xea\x00'
+                '\x01\x01\x00\x00\x00\x01')
+
+        used, decoded = pathattr.decode(b, 0, True)
+        self.assertEqual(decoded, aspath)
+        self.failUnless(isinstance(decoded.value[0], pathattr.AsSeq))
+        self.failUnless(isinstance(decoded.value[1], pathattr.AsSet))
+
+        # 2-byte speakers see AS_TRANS in its place
+        self.assertEqual(aspath.encode(), '\x40\x02\x0a'
+                '\x02\x02\xfd\xe8\x5b\xa0'
+                '\x01\x01\x00\x01')
+
+    def test_segments(self):
+        self.assertEqual(pathattr.AsSeq([1, 2]), [1, 2])
+        self.assertNotEqual(pathattr.AsSeq([1, 2]), [2, 1])
+        self.assertEqual(pathattr.AsSet([1, 2]), set([2, 1]))
+        self.assertNotEqual(pathattr.AsSet([1, 2]), [1, 2])
+        self.assertEqual(pathattr.AsPath('1,2 set(3,4)').value, [[1, 2], set([3, 4])])
+        self.assertEqual(pathattr.AsPath('1,2 set(3,4)').length(), 3)
+
+    def test_freeze(self):
+        aspath = pathattr.AsPath([[4200000000]]).freeze()
+        self.assertEqual(aspath.encode(True), '\x40\x02\x06\x02\x01\xfa\x56\xea\x00')
+        self.assertEqual(aspath.encode(), '\x40\x02\x04\x02\x01\x5b\xa0')
+        self.failUnless(aspath.as4() is aspath.as4())
+        self.failUnless(aspath.as4().frozen())
+
+class TestAs4(unittest.TestCase):
+    def test_sendable(self):
+        small = [pathattr.Origin('igp'), pathattr.AsPath([[65000]])]
+        self.assertEqual(pathattr.sendable(small), small)
+
+        attrs = [
+            pathattr.Origin('igp'),
+            pathattr.AsPath([[65000, 4200000000]]),
+            pathattr.Aggregator((4200000000, '192.168.1.1')),
+            ]
+        sent = pathattr.sendable(attrs)
+        self.assertEqual([a.type for a in sent], [
+            'origin', 'aspath', 'aggregator', 'as4path', 'as4aggregator',
+            ])
+        self.assertEqual(sent[3].value, [[65000, 4200000000]])
+        self.assertEqual(sent[4].value, (4200000000, '192.168.1.1'))
+
+        self.assertEqual(pathattr.sendable(sent, True), attrs)
+
+    def test_sendable_reconciles(self):
+        # AS4_* from a 2-byte speaker, passed on to a 4-byte one
+        attrs = [
+            pathattr.Origin('igp'),
+            pathattr.AsPath([[65000, 23456]]),
+            pathattr.As4Path([[4200000000]]),
+            ]
+        sent = pathattr.sendable(attrs, True)
+        self.assertEqual([a.type for a in sent], ['origin', 'aspath'])
+        self.assertEqual(sent[1], [[65000, 4200000000]])
+
+    def test_reconcile(self):
+        attrs = OrderedMap()
+        attrs['aspath'] = pathattr.AsPath([[100, 200, 23456, 23456]])
+        attrs['as4path'] = pathattr.As4Path([[4200000000, 4200000001]])
+        attrs['aggregator'] = pathattr.Aggregator((23456, '192.168.1.1'))
+        attrs['as4aggregator'] = pathattr.As4Aggregator((4200000001, '192.168.1.1'))
+
+        pathattr.reconcile(attrs)
+
+        self.assertEqual(attrs.keys(), ['aspath', 'aggregator'])
+        self.assertEqual(attrs['aspath'], [[100, 200, 4200000000, 4200000001]])
+        self.assertEqual(attrs['aggregator'], (4200000001, '192.168.1.1'))
+
+    def test_reconcile_longer(self):
+        # an AS4_PATH longer than AS_PATH is ignored
+        attrs = OrderedMap()
+        attrs['aspath'] = pathattr.AsPath([[23456]])
+        attrs['as4path'] = pathattr.As4Path([[1, 4200000000]])
+
+        pathattr.reconcile(attrs)
+        self.assertEqual(attrs.items(), [('aspath', [[23456]])])
+
+    def test_reconcile_aggregated(self):
+        # aggregated by a 2-byte speaker, so the AS4_* are stale
+        attrs = OrderedMap()
+        attrs['aspath'] = pathattr.AsPath([[300], set([23456])])
+        attrs['as4path'] = pathattr.As4Path([[4200000000]])
+        attrs['aggregator'] = pathattr.Aggregator((300, '192.168.1.1'))
+        attrs['as4aggregator'] = pathattr.As4Aggregator((4200000001, '192.168.1.1'))
+
+        pathattr.reconcile(attrs)
+        self.assertEqual(attrs['aspath'], [[300], set([23456])])
+        self.assertEqual(attrs['aggregator'], (300, '192.168.1.1'))
+
+class TestCommunities(unittest.TestCase):
+    def test_encode(self):
+        c = pathattr.Communities(['no-export', '65000:1', 5, '65000:1'])
+
+        self.assertEqual(list(c.value), [5, 0xfde80001, 0xffffff01])
+        self.assertEqual(c.encode(), '\xc0\x08\x0c'
+                '\x00\x00\x00\x05\xfd\xe8\x00\x01\xff\xff\xff\x01')
+        self.assertEqual(c.strings(), ['0:5', '65000:1', 'no-export'])
+
+    def test_decode(self):
+        b = '\xc0\x08\x08\xff\xff\xff\x01\xfd\xe8\x00\x01'
+
+        used, c = pathattr.decode(b)
+
+        self.assertEqual(used, len(b))
+        self.failUnless(isinstance(c, pathattr.Communities))
+        self.assertEqual(list(c.value), [0xfde80001, 0xffffff01])
+
+    def test_match(self):
+        c = pathattr.Communities(['65000:%d' % (i,) for i in range(100)])
+
+        self.failUnless('65000:42' in c)
+        self.failUnless(0xfde8002a in c)
+        self.failIf('65000:100' in c)
+        self.failIf('no-export' in c)
+
+        self.failUnless(c.has_any(pathattr.community_set(['no-export', '65000:7'])))
+        self.failIf(c.has_any(pathattr.community_set(['no-export'])))
+        self.failUnless(c.has_all(pathattr.community_set(['65000:1', '65000:2'])))
+        self.failIf(c.has_all(pathattr.community_set(['65000:1', 'no-export'])))
+
+    def test_empty(self):
+        # present but empty is still there
+        for c in (pathattr.Communities([]), pathattr.LargeCommunities([])):
+            self.assertEqual(len(c), 0)
+            self.failUnless(c)
+            self.failUnless({'c': c}.get('c'))
+
+    def test_having_any(self):
+        shared = pathattr.Communities(['65000:1'])
+        other = pathattr.Communities(['65000:2'])
+        routes = [
+            ('10.0.0.0/24', {'communities': shared}),
+            ('10.0.1.0/24', {'communities': other}),
+            ('10.0.2.0/24', {}),
+            ('10.0.3.0/24', {'communities': shared}),
+            ]
+
+        got = pathattr.having_any(routes, pathattr.community_set(['65000:1']))
+        self.assertEqual([k for k, a in got], ['10.0.0.0/24', '10.0.3.0/24'])
+
+class TestLargeCommunities(unittest.TestCase):
+    def test_encode(self):
+        c = pathattr.LargeCommunities(['65000:1:2', (4200000000, 0, 1)])
+
+        self.assertEqual(c.communities(), [(65000, 1, 2), (4200000000, 0, 1)])
+        self.assertEqual(c.encode(), '\xc0\x20\x18'
+                '\x00\x00\xfd\xe8\x00\x00\x00\x01\x00\x00\x00\x02'
+                '\xfa\x56\xea\x00\x00\x00\x00\x00\x00\x00\x00\x01')
+
+    def test_decode(self):
+        c = pathattr.LargeCommunities(['3:2:1', '1:2:3', '1:2:3'])
+
+        used, d = pathattr.decode(c.encode())
+
+        self.failUnless(isinstance(d, pathattr.LargeCommunities))
+        self.assertEqual(d.communities(), [(1, 2, 3), (3, 2, 1)])
+        self.assertRaises(Exception, pathattr.decode, '\xc0\x20\x04\x00\x00\x00\x01')
+
+    def test_match(self):
+        c = pathattr.LargeCommunities(['65000:%d:0' % (i,) for i in range(50)])
+
+        self.failUnless('65000:49:0' in c)
+        self.failUnless((65000, 0, 0) in c)
+        self.failIf('65000:49:1' in c)
+        self.failUnless(c.has_any(pathattr.large_community_set(['1:1:1', '65000:3:0'])))
+        self.failIf(c.has_any(pathattr.large_community_set(['1:1:1'])))
+
 class TestMed(unittest.TestCase):
     def test_encode(self):
         med = pathattr.Med(32)
@@ -101,6 +292,60 @@ class TestExtCommunity(unittest.TestCase):
         self.failUnless(isinstance(ext, pathattr.ExtCommunity))
 
         self.assertEqual(ext.value, ['RT:192.168.0.0:1'])
+        self.assertEqual(list(ext.ints), [0x0102c0a800000001])
+
+    def test_forms(self):
+        values = ['RT:65000:1', 'RT:192.168.0.1:2', 'RT:4200000000L:3', 'RT:100L:4', '3:0b000000000001']
+        ext = pathattr.ExtCommunity(values)
+
+        used, decoded = pathattr.decode(ext.encode())
+        self.assertEqual(decoded.value, values)
+        self.assertEqual(decoded, ext)
+        self.assertEqual(decoded.encode(), ext.encode())
+
+    def test_route_targets(self):
+        ext = pathattr.ExtCommunity(['RT:65000:1', '3:0b000000000001', 'RT:192.168.0.1:2'])
+
+        self.assertEqual(ext.route_targets(), [
+            pathattr.route_target('RT:65000:1'),
+            pathattr.route_target('RT:192.168.0.1:2'),
+            ])
+        self.failUnless(ext.has_route_target('RT:192.168.0.1:2'))
+        self.failIf(ext.has_route_target('RT:192.168.0.1:3'))
+        self.failUnless(ext.has_any(pathattr.route_target_set(['RT:1:1', 'RT:65000:1'])))
+        self.failIf(ext.has_any(pathattr.route_target_set(['RT:1:1'])))
+
+    def test_set_value(self):
+        ext = pathattr.ExtCommunity(['RT:65000:1'])
+        self.assertEqual(ext.value, ['RT:65000:1'])
+
+        ext.value = ['RT:65000:2']
+        self.assertEqual(ext.value, ['RT:65000:2'])
+        self.assertEqual(ext, pathattr.ExtCommunity(['RT:65000:2']))
+
+        # changes in place reach the encoding
+        ext.value.append('RT:65000:3')
+        ext.value[0] = 'RT:65000:1'
+        ext.value += ['RT:65000:4']
+        del ext.value[-1]
+        self.assertEqual(ext.encode(), pathattr.ExtCommunity(['RT:65000:1', 'RT:65000:3']).encode())
+
+        ext.freeze()
+        self.assertRaises(AttributeError, setattr, ext, 'value', [])
+        self.assertRaises(AttributeError, ext.value.append, 'RT:65000:5')
+        self.assertEqual(ext.value, ['RT:65000:1', 'RT:65000:3'])
+
+    def test_as4_route_target(self):
+        # 4-octet AS route targets keep their type, however small the AS
+        i = (0x0202 << 48) | (100 << 16) | 5
+        self.assertEqual(pathattr.extcommunity_str(i), 'RT:100L:5')
+        self.assertEqual(pathattr.route_target('RT:100L:5'), i)
+        self.assertNotEqual(pathattr.route_target('RT:100:5'), i)
+
+        ext = pathattr.ExtCommunity([i])
+        self.assertEqual(pathattr.ExtCommunity(ext.value), ext)
+        self.failUnless(ext.has_route_target('RT:100L:5'))
+        self.failIf(ext.has_route_target('RT:100:5'))
 
 class TestMpReachNlri(unittest.TestCase):
     def test_encode(self):
@@ -113,7 +358,7 @@ class TestMpReachNlri(unittest.TestCase):
 
         b = r.encode()
 
-        self.assertEqual(b, '\x00\x0e&\x00\x01\x80\x0c\x00\x00\x00\x00\x00\x00\x00\x00\xc0\xa8\x01\x01\x00\xa0\x00\x06\xf0\x00\r\xe0\x00\x14\xd1\x00\x01\xc0\xa8\x00\x00\x00\x02\xc0\xa8\x02')
+        self.assertEqual(b, '\x80\x0e&\x00\x01\x80\x0c\x00\x00\x00\x00\x00\x00\x00\x00\xc0\xa8\x01\x01\x00\xa0\x00\x06\xf0\x00\r\xe0\x00\x14\xd1\x00\x01\xc0\xa8\x00\x00\x00\x02\xc0\xa8\x02')
 
     def test_decode(self):
         nh = '\0'*8 + socket.inet_aton('192.168.1.1')
@@ -158,6 +403,26 @@ class TestMpReachNlri(unittest.TestCase):
             ]
             )
 
+    def test_iter_nlri(self):
+        r = pathattr.MpReachNlri(dict(
+            afi=1,
+            safi=128,
+            nh='192.168.1.1',
+            nlri=[
+                nlri.vpnv4([111], '192.168.0.0:2', '192.168.2.0/24'),
+                nlri.vpnv4([222], '192.168.0.0:2', '192.168.3.0/24'),
+                ],
+            ))
+
+        used, mpreach = pathattr.decode(r.encode())
+
+        # streamed from the attribute body, without building "value"
+        self.assertEqual(list(mpreach.iter_nlri()), r.value['nlri'])
+        self.failIf('value' in mpreach.__dict__)
+
+        self.assertEqual(mpreach.value['nlri'], r.value['nlri'])
+        self.assertEqual(list(mpreach.iter_nlri()), r.value['nlri'])
+
 class TestMpUnreachNlri(unittest.TestCase):
     def test_encode(self):
         r = pathattr.MpUnreachNlri(dict(
@@ -168,7 +433,7 @@ class TestMpUnreachNlri(unittest.TestCase):
 
         b = r.encode()
 
-        self.assertEqual(b, '\x00\x0f\x18\x00\x01\x80\xa0\x00\x06\xf0\x00\r\xe0\x00\x14\xd1\x00\x01\xc0\xa8\x00\x00\x00\x02\xc0\xa8\x02')
+        self.assertEqual(b, '\x80\x0f\x18\x00\x01\x80\xa0\x00\x06\xf0\x00\r\xe0\x00\x14\xd1\x00\x01\xc0\xa8\x00\x00\x00\x02\xc0\xa8\x02')
 
     def test_decode(self):
         payload = '\x00\x01'# afi
@@ -200,3 +465,123 @@ class TestMpUnreachNlri(unittest.TestCase):
             nlri.vpnv4(None, '192.168.0.0:2', '192.168.2.128/25')
             ]
             )
+
+class TestInterner(unittest.TestCase):
+    def block(self, med=10):
+        return pathattr.Origin('igp').encode() + \
+                pathattr.AsPath([[65000, 65001]]).encode() + \
+                pathattr.NextHop('192.168.1.1').encode() + \
+                pathattr.Med(med).encode()
+
+    def test_share(self):
+        i = pathattr.Interner()
+
+        a, mp = i.intern_block(self.block())
+        b, mp = i.intern_block(self.block())
+        c, mp = i.intern_block(self.block(20))
+
+        self.failUnless(a is b)
+        self.failIf(a is c)
+        self.failUnless(a['origin'] is c['origin'])
+        self.failUnless(a['med'] is not c['med'])
+
+        self.assertEqual(a.keys(), ['origin', 'aspath', 'nexthop', 'med'])
+        self.assertEqual(a['med'].value, 10)
+        self.assertEqual(a.encode(), self.block())
+        self.failUnless(a['aspath'].frozen())
+
+        s = i.stats()
+        self.assertEqual(s['sets'], 2)
+        self.assertEqual(s['attrs'], 5)
+        self.assertEqual(s['hits'], 1)
+
+    def test_mp(self):
+        i = pathattr.Interner()
+        reach = pathattr.MpReachNlri(dict(
+            afi=1, safi=128, nh='192.168.1.1',
+            nlri=[nlri.vpnv4([100], '1:1', '10.0.0.0/24')],
+            )).encode()
+
+        a, mp = i.intern_block(self.block() + reach)
+        b, mp2 = i.intern_block(self.block())
+
+        self.failUnless(a is b)
+        self.assertEqual(len(mp), 1)
+        self.assertEqual(mp[0].value['nlri'], [nlri.vpnv4([100], '1:1', '10.0.0.0/24')])
+        self.assertEqual(mp2, [])
+
+    def test_release(self):
+        i = pathattr.Interner()
+
+        a, mp = i.intern_block(self.block())
+        c, mp = i.intern_block(self.block(20))
+        i.acquire(a)
+        i.acquire(a)
+        i.acquire(c)
+
+        i.release(a)
+        self.assertEqual(i.stats()['sets'], 2)
+
+        i.release(a)
+        self.assertEqual(i.stats()['sets'], 1)
+        self.assertEqual(i.stats()['attrs'], 4)
+
+        i.release(c)
+        self.assertEqual(i.stats()['sets'], 0)
+        self.assertEqual(i.stats()['attrs'], 0)
+
+    def test_sweep(self):
+        i = pathattr.Interner()
+
+        a, mp = i.intern_block(self.block())
+        c, mp = i.intern_block(self.block(20))
+        i.acquire(c)
+
+        i.sweep()
+        self.assertEqual(i.stats()['sets'], 1)
+        self.failUnless(i.intern_block(self.block(20))[0] is c)
+
+    def test_as4(self):
+        i = pathattr.Interner()
+        block = ''.join([a.encode() for a in pathattr.sendable([
+            pathattr.Origin('igp'),
+            pathattr.AsPath([[65000, 4200000000]]),
+            pathattr.Aggregator((4200000000, '192.168.1.1')),
+            ])])
+
+        a, mp = i.intern_block(block)
+        self.assertEqual(a.keys(), ['origin', 'aspath', 'aggregator'])
+        self.assertEqual(a['aspath'], [[65000, 4200000000]])
+        self.assertEqual(a['aggregator'], (4200000000, '192.168.1.1'))
+        self.assertEqual(a.encode(), block)
+        self.failUnless(i.intern_block(block)[0] is a)
+
+        # evicted along with the attributes as received
+        i.acquire(a)
+        i.release(a)
+        self.assertEqual(i.stats()['sets'], 0)
+        self.assertEqual(i.stats()['attrs'], 0)
+
+class TestRegister(unittest.TestCase):
+    def tearDown(self):
+        pathattr.codecs.pop(99, None)
+
+    def test_register(self):
+        class Custom(pathattr.IntAttr):
+            typenum = 99
+            type = 'custom'
+            flags = 0xc0
+
+        b = '\xc0\x63\x04\x00\x00\x00\x2a'
+
+        used, attr = pathattr.decode(b)
+        self.failUnless(attr.__class__ is pathattr.PathAttr)
+        self.assertEqual(pathattr.typename(99), 'type-99')
+
+        self.failUnless(pathattr.register(Custom) is Custom)
+
+        used, attr = pathattr.decode(b)
+        self.failUnless(isinstance(attr, Custom))
+        self.assertEqual(attr.value, 42)
+        self.assertEqual(attr.encode(), b)
+        self.assertEqual(pathattr.typename(99), 'custom')
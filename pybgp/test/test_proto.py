@@ -26,9 +26,118 @@ class TestOpen(unittest.TestCase):
 
         self.assertEqual(b, '\x04\xaa\xbb\x00\xff\xc0\xa8\x01\x01\x00')
 
+    def test_extended_message(self):
+        e = proto.Open('192.168.1.1', 0xaabb, holdtime=255)
+        e.caps['extended-message'] = ['']
+        b = e.encode()
+
+        self.assertEqual(b, '\x04\xaa\xbb\x00\xff\xc0\xa8\x01\x01\x04\x02\x02\x06\x00')
+
+        open = proto.Open.from_bytes(b)
+        self.assertEqual(open.caps['extended-message'], [''])
+
+    def test_graceful_restart(self):
+        e = proto.Open('192.168.1.1', 0xaabb, holdtime=255)
+        e.caps['graceful-restart'] = [dict(restart=True, time=120,
+            families=[(1, 1, True), (1, 128, False)])]
+        b = e.encode()
+        self.assertEqual(b[10:], '\x02\x0c\x40\x0a\x80\x78\x00\x01\x01\x80\x00\x01\x80\x00')
+
+        open = proto.Open.from_bytes(b)
+        self.assertEqual(open.caps['graceful-restart'], [dict(restart=True, time=120,
+            families=[(1, 1, True), (1, 128, False)])])
+
+    def test_register_capability(self):
+        class Pair(proto.Capability):
+            def decode(self, bytes):
+                return tuple(map(ord, bytes))
+            def encode(self, value):
+                return ''.join(map(chr, value))
+
+        o = proto.Open(asnum=1, bgpid='1.1.1.1')
+        o.caps[200] = ['\x01\x02']
+        b = o.encode()
+        self.assertEqual(proto.Open.from_bytes(b).caps[200], ['\x01\x02'])
+
+        proto.register_capability(Pair(200, 'pair'))
+        try:
+            self.assertEqual(proto.Open.from_bytes(b).caps['pair'], [(1, 2)])
+            o = proto.Open.from_bytes(b)
+            self.assertEqual(o.encode(), b)
+        finally:
+            self.failUnless(isinstance(proto.unregister_capability(200), Pair))
+
+        self.assertEqual(proto.Open.from_bytes(b).caps[200], ['\x01\x02'])
+        self.assertEqual(proto.unregister_capability(200), None)
+
+    def test_truncated(self):
+        head = '\x04\x00\x01\x00\xb4\x01\x01\x01\x01'
+        for params in (
+                # a parameter longer than the parameters
+                '\x02\x08\x41\x04\x00\x00',
+                # a capability longer than its parameter
+                '\x02\x04\x41\x04\x00\x00',
+                # a 4byteas capability of two bytes
+                '\x02\x04\x41\x02\x00\x01',
+                # a graceful-restart capability of one byte
+                '\x02\x03\x40\x01\x00',
+                ):
+            b = head + chr(len(params)) + params
+            self.assertRaises(exceptions.BadOpen, proto.Open.from_bytes, b)
+
+        ex = exceptions.BadOpen('x')
+        self.assertEqual((ex.code, ex.subcode), (2, 0))
+
+class TestRouteRefresh(unittest.TestCase):
+    def test_codec(self):
+        r = proto.RouteRefresh.from_bytes('\x00\x01\x02\x80')
+        self.assertEqual((r.afi, r.safi, r.subtype), (1, 128, proto.RouteRefresh.EORR))
+        self.assertEqual(r.family(), (1, 128))
+        self.assertEqual(r.encode(), '\x00\x01\x02\x80')
+        self.assertEqual(proto.RouteRefresh().encode(), '\x00\x01\x00\x01')
+
+    def test_parse(self):
+        p = proto.ProtoBase()
+        r = p.parse_payload(5, memoryview('\x00\x01\x00\x01'))
+        self.assertEqual(r.kind, 'refresh')
+        self.assertEqual(r.subtype, proto.RouteRefresh.REQUEST)
+
+        try:
+            p.parse_payload(5, '\x00\x01\x00\x01\x00')
+        except exceptions.BadRefreshLen, ex:
+            self.assertEqual((ex.code, ex.subcode), (7, 1))
+            self.assertEqual(ex.data, '\xff'*16 + '\x00\x18\x05\x00\x01\x00\x01\x00')
+        else:
+            self.fail('no BadRefreshLen')
+
+class TestEndOfRib(unittest.TestCase):
+    def test_eor(self):
+        for family in ((1, 1), (1, 128)):
+            b = proto.end_of_rib(*family).encode()
+            self.assertEqual(proto.Update.from_bytes(b).eor(), family)
+            self.assertEqual(proto.LazyUpdate.from_bytes(b).eor(), family)
+        self.assertEqual(proto.end_of_rib(1, 128).encode(),
+                '\x00\x00\x00\x06\x80\x0f\x03\x00\x01\x80')
+
+    def test_not_eor(self):
+        updates = [
+            proto.Update(nlri=['10.0.0.0/8']),
+            proto.Update(withdraw=['10.0.0.0/8']),
+            proto.Update(pathattr.Origin('igp')),
+            proto.Update(pathattr.MpUnreachNlri(dict(afi=1, safi=128,
+                withdraw=[nlri.vpnv4(None, '65000:1', '10.0.0.0/8')]))),
+            ]
+        for up in updates:
+            b = up.encode()
+            self.assertEqual(up.eor(), None)
+            self.assertEqual(proto.Update.from_bytes(b).eor(), None)
+            self.assertEqual(proto.LazyUpdate.from_bytes(b).eor(), None)
+
 class TestUpdate(unittest.TestCase):
+    sample = '\x00\x00\x00k@\x01\x01\x00@\x02\x08\x02\x03\xfcE\xfcD\xfc7\x80\x04\x04\x00\x00\x00\x00@\x05\x04\x00\x00\x00\xff\xc0\x10\x08\x01\x02\x9b\xc6\x00\x00\x00\x01\x80\n\x08\xc2R\x98\x0b\xc2R\x98\x01\x80\t\x04\xc2R\x98\x04\xc0\x14\x0e\x00\x01\x00\x01\x9b\xc6\x00\x00\x00\x01\xc2R\x98\x04\x80\x0e\x1d\x00\x01\x80\x0c\x00\x00\x00\x00\x00\x00\x00\x00\xc2R\x98\x04\x00X\x00\x07\x01\x00\x01\x9b\xc6\x00\x00\x00\x01'
+
     def test_decode(self):
-        b = '\x00\x00\x00k@\x01\x01\x00@\x02\x08\x02\x03\xfcE\xfcD\xfc7\x80\x04\x04\x00\x00\x00\x00@\x05\x04\x00\x00\x00\xff\xc0\x10\x08\x01\x02\x9b\xc6\x00\x00\x00\x01\x80\n\x08\xc2R\x98\x0b\xc2R\x98\x01\x80\t\x04\xc2R\x98\x04\xc0\x14\x0e\x00\x01\x00\x01\x9b\xc6\x00\x00\x00\x01\xc2R\x98\x04\x80\x0e\x1d\x00\x01\x80\x0c\x00\x00\x00\x00\x00\x00\x00\x00\xc2R\x98\x04\x00X\x00\x07\x01\x00\x01\x9b\xc6\x00\x00\x00\x01'
+        b = self.sample
 
         update = proto.Update.from_bytes(b)
 
@@ -45,5 +154,219 @@ class TestUpdate(unittest.TestCase):
 
         self.assertEqual(update, update2)
 
+class TestAs4(unittest.TestCase):
+    def test_round_trip(self):
+        # received from a 2-byte speaker, sent on to a 4-byte one
+        up = proto.Update(
+                pathattr.Origin('igp'),
+                pathattr.AsPath([[65000, 4200000000]]),
+                pathattr.NextHop('192.168.1.1'),
+                pathattr.Aggregator((4200000000, '192.168.1.1')),
+                nlri=['10.0.0.0/24'],
+                )
+        b = up.encode()
+
+        for klass in (proto.Update, proto.LazyUpdate):
+            out = proto.Update.from_bytes(klass.from_bytes(b).encode(True), asn4=True)
+            self.assertEqual(out.pathattr.keys(), ['origin', 'aspath', 'nexthop', 'aggregator'])
+            self.assertEqual(out.pathattr['aspath'], [[65000, 4200000000]])
+            self.assertEqual(out.pathattr['aggregator'], (4200000000, '192.168.1.1'))
+
+class TestAttrBlock(unittest.TestCase):
+    def test_cached(self):
+        origin = pathattr.Origin('igp').freeze()
+        med = pathattr.Med(0).freeze()
+
+        up = proto.Update(origin, med, nlri=['10.0.0.0/8'])
+        block = up.attrblock()
+        self.assertEqual(block, '\x40\x01\x01\x00\x80\x04\x04\x00\x00\x00\x00')
+        self.failUnless(up.attrblock() is block)
+
+        # a different attribute set is noticed
+        up.pathattr['med'] = pathattr.Med(1).freeze()
+        self.assertEqual(up.attrblock(), '\x40\x01\x01\x00\x80\x04\x04\x00\x00\x00\x01')
+
+    def test_unfrozen(self):
+        med = pathattr.Med(0)
+        up = proto.Update(med)
+        up.attrblock()
+
+        med.value = 5
+        self.assertEqual(up.attrblock(), '\x80\x04\x04\x00\x00\x00\x05')
+
+class TestEncodeIter(unittest.TestCase):
+    def attrs(self):
+        return [
+            pathattr.Origin('igp'),
+            pathattr.AsPath([[65000]]),
+            pathattr.NextHop('192.168.1.1'),
+            ]
+
+    def decode(self, bodies, max_len):
+        rv = []
+        for b in bodies:
+            self.failUnless(19 + len(b) <= max_len)
+            rv.append(proto.Update.from_bytes(b))
+        return rv
+
+    def test_small(self):
+        up = proto.Update(nlri=['10.0.0.0/8'], withdraw=['10.1.0.0/16'], *self.attrs())
+        self.assertEqual(list(up.encode_iter()), [up.encode()])
+
+    def test_small_mp(self):
+        reach = pathattr.MpReachNlri(dict(afi=1, safi=128, nh='192.168.1.1',
+            nlri=[nlri.vpnv4([100], '65000:1', '10.0.0.0/24')]))
+        unreach = pathattr.MpUnreachNlri(dict(afi=1, safi=128,
+            withdraw=[nlri.vpnv4(None, '65000:1', '10.1.0.0/24')]))
+        attrs = self.attrs()
+        up = proto.Update(attrs[0], reach, attrs[1], unreach, attrs[2])
+        self.assertEqual(list(up.encode_iter()), [up.encode()])
+
+        b = up.encode()
+        for klass in (proto.Update, proto.LazyUpdate):
+            self.assertEqual(list(klass.from_bytes(b).encode_iter()), [b])
+
+    def test_encoded_once(self):
+        packed = []
+        class Med(pathattr.Med):
+            def packvalue(self):
+                packed.append(self)
+                return pathattr.Med.packvalue(self)
+
+        up = proto.Update(Med(5), nlri=['10.0.0.0/8'], *self.attrs())
+        list(up.encode_iter())
+        self.assertEqual(len(packed), 1)
+
+    def test_ipv4(self):
+        nlri = ['10.%d.%d.0/24' % (i >> 8, i & 0xff) for i in range(2000)]
+        withdraw = ['11.%d.%d.0/24' % (i >> 8, i & 0xff) for i in range(1500)]
+        up = proto.Update(nlri=nlri, withdraw=withdraw, *self.attrs())
+
+        ups = self.decode(up.encode_iter(4096), 4096)
+        self.assertEqual(len(ups), 2 + 2)
+
+        # withdrawals first, on their own
+        for u in ups[:2]:
+            self.assertEqual(u.nlri, [])
+            self.assertEqual(len(u.pathattr), 0)
+        for u in ups[2:]:
+            self.assertEqual(u.withdraw, [])
+            self.assertEqual(u.pathattr.items(), up.pathattr.items())
+
+        self.assertEqual(sum([u.withdraw for u in ups], []), up.withdraw)
+        self.assertEqual(sum([u.nlri for u in ups], []), up.nlri)
+
+    def test_vpnv4(self):
+        reach = [nlri.vpnv4([100], '65000:1', '10.0.%d.0/24' % (i,)) for i in range(200)]
+        unreach = [nlri.vpnv4([100], '65000:1', '10.1.%d.0/24' % (i,)) for i in range(200)]
+
+        attrs = self.attrs()[:2]
+        attrs.append(pathattr.MpReachNlri(dict(afi=1, safi=128, nh='192.168.1.1', nlri=reach)))
+        attrs.append(pathattr.MpUnreachNlri(dict(afi=1, safi=128, withdraw=unreach)))
+        up = proto.Update(*attrs)
+
+        ups = self.decode(up.encode_iter(1000), 1000)
+
+        got_reach = []
+        got_unreach = []
+        for u in ups:
+            if 'mp-reach-nlri' in u.pathattr:
+                self.assertEqual(u.pathattr['origin'], 'igp')
+                self.assertEqual(u.pathattr['mp-reach-nlri'].value['nh'], '192.168.1.1')
+                got_reach.extend(u.pathattr['mp-reach-nlri'].value['nlri'])
+            else:
+                self.assertEqual(u.pathattr.keys(), ['mp-unreach-nlri'])
+                got_unreach.extend(u.pathattr['mp-unreach-nlri'].value['withdraw'])
+
+        self.assertEqual(got_reach, reach)
+        self.assertEqual(got_unreach, unreach)
+        self.assertEqual(len(ups), 4 + 4)
+
+    def test_mixed(self):
+        # plain prefixes spilling over, then MP ones after them
+        withdraw = ['11.%d.%d.0/24' % (i >> 8, i & 0xff) for i in range(1422)]
+        plain = ['10.%d.%d.0/24' % (i >> 8, i & 0xff) for i in range(1422)]
+        unreach = [nlri.vpnv4(None, '65000:1', '10.1.%d.0/24' % (i,)) for i in range(34)]
+        reach = [nlri.vpnv4([100], '65000:1', '10.2.%d.0/24' % (i,)) for i in range(34)]
+
+        attrs = self.attrs()
+        attrs.append(pathattr.MpReachNlri(dict(afi=1, safi=128, nh='192.168.1.1', nlri=reach)))
+        attrs.append(pathattr.MpUnreachNlri(dict(afi=1, safi=128, withdraw=unreach)))
+        up = proto.Update(nlri=plain, withdraw=withdraw, *attrs)
+
+        ups = self.decode(up.encode_iter(4096), 4096)
+
+        got = dict(withdraw=[], nlri=[], reach=[], unreach=[])
+        for u in ups:
+            got['withdraw'].extend(u.withdraw)
+            got['nlri'].extend(u.nlri)
+            if 'mp-reach-nlri' in u.pathattr:
+                got['reach'].extend(u.pathattr['mp-reach-nlri'].value['nlri'])
+            if 'mp-unreach-nlri' in u.pathattr:
+                got['unreach'].extend(u.pathattr['mp-unreach-nlri'].value['withdraw'])
+
+        self.assertEqual(got['withdraw'], up.withdraw)
+        self.assertEqual(got['nlri'], up.nlri)
+        self.assertEqual(got['reach'], reach)
+        self.assertEqual(got['unreach'], unreach)
+
+class TestInterned(unittest.TestCase):
+    sample = TestUpdate.sample
+
+    def test_decode(self):
+        i = pathattr.Interner()
+        a = proto.Update.from_bytes(self.sample, i)
+        b = proto.Update.from_bytes(self.sample, i)
+
+        self.assertEqual(a, proto.Update.from_bytes(self.sample))
+        self.assertEqual(a.encode(), self.sample)
+
+        self.failUnless(a.attrset is b.attrset)
+        self.failIf('mp-reach-nlri' in a.attrset)
+        self.failUnless(a.pathattr['med'] is b.pathattr['med'])
+        self.failIf(a.pathattr['mp-reach-nlri'] is b.pathattr['mp-reach-nlri'])
+
+    def test_lazy(self):
+        i = pathattr.Interner()
+        a = proto.Update.from_bytes(self.sample, i)
+        b = proto.LazyUpdate.from_bytes(self.sample, i)
+
+        self.failUnless(b.attrset is a.attrset)
+        self.assertEqual(b.encode(), self.sample)
+
+class TestLazyUpdate(unittest.TestCase):
+    sample = TestUpdate.sample
+
+    def test_decode(self):
+        update = proto.LazyUpdate.from_bytes(self.sample)
+
+        # only the headers have been read so far
+        self.assertEqual(update.pathattr.keys(), [
+            'origin', 'aspath', 'med', 'localpref', 'extcommunity',
+            'cluster-list', 'originator', 'type-20', 'mp-reach-nlri',
+            ])
+        self.assertEqual(update.pathattr._attrs, {})
+
+        self.assertEqual(update.pathattr['localpref'], 255)
+        self.assertEqual(update.pathattr._attrs.keys(), ['localpref'])
+        self.failUnless(update.pathattr['localpref'] is update.pathattr['localpref'])
+
+        self.failUnless('med' in update.pathattr)
+        self.failIf('nexthop' in update.pathattr)
+        self.assertEqual(update.nlri, [])
+        self.assertEqual(update.withdraw, [])
+
+        self.assertEqual(update, proto.Update.from_bytes(self.sample))
+
+    def test_encode(self):
+        update = proto.LazyUpdate.from_bytes(self.sample)
+        self.assertEqual(update.encode(), self.sample)
+
+        # a changed attribute is re-encoded, the rest copied as received
+        update.pathattr['localpref'] = pathattr.LocalPref(100)
+        update2 = proto.Update.from_bytes(update.encode())
+        self.assertEqual(update2.pathattr['localpref'], 100)
+        self.assertEqual(update2.pathattr['aspath'], [[64581, 64580, 64567]])
+
 if __name__=='__main__':
     unittest.main()
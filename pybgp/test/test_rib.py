@@ -0,0 +1,386 @@
+#!/usr/bin/python
+
+import unittest
+
+from pybgp import nlri, pathattr, proto, rib
+
+def attrs(med=0):
+    return [
+        pathattr.Origin('igp'),
+        pathattr.AsPath([[65000]]),
+        pathattr.NextHop('192.168.1.1'),
+        pathattr.Med(med),
+        ]
+
+class TestAdjRibIn(unittest.TestCase):
+    def setUp(self):
+        self.rib = rib.AdjRibIn()
+
+    def receive(self, *a, **kw):
+        # through the wire, as the session would decode it, sweeping once
+        # the UPDATE is applied
+        b = proto.Update(*a, **kw).encode()
+        changed = self.rib.apply(proto.Update.from_bytes(b, self.rib.interner))
+        self.rib.interner.sweep()
+        return changed
+
+    def test_ipv4(self):
+        changed = self.receive(nlri=['10.0.0.0/24', '10.0.1.0/24'], *attrs())
+        self.assertEqual(changed, [nlri.ipv4('10.0.0.0/24'), nlri.ipv4('10.0.1.0/24')])
+        self.receive(nlri=['10.0.2.0/24'], *attrs(5))
+
+        self.assertEqual(len(self.rib), 3)
+        a = self.rib.get('10.0.0.0/24')
+        self.failUnless(a is self.rib.get(nlri.ipv4('10.0.1.0/24')))
+        self.assertEqual(a['med'], 0)
+        self.assertEqual(self.rib.get('10.0.2.0/24')['med'], 5)
+        self.failIf('10.0.3.0/24' in self.rib)
+
+        self.assertEqual(sorted([str(p) for p, a in self.rib.routes()]), [
+            '10.0.0.0/24', '10.0.1.0/24', '10.0.2.0/24',
+            ])
+
+    def test_replace(self):
+        self.receive(nlri=['10.0.0.0/24'], *attrs())
+        self.receive(nlri=['10.0.0.0/24'], *attrs(5))
+
+        self.assertEqual(len(self.rib), 1)
+        self.assertEqual(self.rib.get('10.0.0.0/24')['med'], 5)
+        # the old attributes went with the last route using them
+        self.assertEqual(self.rib.stats()['sets'], 1)
+
+    def test_batch(self):
+        # UPDATEs decoded ahead of being applied keep sharing their sets
+        interner = self.rib.interner
+        decode = lambda up: proto.Update.from_bytes(up.encode(), interner)
+        first = decode(proto.Update(nlri=['10.0.0.0/24'], *attrs()))
+        second = decode(proto.Update(nlri=['10.0.1.0/24'], *attrs(5)))
+        self.rib.apply(first)
+        self.rib.apply(second)
+        interner.sweep()
+
+        third = decode(proto.Update(nlri=['10.0.2.0/24'], *attrs(5)))
+        self.failUnless(third.attrset is second.attrset)
+        self.rib.apply(third)
+        self.assertEqual(self.rib.stats()['sets'], 2)
+
+    def test_withdraw(self):
+        self.receive(nlri=['10.0.0.0/24', '10.0.1.0/24'], *attrs())
+
+        changed = self.receive(withdraw=['10.0.0.0/24', '10.9.0.0/24'])
+        self.assertEqual(changed, [nlri.ipv4('10.0.0.0/24')])
+        self.assertEqual(len(self.rib), 1)
+        self.assertEqual(self.rib.stats()['sets'], 1)
+
+        self.receive(withdraw=['10.0.1.0/24'])
+        self.assertEqual(len(self.rib), 0)
+        self.assertEqual(self.rib.stats()['sets'], 0)
+        self.assertEqual(self.rib.stats()['attrs'], 0)
+
+    def test_vpnv4(self):
+        prefix = nlri.vpnv4([100], '65000:1', '10.0.0.0/24')
+        reach = pathattr.MpReachNlri(dict(
+            afi=1, safi=128, nh='192.168.1.1', nlri=[prefix],
+            ))
+        a = [pathattr.Origin('igp'), pathattr.AsPath([[65000]]), reach]
+        self.assertEqual(self.receive(*a), [prefix])
+
+        aset, nh, labels = self.rib.get(prefix)
+        self.assertEqual(aset.keys(), ['origin', 'aspath'])
+        self.assertEqual(nh, '192.168.1.1')
+        self.assertEqual(labels, (100,))
+        self.assertEqual(list(self.rib.routes()), [(prefix, (aset, nh, labels))])
+
+        unreach = pathattr.MpUnreachNlri(dict(
+            afi=1, safi=128, withdraw=[nlri.vpnv4(None, '65000:1', '10.0.0.0/24')],
+            ))
+        self.receive(unreach)
+        self.assertEqual(len(self.rib), 0)
+
+    def test_flush(self):
+        self.receive(nlri=['10.0.0.0/24', '10.0.1.0/24'], *attrs())
+
+        dropped = self.rib.flush()
+        self.assertEqual(sorted(dropped), [nlri.ipv4('10.0.0.0/24'), nlri.ipv4('10.0.1.0/24')])
+        self.assertEqual(len(self.rib), 0)
+        self.assertEqual(self.rib.stats()['sets'], 0)
+
+    def test_stale(self):
+        self.receive(nlri=['10.0.0.0/24', '10.0.1.0/24', '10.0.2.0/24'], *attrs())
+        self.rib.mark_stale()
+        self.assertTrue(self.rib.is_stale('10.0.0.0/24'))
+
+        # sent again or withdrawn after the restart, a route is not stale
+        self.receive(nlri=['10.0.0.0/24'], *attrs(5))
+        self.receive(withdraw=['10.0.1.0/24'])
+        self.assertFalse(self.rib.is_stale('10.0.0.0/24'))
+        self.assertTrue(self.rib.is_stale('10.0.2.0/24'))
+
+        # the End-of-RIB marker drops the rest
+        changed = self.rib.apply(proto.Update.from_bytes(proto.end_of_rib().encode()))
+        self.assertEqual(changed, [nlri.ipv4('10.0.2.0/24')])
+        self.assertEqual([str(p) for p, v in self.rib.routes()], ['10.0.0.0/24'])
+        self.assertEqual(self.rib.stale, {})
+        self.assertEqual(self.rib.stats()['sets'], 1)
+
+    def test_sweep_family(self):
+        prefix = nlri.vpnv4([100], '65000:1', '10.0.0.0/24')
+        reach = pathattr.MpReachNlri(dict(
+            afi=1, safi=128, nh='192.168.1.1', nlri=[prefix],
+            ))
+        self.receive(pathattr.Origin('igp'), pathattr.AsPath([[65000]]), reach)
+        self.receive(nlri=['10.0.0.0/24'], *attrs())
+        self.rib.mark_stale()
+
+        # the IPv4 marker leaves vpnv4 routes stale
+        self.assertEqual(self.receive(), [nlri.ipv4('10.0.0.0/24')])
+        self.assertEqual(len(self.rib), 1)
+        self.assertEqual(self.rib.apply(proto.end_of_rib(1, 128)), [prefix])
+        self.assertEqual(len(self.rib), 0)
+
+        self.receive(nlri=['10.0.0.0/24'], *attrs())
+        self.rib.mark_stale(rib.IPV4)
+        self.assertEqual(self.rib.sweep(), [nlri.ipv4('10.0.0.0/24')])
+
+    def test_not_interned(self):
+        # decoded without the interner, the RIB interns the attributes
+        self.rib.apply(proto.Update(nlri=['10.0.0.0/24'], *attrs()))
+        self.assertEqual(self.rib.get('10.0.0.0/24')['med'], 0)
+        self.assertEqual(self.rib.stats()['sets'], 1)
+
+class TestAdjRibOut(unittest.TestCase):
+    def setUp(self):
+        self.rib = rib.AdjRibOut()
+        self.attrs = attrs()
+
+    def sent(self):
+        nlri = []
+        withdraw = []
+        for up in self.rib.updates():
+            nlri.extend([str(p) for p in up.nlri])
+            withdraw.extend([str(p) for p in up.withdraw])
+        return sorted(nlri), sorted(withdraw)
+
+    def test_delta(self):
+        self.rib.advertise('10.0.0.0/24', self.attrs)
+        self.rib.advertise('10.0.1.0/24', self.attrs)
+        self.assertEqual(self.sent(), (['10.0.0.0/24', '10.0.1.0/24'], []))
+        self.assertEqual(len(self.rib), 2)
+
+        # nothing pending, nothing sent
+        self.assertEqual(self.rib.updates(), [])
+
+        # only the change goes out; re-advertising the same attributes and
+        # withdrawing what was never sent are no-ops
+        self.rib.advertise('10.0.0.0/24', self.attrs)
+        self.rib.advertise('10.0.1.0/24', attrs())
+        self.rib.withdraw('10.0.2.0/24')
+        self.rib.advertise('10.0.3.0/24', self.attrs)
+        self.assertEqual(self.sent(), (['10.0.3.0/24'], []))
+
+        self.rib.withdraw('10.0.0.0/24')
+        self.rib.advertise('10.0.1.0/24', attrs(5))
+        self.assertEqual(self.sent(), (['10.0.1.0/24'], ['10.0.0.0/24']))
+        self.assertEqual(len(self.rib), 2)
+
+    def test_last_wins(self):
+        self.rib.advertise('10.0.0.0/24', self.attrs)
+        self.rib.withdraw('10.0.0.0/24')
+        self.assertEqual(self.sent(), ([], []))
+
+        self.rib.advertise('10.0.0.0/24', self.attrs)
+        self.sent()
+        self.rib.withdraw('10.0.0.0/24')
+        self.rib.advertise('10.0.0.0/24', self.attrs)
+        self.assertEqual(self.sent(), ([], []))
+
+    def test_vpnv4(self):
+        a = self.attrs
+        self.rib.advertise(nlri.vpnv4([100], '65000:1', '10.0.0.0/24'), a)
+        self.rib.advertise(nlri.vpnv4([100], '65000:2', '10.0.0.0/24'), a)
+        ups = self.rib.updates()
+        self.assertEqual(len(ups), 1)
+        self.assertEqual(len(ups[0].pathattr['mp-reach-nlri'].value['nlri']), 2)
+
+        # withdrawn without labels, by rd and prefix
+        self.rib.withdraw(nlri.vpnv4(None, '65000:1', '10.0.0.0/24'))
+        ups = self.rib.updates()
+        self.assertEqual(ups[0].pathattr['mp-unreach-nlri'].value['withdraw'],
+                [nlri.vpnv4(None, '65000:1', '10.0.0.0/24')])
+        self.assertEqual(len(self.rib), 1)
+
+    def test_resend(self):
+        self.rib.advertise('10.0.0.0/24', self.attrs)
+        self.rib.advertise('10.0.1.0/24', self.attrs)
+        self.sent()
+        self.rib.resend()
+        self.assertEqual(self.sent(), (['10.0.0.0/24', '10.0.1.0/24'], []))
+
+        self.rib.clear()
+        self.assertEqual(len(self.rib), 0)
+        self.rib.withdraw('10.0.0.0/24')
+        self.assertEqual(self.sent(), ([], []))
+
+    def test_resend_pending(self):
+        # a withdraw pending at the time is not undone by resending
+        self.rib.advertise('10.0.0.0/24', self.attrs)
+        self.rib.advertise('10.0.1.0/24', self.attrs)
+        self.sent()
+        self.rib.withdraw('10.0.0.0/24')
+        self.rib.resend()
+        self.assertEqual(self.sent(), (['10.0.1.0/24'], []))
+        self.assertEqual(len(self.rib), 1)
+
+    def test_replay(self):
+        for i in range(3):
+            self.rib.advertise('10.0.%d.0/24' % (i,), self.attrs)
+        self.rib.advertise('10.1.0.0/24', attrs(5))
+        self.rib.advertise(nlri.vpnv4([100], '65000:1', '10.0.0.0/24'), self.attrs)
+        self.sent()
+
+        bodies = self.rib.replay()
+        ups = [proto.Update.from_bytes(b) for b in bodies]
+        self.assertEqual(sorted([str(p) for up in ups for p in up.nlri]),
+                ['10.0.0.0/24', '10.0.1.0/24', '10.0.2.0/24', '10.1.0.0/24'])
+        self.assertEqual(len(self.rib.replay(rib.VPNV4)), 1)
+        self.assertEqual(len(self.rib.replay(None)), 3)
+
+        # kept until a route of the group changes
+        again = self.rib.replay()
+        self.assertEqual(sorted(map(id, again)), sorted(map(id, bodies)))
+
+        self.rib.withdraw('10.0.1.0/24')
+        self.sent()
+        again = self.rib.replay()
+        self.assertEqual(len([b for b in again if b in bodies]), 1)
+        ups = [proto.Update.from_bytes(b) for b in again]
+        self.assertEqual(sorted([str(p) for up in ups for p in up.nlri]),
+                ['10.0.0.0/24', '10.0.2.0/24', '10.1.0.0/24'])
+
+        # pending changes are not replayed until sent
+        self.rib.advertise('10.2.0.0/24', self.attrs)
+        self.assertEqual(len(self.rib.replay()), 2)
+
+        self.rib.clear()
+        self.assertEqual(self.rib.replay(None), [])
+
+class TestLocRib(unittest.TestCase):
+    def setUp(self):
+        self.rib = rib.LocRib()
+        self.rib.add_peer('192.168.0.1', '192.168.0.1', ebgp=True)
+        self.rib.add_peer('192.168.0.2', '192.168.0.2', ebgp=True)
+        self.rib.add_peer('192.168.0.3', '192.168.0.3')
+
+    def receive(self, peer, *a, **kw):
+        b = proto.Update(*a, **kw).encode()
+        return self.rib.apply(peer, proto.Update.from_bytes(b, self.rib.interner))
+
+    def announce(self, peer, aspath=[[65000]], nlri=['10.0.0.0/24'], **attrs):
+        a = [pathattr.Origin(attrs.get('origin', 'igp')), pathattr.AsPath(aspath),
+                pathattr.NextHop(peer)]
+        if 'med' in attrs:
+            a.append(pathattr.Med(attrs['med']))
+        if 'localpref' in attrs:
+            a.append(pathattr.LocalPref(attrs['localpref']))
+        if 'originator' in attrs:
+            a.append(pathattr.Originator(attrs['originator']))
+        if 'clusters' in attrs:
+            a.append(pathattr.ClusterList(attrs['clusters']))
+        return self.receive(peer, nlri=nlri, *a)
+
+    def best(self, prefix='10.0.0.0/24'):
+        peer, value = self.rib.get(prefix)
+        return peer.name
+
+    def test_as4_neighbour(self):
+        # both neighbour ASes show as AS_TRANS to a 2-byte session, but
+        # they differ, so MED is not compared between them
+        self.announce('192.168.0.1', aspath=[[4200000001]], med=20)
+        self.announce('192.168.0.2', aspath=[[4200000002]], med=10)
+        self.assertEqual(self.best(), '192.168.0.1')
+
+    def test_changes(self):
+        changes = self.announce('192.168.0.1', aspath=[[1, 2, 3]])
+        self.assertEqual([(str(p), peer.name) for p, peer, v in changes], [
+            ('10.0.0.0/24', '192.168.0.1'),
+            ])
+
+        # a shorter path wins
+        changes = self.announce('192.168.0.2', aspath=[[1, 2]])
+        self.assertEqual([(str(p), peer.name) for p, peer, v in changes], [
+            ('10.0.0.0/24', '192.168.0.2'),
+            ])
+
+        # a worse route changes nothing
+        self.assertEqual(self.announce('192.168.0.3', aspath=[[1, 2, 3, 4]]), [])
+
+        changes = self.receive('192.168.0.2', withdraw=['10.0.0.0/24'])
+        self.assertEqual([(str(p), peer.name) for p, peer, v in changes], [
+            ('10.0.0.0/24', '192.168.0.1'),
+            ])
+
+        self.rib.flush('192.168.0.1')
+        changes = self.rib.remove_peer('192.168.0.3')
+        self.assertEqual(changes, [(nlri.ipv4('10.0.0.0/24'), None, None)])
+        self.assertEqual(len(self.rib), 0)
+
+    def test_localpref(self):
+        self.announce('192.168.0.1', aspath=[[1]])
+        self.announce('192.168.0.3', aspath=[[1, 2, 3]], localpref=200)
+        self.assertEqual(self.best(), '192.168.0.3')
+
+    def test_origin(self):
+        self.announce('192.168.0.1', origin='incomplete')
+        self.announce('192.168.0.2', origin='egp')
+        self.assertEqual(self.best(), '192.168.0.2')
+
+    def test_med(self):
+        # MED decides between routes from the same neighbouring AS...
+        self.announce('192.168.0.1', aspath=[[1, 9]], med=20)
+        self.announce('192.168.0.2', aspath=[[1, 8]], med=10)
+        self.assertEqual(self.best(), '192.168.0.2')
+
+        # ...but not across them; the lower peer address wins instead
+        self.announce('192.168.0.2', aspath=[[2, 8]], med=10)
+        self.assertEqual(self.best(), '192.168.0.1')
+
+    def test_ebgp(self):
+        self.announce('192.168.0.3')
+        self.announce('192.168.0.2')
+        self.assertEqual(self.best(), '192.168.0.2')
+
+    def test_originator(self):
+        self.announce('192.168.0.1', originator='10.0.0.9')
+        self.announce('192.168.0.2', originator='10.0.0.2')
+        self.assertEqual(self.best(), '192.168.0.2')
+
+    def test_clusters(self):
+        self.announce('192.168.0.1', originator='10.0.0.2', clusters=['1.1.1.1', '2.2.2.2'])
+        self.announce('192.168.0.2', originator='10.0.0.2', clusters=['1.1.1.1'])
+        self.assertEqual(self.best(), '192.168.0.2')
+
+    def test_graceful_restart(self):
+        self.announce('192.168.0.1', aspath=[[1]], nlri=['10.0.0.0/24', '10.0.1.0/24'])
+        self.announce('192.168.0.2', aspath=[[1, 2]], nlri=['10.0.0.0/24', '10.0.1.0/24'])
+
+        # the stale routes stay best while the peer restarts...
+        self.rib.mark_stale('192.168.0.1')
+        self.assertEqual(self.best(), '192.168.0.1')
+        self.assertEqual(self.announce('192.168.0.1', aspath=[[1]]), [])
+
+        # ...and only those not sent again move on End-of-RIB
+        changes = self.receive('192.168.0.1')
+        self.assertEqual([(str(p), peer.name) for p, peer, v in changes], [
+            ('10.0.1.0/24', '192.168.0.2'),
+            ])
+        self.assertEqual(self.best(), '192.168.0.1')
+
+    def test_incremental(self):
+        self.announce('192.168.0.1', nlri=['10.0.%d.0/24' % (i,) for i in range(10)])
+        changes = self.announce('192.168.0.2', aspath=[[1, 2]],
+                nlri=['10.0.3.0/24', '10.0.4.0/24'])
+        self.assertEqual(changes, [])
+        self.assertEqual(len(self.rib), 10)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+
+import struct
+import unittest
+
+from pybgp import proto, session, exceptions, pathattr, nlri, rib
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def keepalive():
+    return '\xff'*16 + '\x00\x13\x04'
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.session = session.Session(clock=self.clock)
+
+    def test_open(self):
+        self.session.open(0xaabb, '192.168.1.1', holdtime=255)
+
+        out = self.session.data_to_send()
+        self.assertEqual(out, [
+            '\xff'*16 + '\x00\x1d\x01' + '\x04\xaa\xbb\x00\xff\xc0\xa8\x01\x01\x00',
+            ])
+
+        # the queue is drained
+        self.assertEqual(self.session.data_to_send(), [])
+
+    def test_bad_open(self):
+        # a 4byteas capability cut short is an OPEN message error
+        body = '\x04\x00\x01\x00\xb4\x01\x01\x01\x01\x04\x02\x02\x41\x00'
+        self.session.receive_data('\xff'*16 + chr(0) + chr(19+len(body)) + '\x01' + body)
+
+        self.failUnless(self.session.closing)
+        self.failUnless(isinstance(self.session.reason, exceptions.BadOpen))
+        self.assertEqual(self.session.data_to_send(), ['\xff'*16 + '\x00\x15\x03\x02\x00'])
+
+    def test_keepalive_consumed(self):
+        msgs = self.session.receive_data(keepalive()*3)
+
+        self.assertEqual(msgs, [])
+        self.failIf(self.session.closing)
+        self.assertEqual(len(self.session.buffer), 0)
+
+    def test_notify(self):
+        msgs = self.session.receive_data('\xee'*16 + '\x00\x13\x04')
+
+        self.assertEqual(msgs, [])
+        self.failUnless(self.session.closing)
+        self.failUnless(isinstance(self.session.reason, exceptions.NotSync))
+        self.assertEqual(self.session.data_to_send(), [
+            '\xff'*16 + '\x00\x15\x03\x01\x01',
+            ])
+
+        # nothing more is sent or decoded once closing
+        self.session.send(proto.Keepalive())
+        self.assertEqual(self.session.receive_data(keepalive()), [])
+        self.assertEqual(self.session.data_to_send(), [])
+
+    def test_no_timers(self):
+        self.assertEqual(self.session.next_deadline(), None)
+
+        self.session.open(1, '192.168.1.1', holdtime=0)
+        self.session.start_timer(90)
+        self.assertEqual(self.session.next_deadline(), None)
+
+    def test_timers(self):
+        self.session.open(1, '192.168.1.1', holdtime=90)
+        self.session.data_to_send()
+
+        # the peer offered a shorter hold time
+        self.session.start_timer(30)
+        self.assertEqual(self.session.next_deadline(), 1000.0)
+
+        self.session.tick()
+        self.assertEqual(self.session.data_to_send(), [keepalive()])
+        self.assertEqual(self.session.next_deadline(), 1015.0)
+
+        # a message from the peer pushes the hold timer out
+        self.clock.now = 1020.0
+        self.session.receive_data(keepalive())
+        self.assertEqual(self.session.expiry_at, 1050.0)
+
+        self.session.tick()
+        self.assertEqual(self.session.data_to_send(), [keepalive()])
+        self.assertEqual(self.session.next_deadline(), 1035.0)
+
+        self.clock.now = 1050.0
+        self.session.tick()
+        self.failUnless(self.session.closing)
+        self.assertEqual(self.session.reason, 'hold timer expired')
+        self.assertEqual(self.session.next_deadline(), None)
+
+class TestExtendedMessage(unittest.TestCase):
+    def peer_open(self, *caps):
+        open = proto.Open('192.168.1.2', 2, holdtime=90)
+        for c in caps:
+            open.caps[c] = ['']
+        body = open.encode()
+        return session.HEADER.pack(session.MARKER, 19+len(body), 1) + body
+
+    def update(self, length):
+        # an UPDATE carrying nothing but an unrecognised attribute
+        vlen = length - 19 - 4 - 4
+        attr = '\xd0\xfe' + struct.pack('!H', vlen) + '\x00'*vlen
+        body = '\x00\x00' + struct.pack('!H', len(attr)) + attr
+        return session.HEADER.pack(session.MARKER, 19+len(body), 2) + body
+
+    def setUp(self):
+        self.session = session.Session()
+
+    def test_negotiated(self):
+        self.session.open(1, '192.168.1.1', **{'extended-message': ['']})
+        self.assertEqual(self.session.max_len, session.MAX_LEN)
+
+        msgs = self.session.receive_data(
+                self.peer_open('extended-message') + self.update(20000))
+
+        self.failIf(self.session.closing)
+        self.assertEqual(self.session.max_len, session.MAX_EXTENDED_LEN)
+        self.assertEqual(len(msgs), 2)
+
+    def test_not_negotiated(self):
+        self.session.open(1, '192.168.1.1', **{'extended-message': ['']})
+
+        self.session.receive_data(self.peer_open() + self.update(20000))
+
+        self.failUnless(self.session.closing)
+        self.failUnless(isinstance(self.session.reason, exceptions.BadLen))
+
+    def test_send_limit(self):
+        self.session.open(1, '192.168.1.1')
+        self.session.receive_data(self.peer_open('extended-message'))
+
+        self.assertRaises(Exception, self.session.send,
+                proto.Notification(6, 0, '\x00'*5000))
+
+class TestAsn4(unittest.TestCase):
+    def peer_open(self, asn4):
+        open = proto.Open('192.168.1.2', 2, holdtime=90)
+        if asn4:
+            open.caps['4byteas'] = [2]
+        body = open.encode()
+        return session.HEADER.pack(session.MARKER, 19+len(body), 1) + body
+
+    def update(self):
+        return proto.Update(
+                pathattr.Origin('igp'),
+                pathattr.AsPath([[4200000000]]),
+                nlri=['10.0.0.0/24'],
+                )
+
+    def exchange(self, asn4):
+        s = session.Session()
+        s.open(4200000000, '192.168.1.1')
+        s.receive_data(self.peer_open(asn4))
+        s.data_to_send()
+
+        s.send(self.update())
+        return s, ''.join(s.data_to_send())[19:]
+
+    def test_open(self):
+        s = session.Session()
+        s.open(4200000000, '192.168.1.1')
+
+        open = proto.Open.from_bytes(''.join(s.data_to_send())[19:])
+        self.assertEqual(open.asnum, pathattr.AS_TRANS)
+        self.assertEqual(open.caps['4byteas'], [4200000000])
+
+    def test_negotiated(self):
+        s, body = self.exchange(True)
+        self.failUnless(s.asn4)
+
+        up = proto.Update.from_bytes(body, None, True)
+        self.assertEqual(up.pathattr.keys(), ['origin', 'aspath'])
+        self.assertEqual(up.pathattr['aspath'], [[4200000000]])
+
+        # and the peer's UPDATEs are decoded the same way
+        msgs = s.receive_data(session.HEADER.pack(session.MARKER, 19+len(body), 2) + body)
+        self.assertEqual(msgs[0].pathattr['aspath'], [[4200000000]])
+
+    def test_not_negotiated(self):
+        s, body = self.exchange(False)
+        self.failIf(s.asn4)
+
+        up = proto.Update.from_bytes(body)
+        self.assertEqual(up.pathattr.keys(), ['origin', 'aspath', 'as4path'])
+        self.assertEqual(up.pathattr['aspath'], [[pathattr.AS_TRANS]])
+
+        up.reconcile()
+        self.assertEqual(up, self.update())
+
+class TestRouteRefresh(unittest.TestCase):
+    def setUp(self):
+        self.ribout = rib.AdjRibOut()
+        attrs = [pathattr.Origin('igp'), pathattr.AsPath([[1]]), pathattr.NextHop('192.168.1.1')]
+        for i in range(3):
+            self.ribout.advertise('10.0.%d.0/24' % (i,), attrs)
+        self.ribout.updates()
+
+        self.session = session.Session()
+        self.session.ribout = self.ribout
+
+    def open(self, *caps):
+        self.session.open(1, '192.168.1.1', **dict([(c, ['']) for c in caps]))
+        open = proto.Open('192.168.1.2', 2, holdtime=90)
+        for c in caps:
+            open.caps[c] = ['']
+        body = open.encode()
+        self.session.receive_data(session.HEADER.pack(session.MARKER, 19+len(body), 1) + body)
+        self.session.data_to_send()
+
+    def refresh(self, afi=1, safi=1):
+        body = proto.RouteRefresh(afi, safi).encode()
+        msgs = self.session.receive_data(session.HEADER.pack(session.MARKER, 23, 5) + body)
+        self.assertEqual([m.kind for m in msgs], ['refresh'])
+
+        peer = session.Session()
+        return peer.receive_data(''.join(self.session.data_to_send()))
+
+    def test_replay(self):
+        self.open('refresh')
+        msgs = self.refresh()
+        self.assertEqual([m.kind for m in msgs], ['update'])
+        self.assertEqual(sorted([str(p) for p in msgs[0].nlri]),
+                ['10.0.0.0/24', '10.0.1.0/24', '10.0.2.0/24'])
+
+        # nothing sent of other families
+        self.assertEqual(self.refresh(1, 128), [])
+
+    def test_enhanced(self):
+        self.open('refresh', 'enhanced-refresh')
+        msgs = self.refresh()
+        self.assertEqual([(m.kind, getattr(m, 'subtype', None)) for m in msgs], [
+            ('refresh', proto.RouteRefresh.BORR),
+            ('update', None),
+            ('refresh', proto.RouteRefresh.EORR),
+            ])
+
+    def test_graceful_restart(self):
+        self.assertEqual(self.session.graceful_restart, None)
+        gr = dict(restart=False, time=90, families=[(1, 1, True)])
+        self.session.open(1, '192.168.1.1', **{'graceful-restart': [gr]})
+        open = proto.Open('192.168.1.2', 2, holdtime=90)
+        open.caps['graceful-restart'] = [gr]
+        body = open.encode()
+        self.session.receive_data(session.HEADER.pack(session.MARKER, 19+len(body), 1) + body)
+        self.assertEqual(self.session.graceful_restart, gr)
+
+    def test_bad_length(self):
+        self.session.receive_data(session.HEADER.pack(session.MARKER, 22, 5) + '\x00\x01\x00')
+        self.failUnless(self.session.closing)
+        self.failUnless(isinstance(self.session.reason, exceptions.BadRefreshLen))
+
+class TestSplit(unittest.TestCase):
+    def test_split(self):
+        s = session.Session()
+
+        prefixes = ['10.%d.%d.0/24' % (i >> 8, i & 0xff) for i in range(2000)]
+        s.send(proto.Update(pathattr.Origin('igp'), nlri=prefixes))
+
+        # too big for one message, so it goes out as two
+        out = s.data_to_send()
+        self.assertEqual(len(out), 2)
+
+        peer = session.Session()
+        msgs = peer.receive_data(''.join(out))
+        self.failIf(peer.closing)
+        self.assertEqual(
+                msgs[0].nlri + msgs[1].nlri,
+                [nlri.ipv4(p) for p in prefixes],
+                )
+
+if __name__=='__main__':
+    unittest.main()
@@ -19,6 +19,10 @@ class FakeTransport:
     def write(self, b):
         self.value.write(b)
 
+    def writeSequence(self, seq):
+        for b in seq:
+            self.value.write(b)
+
     def loseConnection(self):
         self.closed = True
 
@@ -173,6 +177,20 @@ class TestSpeakerGood(unittest.TestCase):
         self.proto.handle_msg = self.msgs.append
         self.proto.makeConnection(FakeTransport())
 
+    def test_protobase(self):
+        # still a ProtoBase, whose decoding settings reach the session
+        class Lazy(speaker.BGP):
+            update_class = proto.LazyUpdate
+
+        p = Lazy()
+        p.handle_msg = self.msgs.append
+        p.makeConnection(FakeTransport())
+        self.failUnless(isinstance(p, proto.ProtoBase))
+
+        p.dataReceived(self.update_w())
+        self.failUnless(isinstance(self.msgs[0], proto.LazyUpdate))
+        self.assertEqual(p.parse_payload(4, '').kind, 'keepalive')
+
     def test_one(self):
         msg = self.open()
 
@@ -221,3 +239,47 @@ class TestSpeakerGood(unittest.TestCase):
                 ])
 
 
+    def test_handle_msgs(self):
+        batches = []
+        self.proto.handle_msgs = batches.append
+
+        self.proto.dataReceived(self.open() + self.update_w())
+        self.proto.dataReceived(self.update_w())
+
+        self.failIf(self.proto.transport.closed)
+
+        # handle_msg is bypassed
+        self.assertEqual(self.msgs, [])
+        self.assertEqual([len(b) for b in batches], [2, 1])
+        self.failUnless(isinstance(batches[0][0], proto.Open))
+        self.failUnless(isinstance(batches[0][1], proto.Update))
+
+    def test_send_many(self):
+        self.proto.send_many([
+            proto.Keepalive(),
+            proto.Update(withdraw=['10.0.0.0/8']),
+            proto.Keepalive(),
+            ])
+
+        keepalive = '\xff'*16 + '\x00\x13\x04'
+        update = '\xff'*16 + '\x00\x19\x02\x00\x02\x08\x0a\x00\x00'
+
+        self.assertEqual(
+                self.proto.transport.reply(),
+                keepalive + update + keepalive,
+                )
+
+    def test_split(self):
+        msgs = self.open() + self.update_w()
+
+        # deliver the two messages a few bytes at a time
+        for i in range(0, len(msgs), 7):
+            self.proto.dataReceived(msgs[i:i+7])
+
+        self.failIf(self.proto.transport.closed)
+
+        self.failUnless(len(self.msgs)==2)
+        self.failUnless(self.proto.buffer=='')
+
+        self.failUnless(isinstance(self.msgs[0], proto.Open))
+        self.failUnless(isinstance(self.msgs[1], proto.Update))
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from pybgp import nlri, trie
+
+class TestTrie(unittest.TestCase):
+    def setUp(self):
+        self.t = trie.Trie()
+        for p in ('10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '10.2.0.0/16',
+                '192.168.0.0/24', '0.0.0.0/0'):
+            self.t[p] = p
+
+    def test_mapping(self):
+        self.assertEqual(len(self.t), 6)
+        self.assertEqual(self.t['10.1.0.0/16'], '10.1.0.0/16')
+        self.assertEqual(self.t[nlri.ipv4('10.1.2.0/24')], '10.1.2.0/24')
+        self.assertTrue('10.2.0.0/16' in self.t)
+        self.assertFalse('10.3.0.0/16' in self.t)
+        # a junction node holds no value
+        self.assertFalse('10.0.0.0/14' in self.t)
+        self.assertRaises(KeyError, lambda: self.t['10.0.0.0/14'])
+        self.assertEqual(self.t.get('11.0.0.0/8'), None)
+
+        self.t['10.1.0.0/16'] = 'x'
+        self.assertEqual(self.t['10.1.0.0/16'], 'x')
+        self.assertEqual(len(self.t), 6)
+
+        self.assertEqual([str(p) for p in self.t], [
+            '0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24',
+            '10.2.0.0/16', '192.168.0.0/24',
+            ])
+
+    def test_delete(self):
+        del self.t['10.1.0.0/16']
+        self.assertFalse('10.1.0.0/16' in self.t)
+        self.assertEqual(self.t['10.1.2.0/24'], '10.1.2.0/24')
+        self.assertRaises(KeyError, self.t.__delitem__, '10.1.0.0/16')
+        self.assertEqual(self.t.pop('10.2.0.0/16'), '10.2.0.0/16')
+        self.assertEqual(self.t.pop('10.2.0.0/16', None), None)
+        self.assertEqual(len(self.t), 4)
+
+        for p in list(self.t):
+            del self.t[p]
+        self.assertEqual(len(self.t), 0)
+        self.assertEqual(self.t.nodes(), 1)
+
+    def test_lookup(self):
+        p, v = self.t.lookup('10.1.2.3')
+        self.assertEqual(v, '10.1.2.0/24')
+        self.assertEqual(self.t.lookup('10.1.3.1')[1], '10.1.0.0/16')
+        self.assertEqual(self.t.lookup('10.200.0.1')[1], '10.0.0.0/8')
+        self.assertEqual(self.t.lookup('11.0.0.1')[1], '0.0.0.0/0')
+        self.assertEqual(self.t.lookup('10.1.2.0/23')[1], '10.1.0.0/16')
+
+        del self.t['0.0.0.0/0']
+        self.assertEqual(self.t.lookup('11.0.0.1'), None)
+
+    def test_covering(self):
+        self.assertEqual([v for p, v in self.t.covering('10.1.2.3')], [
+            '0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24',
+            ])
+        self.assertEqual([v for p, v in self.t.covering('10.1.0.0/16')], [
+            '0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16',
+            ])
+
+    def test_covered(self):
+        self.assertEqual([v for p, v in self.t.covered('10.0.0.0/8')], [
+            '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '10.2.0.0/16',
+            ])
+        self.assertEqual([v for p, v in self.t.covered('10.0.0.0/14')], [
+            '10.1.0.0/16', '10.1.2.0/24', '10.2.0.0/16',
+            ])
+        self.assertEqual(list(self.t.covered('10.3.0.0/16')), [])
+        self.assertEqual(list(self.t.covered('172.16.0.0/12')), [])
+
+    def test_random(self):
+        # against a dict and linear scans
+        rand = random.Random(1)
+        t = trie.Trie()
+        d = {}
+        for i in range(3000):
+            masklen = rand.randrange(33)
+            ip = rand.getrandbits(32) & trie.MASKS[masklen] & 0xff00ffff
+            p = nlri.ipv4.from_int(ip, masklen)
+            if p in d and rand.random() < 0.5:
+                del t[p]
+                del d[p]
+            else:
+                t[p] = i
+                d[p] = i
+        self.assertEqual(len(t), len(d))
+        self.assertEqual(t.items(), sorted(d.items()))
+        self.assertTrue(t.nodes() < 2 * len(d) + 1)
+
+        def holds(p, ip, masklen):
+            return p.masklen <= masklen and ip & trie.MASKS[p.masklen]==p.ip
+
+        for i in range(100):
+            masklen = rand.randrange(33)
+            ip = rand.getrandbits(32) & trie.MASKS[masklen] & 0xff00ffff
+            q = nlri.ipv4.from_int(ip, masklen)
+
+            covering = sorted([(p.masklen, p) for p in d if holds(p, ip, masklen)])
+            self.assertEqual([p for p, v in t.covering(q)], [p for l, p in covering])
+            covered = sorted([p for p in d if holds(q, p.ip, p.masklen)])
+            self.assertEqual([p for p, v in t.covered(q)], covered)
+
+class TestVpnTrie(unittest.TestCase):
+    def test_vpn(self):
+        t = trie.VpnTrie()
+        t[nlri.vpnv4([100], '65000:1', '10.0.0.0/8')] = 'a'
+        t[nlri.vpnv4([101], '65000:1', '10.1.0.0/16')] = 'b'
+        t[nlri.vpnv4([102], '65000:2', '10.0.0.0/8')] = 'c'
+        self.assertEqual(len(t), 3)
+
+        # labels do not matter
+        self.assertEqual(t[nlri.vpnv4(None, '65000:1', '10.1.0.0/16')], 'b')
+        self.assertEqual(t.lookup('65000:1', '10.1.2.3'),
+                (nlri.vpnv4(None, '65000:1', '10.1.0.0/16'), 'b'))
+        self.assertEqual(t.lookup('65000:2', '10.1.2.3')[1], 'c')
+        self.assertEqual(t.lookup('65000:3', '10.1.2.3'), None)
+        self.assertEqual([v for p, v in t.covered('65000:1', '10.0.0.0/8')], ['a', 'b'])
+        self.assertEqual([v for p, v in t.covering('65000:1', '10.1.0.0/16')], ['a', 'b'])
+        self.assertEqual(list(t.covered('65000:3', '10.0.0.0/8')), [])
+
+        del t[nlri.vpnv4(None, '65000:2', '10.0.0.0/8')]
+        self.assertEqual(sorted(t.tries), ['65000:1'])
+        self.assertEqual(len(t), 2)
+        self.assertFalse(nlri.vpnv4(None, '65000:2', '10.0.0.0/8') in t)
+        self.assertEqual([v for p, v in t.items()], ['a', 'b'])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,428 @@
+import array
+import socket
+import struct
+
+from pybgp import nlri
+
+_I = struct.Struct('!I')
+
+# a node without a value, as for the root and the nodes where branches meet
+_EMPTY = object()
+
+def _masks():
+    return [(0xffffffff << (32 - n)) & 0xffffffff for n in range(33)]
+
+MASKS = _masks()
+
+def _prefix(prefix):
+    """(ip, masklen) of an nlri.ipv4 or prefix string, host bits cleared."""
+    if isinstance(prefix, str):
+        prefix = nlri.ipv4(prefix)
+    return prefix.ip & MASKS[prefix.masklen], prefix.masklen
+
+def _address(addr):
+    if isinstance(addr, str):
+        if '/' in addr:
+            return _prefix(addr)
+        return _I.unpack(socket.inet_aton(addr))[0], 32
+    if isinstance(addr, nlri.ipv4):
+        return _prefix(addr)
+    return addr, 32
+
+class Trie(object):
+    """A Patricia trie of IPv4 prefixes, for longest-prefix match.
+
+    Behaves as a mapping from nlri.ipv4 (or prefix strings) to values; on
+    top of that lookup() finds the most specific prefix holding an address,
+    covering() every prefix holding it, and covered() every prefix within
+    an aggregate, each in a walk of at most 32 nodes.
+
+    Branches with nothing between them are collapsed, so there are fewer
+    than two nodes per prefix. Nodes live in flat arrays indexed by node
+    number rather than as objects: the prefix as a 4-byte int and a mask
+    length byte, two 4-byte child numbers, and a value slot of the list
+    holding the values. That comes to at most 2 x 21 bytes a prefix, and
+    a million-prefix table stays within 48 MiB plus whatever the values
+    take themselves (nothing, when they are shared). Node 0 is the root,
+    0.0.0.0/0, so child number 0 means no child. Deleted nodes are reused.
+    """
+
+    __slots__ = ('_key', '_len', '_left', '_right', '_values', '_free', '_count')
+
+    def __init__(self, items=()):
+        self._key = array.array('I', [0])
+        self._len = array.array('B', [0])
+        self._left = array.array('i', [0])
+        self._right = array.array('i', [0])
+        self._values = [_EMPTY]
+        self._free = []
+        self._count = 0
+
+        for prefix, value in items:
+            self[prefix] = value
+
+    def __len__(self):
+        return self._count
+
+    def nodes(self):
+        """How many nodes are in use, the root included."""
+        return len(self._values) - len(self._free)
+
+    def _node(self, key, masklen, value, left=0, right=0):
+        if self._free:
+            n = self._free.pop()
+            self._key[n] = key
+            self._len[n] = masklen
+            self._left[n] = left
+            self._right[n] = right
+            self._values[n] = value
+            return n
+
+        self._key.append(key)
+        self._len.append(masklen)
+        self._left.append(left)
+        self._right.append(right)
+        self._values.append(value)
+        return len(self._values) - 1
+
+    def _link(self, parent, child):
+        # children hang on the side of the first bit past the parent's mask
+        if (self._key[child] >> (31 - self._len[parent])) & 1:
+            self._right[parent] = child
+        else:
+            self._left[parent] = child
+
+    def __setitem__(self, prefix, value):
+        ip, masklen = _prefix(prefix)
+        self.insert(ip, masklen, value)
+
+    def insert(self, ip, masklen, value):
+        """Store a value under the prefix given as ints; "ip" must have no
+        bits set past "masklen"."""
+        key = self._key
+        lens = self._len
+        left = self._left
+        right = self._right
+
+        node = 0
+        while True:
+            nlen = lens[node]
+            if nlen==masklen:
+                if self._values[node] is _EMPTY:
+                    self._count += 1
+                self._values[node] = value
+                return
+
+            if (ip >> (31 - nlen)) & 1:
+                child = right[node]
+            else:
+                child = left[node]
+
+            if not child:
+                self._link(node, self._node(ip, masklen, value))
+                self._count += 1
+                return
+
+            clen = lens[child]
+            common = 32 - (ip ^ key[child]).bit_length()
+            if common >= clen and clen <= masklen:
+                node = child
+                continue
+
+            common = min(common, clen, masklen)
+            if common==masklen:
+                # the new prefix goes between node and child
+                new = self._node(ip, masklen, value)
+                self._link(new, child)
+            else:
+                # a node where the two branches meet, with both below it
+                new = self._node(ip & MASKS[common], common, _EMPTY)
+                self._link(new, child)
+                self._link(new, self._node(ip, masklen, value))
+            self._link(node, new)
+            self._count += 1
+            return
+
+    def _find(self, ip, masklen):
+        """The node for exactly this prefix, value or not, or -1."""
+        key = self._key
+        lens = self._len
+
+        node = 0
+        while True:
+            nlen = lens[node]
+            if nlen >= masklen:
+                if nlen==masklen and key[node]==ip:
+                    return node
+                return -1
+            if (ip >> (31 - nlen)) & 1:
+                node = self._right[node]
+            else:
+                node = self._left[node]
+            if not node or key[node]!=ip & MASKS[lens[node]]:
+                return -1
+
+    def __getitem__(self, prefix):
+        ip, masklen = _prefix(prefix)
+        n = self._find(ip, masklen)
+        if n < 0 or self._values[n] is _EMPTY:
+            raise KeyError(prefix)
+        return self._values[n]
+
+    def get(self, prefix, default=None):
+        try:
+            return self[prefix]
+        except KeyError:
+            return default
+
+    def __contains__(self, prefix):
+        ip, masklen = _prefix(prefix)
+        n = self._find(ip, masklen)
+        return n >= 0 and self._values[n] is not _EMPTY
+
+    def __delitem__(self, prefix):
+        ip, masklen = _prefix(prefix)
+        if not self.remove(ip, masklen):
+            raise KeyError(prefix)
+
+    def pop(self, prefix, *default):
+        ip, masklen = _prefix(prefix)
+        n = self._find(ip, masklen)
+        if n < 0 or self._values[n] is _EMPTY:
+            if default:
+                return default[0]
+            raise KeyError(prefix)
+        value = self._values[n]
+        self.remove(ip, masklen)
+        return value
+
+    def remove(self, ip, masklen):
+        """Drop the prefix given as ints; returns whether it was there."""
+        key = self._key
+        lens = self._len
+        left = self._left
+        right = self._right
+
+        path = []
+        node = 0
+        while lens[node] < masklen:
+            path.append(node)
+            if (ip >> (31 - lens[node])) & 1:
+                node = right[node]
+            else:
+                node = left[node]
+            if not node or key[node]!=ip & MASKS[lens[node]]:
+                return False
+        if lens[node]!=masklen or key[node]!=ip or self._values[node] is _EMPTY:
+            return False
+
+        self._values[node] = _EMPTY
+        self._count -= 1
+
+        # take out the node, and its parent if that is left a bare junction
+        # of one branch; the root always stays
+        while node and self._values[node] is _EMPTY and not (left[node] and right[node]):
+            parent = path.pop()
+            child = left[node] or right[node]
+            if right[parent]==node:
+                right[parent] = child
+            else:
+                left[parent] = child
+            left[node] = right[node] = 0
+            self._free.append(node)
+            node = parent
+
+        return True
+
+    def clear(self):
+        self.__init__()
+
+    def lookup(self, addr, default=None):
+        """The (prefix, value) of the most specific prefix holding "addr",
+        an address (string or int) or prefix, or "default" if none does."""
+        ip, masklen = _address(addr)
+        key = self._key
+        lens = self._len
+        values = self._values
+
+        best = -1
+        node = 0
+        while True:
+            nlen = lens[node]
+            if nlen > masklen or key[node]!=ip & MASKS[nlen]:
+                break
+            if values[node] is not _EMPTY:
+                best = node
+            if nlen==32:
+                break
+            if (ip >> (31 - nlen)) & 1:
+                node = self._right[node]
+            else:
+                node = self._left[node]
+            if not node:
+                break
+
+        if best < 0:
+            return default
+        return nlri.ipv4.from_int(key[best], lens[best]), values[best]
+
+    def covering(self, addr):
+        """Every (prefix, value) holding "addr", an address or prefix
+        (which counts as holding itself), least specific first."""
+        ip, masklen = _address(addr)
+        key = self._key
+        lens = self._len
+        values = self._values
+
+        node = 0
+        while True:
+            nlen = lens[node]
+            if nlen > masklen or key[node]!=ip & MASKS[nlen]:
+                return
+            if values[node] is not _EMPTY:
+                yield nlri.ipv4.from_int(key[node], nlen), values[node]
+            if nlen==32:
+                return
+            if (ip >> (31 - nlen)) & 1:
+                node = self._right[node]
+            else:
+                node = self._left[node]
+            if not node:
+                return
+
+    def covered(self, prefix):
+        """Every (prefix, value) within "prefix", itself included, in
+        address then mask length order."""
+        ip, masklen = _prefix(prefix)
+        key = self._key
+        lens = self._len
+
+        # down to the first node at or below the prefix
+        node = 0
+        while lens[node] < masklen:
+            if (ip >> (31 - lens[node])) & 1:
+                node = self._right[node]
+            else:
+                node = self._left[node]
+            if not node:
+                return
+        if key[node] & MASKS[masklen]!=ip:
+            return
+
+        for item in self._walk(node):
+            yield item
+
+    def _walk(self, node):
+        key = self._key
+        lens = self._len
+        left = self._left
+        right = self._right
+        values = self._values
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if values[node] is not _EMPTY:
+                yield nlri.ipv4.from_int(key[node], lens[node]), values[node]
+            if right[node]:
+                stack.append(right[node])
+            if left[node]:
+                stack.append(left[node])
+
+    def items(self):
+        return list(self._walk(0))
+
+    def iteritems(self):
+        return self._walk(0)
+
+    def keys(self):
+        return [p for p, v in self._walk(0)]
+
+    def values(self):
+        return [v for p, v in self._walk(0)]
+
+    def __iter__(self):
+        for p, v in self._walk(0):
+            yield p
+
+class VpnTrie(object):
+    """Tries of vpnv4 routes, one per route distinguisher.
+
+    A mapping from nlri.vpnv4 (only the rd and prefix count, not the
+    labels) to values; lookup(), covering() and covered() take the rd
+    along with the address or prefix, and yield nlri.vpnv4 without labels.
+    """
+
+    __slots__ = ('tries', '_count')
+
+    def __init__(self):
+        self.tries = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __setitem__(self, route, value):
+        t = self.tries.get(route.rd)
+        if t is None:
+            t = self.tries[route.rd] = Trie()
+        before = len(t)
+        t[route.prefix] = value
+        self._count += len(t) - before
+
+    def __getitem__(self, route):
+        t = self.tries.get(route.rd)
+        if t is None:
+            raise KeyError(route)
+        return t[route.prefix]
+
+    def get(self, route, default=None):
+        try:
+            return self[route]
+        except KeyError:
+            return default
+
+    def __contains__(self, route):
+        t = self.tries.get(route.rd)
+        return t is not None and route.prefix in t
+
+    def __delitem__(self, route):
+        t = self.tries.get(route.rd)
+        if t is None:
+            raise KeyError(route)
+        del t[route.prefix]
+        self._count -= 1
+        if not t:
+            del self.tries[route.rd]
+
+    def _routes(self, rd, items):
+        for p, v in items:
+            yield nlri.vpnv4(None, rd, p.prefix), v
+
+    def lookup(self, rd, addr, default=None):
+        t = self.tries.get(rd)
+        if t is None:
+            return default
+        rv = t.lookup(addr)
+        if rv is None:
+            return default
+        p, v = rv
+        return nlri.vpnv4(None, rd, p.prefix), v
+
+    def covering(self, rd, addr):
+        t = self.tries.get(rd)
+        if t is None:
+            return iter(())
+        return self._routes(rd, t.covering(addr))
+
+    def covered(self, rd, prefix):
+        t = self.tries.get(rd)
+        if t is None:
+            return iter(())
+        return self._routes(rd, t.covered(prefix))
+
+    def items(self):
+        rv = []
+        for rd in sorted(self.tries):
+            rv.extend(self._routes(rd, self.tries[rd].iteritems()))
+        return rv